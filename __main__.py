@@ -1,6 +1,10 @@
 #!/usr/bin/env python3.6
+import atexit
+import json
 import logging
 import logging.config
+import logging.handlers
+import queue
 import sys
 import time
 from functools import wraps
@@ -8,7 +12,7 @@ from functools import wraps
 from clinner.command import Type, command
 from clinner.run import Main as ClinnerMain
 
-from bot.bot import TelegramBot
+from bot.utils import Lazy
 
 DONATE_TEXT = '''
 This project is free and open sourced, you can use it, spread the word, contribute to the codebase and help us donating:
@@ -33,6 +37,43 @@ class UTCFormatter(logging.Formatter):
     converter = time.gmtime
 
 
+class JSONFormatter(UTCFormatter):
+    """
+    Formats each record as a JSON object, properly escaping message and traceback.
+    """
+
+    def format(self, record):
+        data = {
+            'timestamp': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'file': record.filename,
+            'line': record.lineno,
+            'message': record.getMessage(),
+        }
+
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+
+        return json.dumps(data)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues records so lazy arguments and tracebacks are rendered by the listener thread instead of the caller.
+
+    Plain arguments may change before the listener handles the record, so messages without lazy arguments are
+    formatted right away. Lazy arguments must bind the values they render when they are created.
+    """
+
+    def prepare(self, record):
+        args = record.args if isinstance(record.args, tuple) else ()
+        if not any(isinstance(arg, Lazy) for arg in args):
+            record.msg = record.getMessage()
+            record.args = None
+
+        return record
+
+
 class Main(ClinnerMain):
     LOGGING = {
         'version': 1,
@@ -47,14 +88,7 @@ class Main(ClinnerMain):
                 'datefmt': '%Y-%m-%d %H:%M:%S',
             },
             'json': {
-                '()': UTCFormatter,
-                'format': '{'
-                          '"timestamp":"%(asctime)s",'
-                          '"level":"%(levelname)s",'
-                          '"file":"%(filename)s",'
-                          '"line":%(lineno)d,'
-                          '"message":"%(message)s"'
-                          '}',
+                '()': JSONFormatter,
                 'datefmt': '%Y-%m-%d %H:%M:%S',
             },
             'plain': {
@@ -92,6 +126,14 @@ class Main(ClinnerMain):
                 'level': 'DEBUG',
                 'maxBytes': 10 * (2 ** 20),
                 'backupCount': 5
+            },
+            'json_file': {
+                'class': 'logging.handlers.RotatingFileHandler',
+                'filename': 'logs/base.json.log',
+                'formatter': 'json',
+                'level': 'INFO',
+                'maxBytes': 10 * (2 ** 20),
+                'backupCount': 5
             }
         },
         'loggers': {
@@ -101,7 +143,7 @@ class Main(ClinnerMain):
                 'propagate': False
             },
             'bot': {
-                'handlers': ['console', 'base_file'],
+                'handlers': ['console', 'base_file', 'json_file'],
                 'level': 'DEBUG',
                 'propagate': False
             }
@@ -113,18 +155,58 @@ class Main(ClinnerMain):
         }
     }
 
+    # Handlers run in a background thread fed through a queue, so callers never block on disk or console I/O
+    LOGGING_QUEUE = True
+
     def __init__(self):
         super().__init__()
 
         logging.config.dictConfig(self.LOGGING)
 
+        if self.LOGGING_QUEUE:
+            self._queue_logging()
+
+    def _queue_logging(self):
+        """
+        Move handlers of every configured logger to a QueueListener, leaving a DeferredQueueHandler in their place.
+        """
+        loggers = [logging.getLogger(name) for name in self.LOGGING['loggers']] + [logging.getLogger()]
+
+        for logger in loggers:
+            log_queue = queue.Queue(-1)
+            listener = logging.handlers.QueueListener(log_queue, *logger.handlers, respect_handler_level=True)
+            logger.handlers = [DeferredQueueHandler(log_queue)]
+            listener.start()
+            atexit.register(listener.stop)
+
 
 @command(command_type=Type.PYTHON,
          args=((('-c', '--config-file'), {'help': 'Config file', 'default': 'config/setup.cfg'}),),
          parser_opts={'help': 'Telegram bot'})
 @donate
 def start(*args, **kwargs):
-    TelegramBot(config=kwargs['config_file']).run()
+    # Imported here so the CLI starts without loading Telegram, DB and HTTP libraries
+    from bot.bot import TelegramBot, run_bots
+
+    run_bots(TelegramBot.from_config(config=kwargs['config_file']))
+
+
+@command(command_type=Type.PYTHON,
+         args=((('--chats',), {'help': 'Synthetic chats', 'type': int, 'default': 100}),
+               (('--apis',), {'help': 'Synthetic APIs, spread across chats', 'type': int, 'default': 200}),
+               (('--sweeps',), {'help': 'Runs of every job', 'type': int, 'default': 5}),
+               (('--jobs',), {'help': 'Jobs to run: sweep, nanopool, wallet (waits 1s per chat), digest',
+                              'nargs': '+', 'default': ['sweep', 'nanopool']}),
+               (('--failure-rate',), {'help': 'Ratio of checks reporting a stopped service', 'type': float,
+                                      'default': 0.05}),
+               (('--error-rate',), {'help': 'Ratio of API requests failing', 'type': float, 'default': 0.01}),
+               (('--latency',), {'help': 'Mean API latency in seconds', 'type': float, 'default': 0.0})),
+         parser_opts={'help': 'Run bot jobs against a synthetic fleet served by a local fake Barrenero API'})
+def loadtest(*args, **kwargs):
+    from bot.loadtest import run
+
+    run(chats=kwargs['chats'], apis=kwargs['apis'], sweeps=kwargs['sweeps'], jobs=kwargs['jobs'],
+        failure_rate=kwargs['failure_rate'], error_rate=kwargs['error_rate'], latency=kwargs['latency'])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3.6
+"""
+Handler and job query times with a large number of APIs, before and after schema indexes.
+
+Seeds a temporary database with given number of APIs, then times the queries used by handlers and jobs at the initial
+schema version and at the latest one.
+
+Usage: python benchmarks/db_queries.py [--apis N] [--chats N] [--repeat N] [--url DATABASE_URL]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.migrations import migrate, migrations  # noqa
+from bot.models import API, Chat, configure_db, db  # noqa
+
+
+def seed(chats: int, apis: int):
+    with db.atomic():
+        Chat.insert_many([{'id': i} for i in range(chats)]).execute()
+
+        rows = [{'name': f'api_{i}', 'url': f'http://rig{i}.local', 'token': f'{i:040x}', 'superuser': i % 4 == 0,
+                 'chat': i % chats} for i in range(apis)]
+        for i in range(0, len(rows), 500):
+            API.insert_many(rows[i:i + 500]).execute()
+
+
+def queries(chats: int, apis: int):
+    return {
+        'sweep: superuser APIs join chat': lambda: list(API.select().where(API.superuser == True).join(Chat)),
+        'handler: chat apis': lambda: list(Chat.get(id=random.randrange(chats)).apis),
+        'handler: api by id': lambda: API.get(id=random.randrange(1, apis)),
+        'handler: api by chat and url': lambda: API.get_or_none(chat=random.randrange(chats),
+                                                                url=f'http://rig{random.randrange(apis)}.local'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--apis', type=int, default=100000, help='APIs seeded')
+    parser.add_argument('--chats', type=int, default=10000, help='Chats seeded')
+    parser.add_argument('--repeat', type=int, default=20, help='Runs per query')
+    parser.add_argument('--url', default=None, help='Empty database to use instead of a temporary SQLite file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        configure_db(args.url or f'sqlite:///{os.path.join(directory, "benchmark.db")}')
+        db.connect()
+
+        # Initial schema, without indexes
+        migrate(1)
+        seed(args.chats, args.apis)
+
+        results = {}
+        for label, target in (('initial', 1), ('latest', len(migrations))):
+            migrate(target)
+            for name, query in queries(args.chats, args.apis).items():
+                results.setdefault(name, {})[label] = timeit.timeit(query, number=args.repeat) / args.repeat * 1e3
+
+        db.close()
+
+    print(f'{args.apis} APIs, {args.chats} chats (ms per query)')
+    print(f'{"query":<36} {"initial":>10} {"latest":>10}')
+    for name, times in results.items():
+        print(f'{name:<36} {times["initial"]:>10.3f} {times["latest"]:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3.6
+"""
+Import time of the container entrypoint, checked against a budget.
+
+Runs `__main__.py --help` with `-X importtime` in a fresh interpreter and reports the slowest top level imports.
+Exits with error if total import time exceeds the budget.
+
+Usage: python benchmarks/import_time.py [--budget MS] [--top N] [--module MODULE]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--budget', type=float, default=150.0, help='Max import time (ms)')
+    parser.add_argument('--top', type=int, default=10, help='Slowest imports shown')
+    parser.add_argument('--module', default=None, help='Import this module instead of running the entrypoint')
+    args = parser.parse_args()
+
+    if args.module:
+        command = [sys.executable, '-X', 'importtime', '-c', f'import {args.module}']
+    else:
+        command = [sys.executable, '-X', 'importtime', os.path.join(ROOT, '__main__.py'), '--help']
+
+    result = subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+
+    # Top level imports are the ones with a single space of indentation
+    imports = [(int(m.group(2)), m.group(4)) for m in map(IMPORT_LINE.match, result.stderr.splitlines())
+               if m and len(m.group(3)) == 1]
+    total = sum(t for t, _ in imports) / 1000
+
+    for cumulative, name in sorted(imports, reverse=True)[:args.top]:
+        print(f'{cumulative / 1000:>10.1f} ms  {name}')
+    print(f'{total:>10.1f} ms  total (budget {args.budget:.1f} ms)')
+
+    return 0 if total <= args.budget else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
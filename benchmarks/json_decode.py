@@ -0,0 +1,87 @@
+#!/usr/bin/env python3.6
+"""
+Decode time and bytes on the wire for Barrenero API payloads, for every available JSON backend.
+
+Payloads mimic the ones served by a Barrenero API for a rig with several graphic cards and Storj nodes.
+
+Usage: python benchmarks/json_decode.py [--nodes N] [--repeat N]
+"""
+import argparse
+import gzip
+import importlib
+import json
+import os
+import sys
+import timeit
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.utils import JSON_BACKENDS  # noqa
+
+
+def ether_payload(cards=8):
+    return {
+        'active': True,
+        'hashrate': [{'graphic_card': i, 'hashrate': 29.87 + i} for i in range(cards)],
+        'nanopool': {
+            'balance': {'confirmed': 0.12345678},
+            'hashrate': {'current': 240.1, 'one_hour': 238.2, 'three_hours': 239.9, 'six_hours': 240.3,
+                         'twelve_hours': 240.0, 'twenty_four_hours': 239.7},
+            'last_payment': {'date': '2018-01-10T10:00:00Z', 'value': 0.2},
+            'workers': {f'worker_{i}': 240.0 for i in range(4)},
+        },
+    }
+
+
+def storj_payload(nodes=200):
+    return [{
+        'id': i, 'status': 'running', 'uptime': '10d 2h', 'restarts': 0, 'shared': '1.2 TB', 'shared_percent': 40,
+        'data_received': '100 GB', 'peers': 120, 'allocs': 10, 'delta': 12, 'config_path': f'/storj/node_{i}.json',
+        'response_time': 123.45, 'reputation': 4800, 'version': '8.4.0',
+    } for i in range(nodes)]
+
+
+def wallet_payload(transactions=100):
+    return {
+        'tokens': {'eth': {'name': 'Ether', 'balance': 1.5, 'symbol': 'ETH', 'balance_usd': 1200.0},
+                   'storj': {'name': 'Storj', 'balance': 300, 'symbol': 'STORJ', 'balance_usd': 400.0}},
+        'transactions': [{'token': {'name': 'Ether', 'symbol': 'ETH'}, 'hash': f'0x{i:064x}',
+                          'source': f'0x{i:040x}', 'value': 0.2, 'timestamp': '2018-01-10T10:00:00Z'}
+                         for i in range(transactions)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--nodes', type=int, default=200, help='Storj nodes in payload')
+    parser.add_argument('--repeat', type=int, default=200, help='Decodes per measure')
+    args = parser.parse_args()
+
+    payloads = {
+        'ether': json.dumps(ether_payload()).encode(),
+        'storj': json.dumps(storj_payload(args.nodes)).encode(),
+        'wallet': json.dumps(wallet_payload()).encode(),
+    }
+
+    backends = {}
+    for name in JSON_BACKENDS:
+        try:
+            backends[name] = importlib.import_module(name).loads
+        except ImportError:
+            pass
+
+    print(f'{"payload":<8} {"identity":>10} {"gzip":>10} {"deflate":>10}')
+    for name, body in payloads.items():
+        print(f'{name:<8} {len(body):>10d} {len(gzip.compress(body)):>10d} {len(zlib.compress(body)):>10d}')
+
+    print()
+    print(f'{"payload":<8} ' + ' '.join(f'{b:>12}' for b in backends) + '  (us per decode)')
+    for name, body in payloads.items():
+        times = [timeit.timeit(lambda: loads(body), number=args.repeat) / args.repeat * 1e6
+                 for loads in backends.values()]
+        print(f'{name:<8} ' + ' '.join(f'{t:>12.1f}' for t in times))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import math
+import threading
+from typing import Dict, Hashable, Iterable, List, NamedTuple, Tuple
+
+from bot.payloads import GraphicCardsHashrate
+
+__all__ = ['Anomaly', 'CardBaselines', 'HashrateDetector']
+
+
+class Anomaly(NamedTuple):
+    card: int
+    hashrate: float
+    baseline: float
+
+
+class CardBaselines:
+    """
+    Exponentially weighted mean and variance of the hashrate of every graphic card in a rig, in lists aligned with
+    card ids so a whole sample is processed in a single pass and memory does not grow with samples. Rigs hold a
+    handful of cards, so a plain loop over them is cheaper than vector operations.
+    """
+    __slots__ = ('cards', 'means', 'variances', 'anomalous', 'samples')
+
+    def __init__(self, cards: Iterable[int]):
+        self.cards = tuple(cards)
+        self.means = [0.0] * len(self.cards)
+        self.variances = [0.0] * len(self.cards)
+        self.anomalous = [False] * len(self.cards)
+        self.samples = 0
+
+    def __repr__(self):
+        return f'CardBaselines{{cards={list(self.cards)}, means={list(self.means)}, samples={self.samples}}}'
+
+
+class HashrateDetector:
+    """
+    Detects graphic cards whose hashrate deviates from their own baseline, which a rig level active flag misses.
+
+    A card is anomalous when its hashrate is more than `threshold` standard deviations and more than `min_deviation`
+    (relative) away from its mean. Baseline is not updated while a card is anomalous, so a degraded card is reported
+    once and again when it recovers.
+    """
+
+    def __init__(self, alpha: float = 0.1, threshold: float = 4.0, min_deviation: float = 0.15, warmup: int = 10):
+        self.alpha = alpha
+        self.threshold = threshold
+        self.min_deviation = min_deviation
+        self.warmup = warmup
+        self._baselines = {}  # type: Dict[Hashable, CardBaselines]
+        self._lock = threading.Lock()
+
+    def update(self, key: Hashable, sample: GraphicCardsHashrate) -> Tuple[List[Anomaly], List[Anomaly]]:
+        """
+        Feed a hashrate sample of a rig. Returns cards that became anomalous and cards that recovered.
+        """
+        with self._lock:
+            baselines = self._baselines.get(key)
+            if baselines is None or baselines.cards != tuple(sample.cards):
+                # Cards changed, so previous baselines are meaningless
+                baselines = self._baselines[key] = CardBaselines(sample.cards)
+
+            return self._update(baselines, sample.hashrates)
+
+    def _update(self, baselines: CardBaselines, hashrates: Iterable[float]) -> Tuple[List[Anomaly], List[Anomaly]]:
+        alpha, threshold, min_deviation = self.alpha, self.threshold, self.min_deviation
+        means, variances, anomalous, cards = baselines.means, baselines.variances, baselines.anomalous, baselines.cards
+        warm = baselines.samples >= self.warmup
+        first = baselines.samples == 0
+        detected, recovered = [], []
+
+        for i, value in enumerate(hashrates):
+            mean = means[i]
+            diff = value - mean
+
+            if warm:
+                deviation = abs(diff)
+                is_anomalous = deviation > threshold * math.sqrt(variances[i]) and deviation > min_deviation * mean
+                if is_anomalous and not anomalous[i]:
+                    detected.append(Anomaly(cards[i], value, mean))
+                elif not is_anomalous and anomalous[i]:
+                    recovered.append(Anomaly(cards[i], value, mean))
+                anomalous[i] = is_anomalous
+
+                if is_anomalous:
+                    continue
+
+            if first:
+                means[i] = value
+            else:
+                increment = alpha * diff
+                means[i] = mean + increment
+                variances[i] = (1 - alpha) * (variances[i] + diff * increment)
+
+        baselines.samples += 1
+
+        return detected, recovered
+
+    def forget(self, key: Hashable):
+        with self._lock:
+            self._baselines.pop(key, None)
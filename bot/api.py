@@ -1,37 +1,333 @@
+import hashlib
 import logging
-from typing import Any, Dict, List, Union
+import threading
+import time
+from concurrent.futures import TimeoutError
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
 
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
 
-from bot.exceptions import BarreneroRequestException
+from bot.exceptions import BarreneroDeadlineException, BarreneroRequestException, BarreneroResponseException
+from bot.health import HealthTracker
+from bot.payloads import Ether, Payload, Status, Storj, Wallet
+from bot.retry import RetryPolicy
+from bot.scheduling import FairExecutor
+from bot.utils import get_json_loads
+
+try:
+    import ijson
+except ImportError:  # pragma: no cover
+    ijson = None
 
 logger = logging.getLogger(__name__)
 
 
+class CacheEntry(NamedTuple):
+    etag: Optional[str]
+    last_modified: Optional[str]
+    digest: Optional[bytes]
+    payload: Payload
+    fetched: float
+
+
+class ResponseCache:
+    """
+    Validators and parsed payload of the last response for every (url, path, token), used to issue conditional
+    requests and to avoid parsing bodies that did not change.
+    """
+
+    def __init__(self):
+        self._entries = {}  # type: Dict[Tuple[str, str, str], CacheEntry]
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[CacheEntry]:
+        with self._lock:
+            return self._entries.get(key)
+
+    def set(self, key: Tuple[str, str, str], entry: CacheEntry):
+        with self._lock:
+            self._entries[key] = entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @staticmethod
+    def conditional_headers(entry: Optional[CacheEntry]) -> Dict[str, str]:
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        return headers
+
+
+class Deadline:
+    """
+    Time budget for a whole operation. Every request made on its behalf gets the remaining time as timeout instead of
+    the default one, so retries and sequential requests never exceed the budget.
+    """
+    __slots__ = ('expires',)
+
+    def __init__(self, budget: float):
+        self.expires = time.monotonic() + budget
+
+    @property
+    def remaining(self) -> float:
+        return max(self.expires - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires
+
+    def expire(self):
+        """
+        Run out of time right away, so pending requests on behalf of this deadline are not made.
+        """
+        self.expires = time.monotonic()
+
+    def timeout(self, default: Tuple[float, float]) -> Tuple[float, float]:
+        """
+        Default (connect, read) timeout bounded by remaining time.
+        """
+        remaining = self.remaining
+        if remaining <= 0.0:
+            raise BarreneroDeadlineException('Barrenero API did not respond in time')
+
+        connect, read = default
+        return min(connect, remaining), min(read, remaining)
+
+    def __repr__(self):
+        return f'Deadline{{remaining={self.remaining:.2f}}}'
+
+
+class Snapshot:
+    """
+    Payloads retrieved from several endpoints of a single Barrenero API. Accessing an endpoint that failed raises the
+    exception raised while requesting it.
+    """
+    __slots__ = ('url', 'payloads', 'errors')
+
+    def __init__(self, url: str):
+        self.url = url
+        self.payloads = {}  # type: Dict[str, Payload]
+        self.errors = {}  # type: Dict[str, BarreneroRequestException]
+
+    def __getitem__(self, endpoint: str) -> Payload:
+        if endpoint in self.errors:
+            raise self.errors[endpoint]
+
+        return self.payloads[endpoint]
+
+    def __contains__(self, endpoint: str):
+        return endpoint in self.payloads or endpoint in self.errors
+
+    def __repr__(self):
+        return f'Snapshot{{{self.url}, ok={sorted(self.payloads)}, errors={sorted(self.errors)}}}'
+
+
+def tracked(func):
+    """
+    Record latency and result of requests in Barrenero health tracker.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        base_url = kwargs['base_url'] if 'base_url' in kwargs else args[0]
+        start = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except BarreneroDeadlineException as e:
+            # Running out of a caller budget says nothing about API health, unless the API itself timed out
+            if isinstance(e.__cause__, (requests.Timeout, urllib3.exceptions.TimeoutError)):
+                Barrenero.health.record(base_url, time.monotonic() - start, ok=False)
+            raise
+        except BarreneroRequestException:
+            Barrenero.health.record(base_url, time.monotonic() - start, ok=False)
+            raise
+
+        Barrenero.health.record(base_url, time.monotonic() - start, ok=True)
+        return result
+
+    return wrapper
+
+
+def _session(pool_size: int) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
 class Barrenero:
     timeout = (3, 30)
+    accept_encoding = 'gzip, deflate'
+    json_loads = staticmethod(get_json_loads())
+    stream = False
+    cache = ResponseCache()
+    interactive_budget = 3.0
+    health = HealthTracker()
+    retry = RetryPolicy()
+    pool_size = 16
+    session = _session(pool_size)
+    # Requests are queued by the chat they are made for. Jobs work for every chat, so they get several turns per round
+    background_weight = 4
+    executor = FairExecutor(max_workers=pool_size, weights={None: background_weight})
+    batch = False
+    batch_path = '/api/v1/batch/'
+    _batch_unsupported = set()
+    endpoints = {
+        'status': ('/api/v1/status/', Status.from_json),
+        'ether': ('/api/v1/ether/', Ether.from_json),
+        'storj': ('/api/v1/storj/', Storj.from_json),
+        'wallet': ('/api/v1/wallet/', Wallet.from_json),
+    }
 
     @staticmethod
-    def _get(base_url: str, path: str, token: str) -> Union[List[Any], Dict[str, Any]]:
+    @tracked
+    def _get(base_url: str, path: str, token: str, parser: Callable[[Any], Payload] = None,
+             deadline: Deadline = None, fresh: bool = False) -> Union[List[Any], Dict[str, Any], Payload]:
+        """
+        Request given path. If a parser is given, the parsed payload is cached and requests are made conditional, so
+        an unchanged resource returns the very same payload object than the previous call. A fresh request ignores
+        cached payload and always parses the response.
+        """
+        key = (base_url, path, token)
+        entry = Barrenero.cache.get(key) if parser and not fresh else None
+
         try:
             url = base_url + path
-            headers = {'Authorization': f'Token {token}'}
+            headers = {'Authorization': f'Token {token}', 'Accept-Encoding': Barrenero.accept_encoding,
+                       **ResponseCache.conditional_headers(entry)}
+
+            timeout = deadline.timeout(Barrenero.timeout) if deadline else Barrenero.timeout
+
+            with Barrenero.session.get(url=url, headers=headers, timeout=timeout) as response:
+                if entry is not None and response.status_code == 304:
+                    Barrenero.cache.set(key, entry._replace(fetched=time.time()))
+                    return entry.payload
 
-            with requests.get(url=url, headers=headers, timeout=Barrenero.timeout) as response:
                 response.raise_for_status()
-                result = response.json()
+
+                if parser is None:
+                    return Barrenero.json_loads(response.content)
+
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+                digest = None
+                if not etag and not last_modified:
+                    # Server does not send validators so compare bodies
+                    digest = hashlib.blake2b(response.content, digest_size=16).digest()
+                    if entry is not None and entry.digest == digest:
+                        Barrenero.cache.set(key, entry._replace(fetched=time.time()))
+                        return entry.payload
+
+                result = parser(Barrenero.json_loads(response.content))
+        except requests.Timeout as e:
+            if deadline is not None:
+                # Budget left does not fit a longer timeout, so waiting again cannot succeed either
+                raise BarreneroDeadlineException('Barrenero API did not respond in time') from e
+            raise BarreneroRequestException('Cannot request Barrenero API') from e
         except requests.RequestException as e:
             raise BarreneroRequestException('Cannot request Barrenero API') from e
+        except ValueError as e:
+            raise BarreneroResponseException('Wrong response from Barrenero API') from e
+
+        Barrenero.cache.set(key, CacheEntry(etag, last_modified, digest, result, time.time()))
+
+        return result
+
+    @staticmethod
+    @tracked
+    def _get_stream(base_url: str, path: str, token: str, parser: Callable[[Any], Payload],
+                    deadline: Deadline = None, fresh: bool = False) -> Payload:
+        """
+        Request a JSON array and feed its items to given parser while they are being downloaded, so the whole body
+        is never held in memory. Only server validators are used for caching, as the body is never complete.
+        """
+        key = (base_url, path, token)
+        entry = Barrenero.cache.get(key) if not fresh else None
+
+        try:
+            url = base_url + path
+            headers = {'Authorization': f'Token {token}', 'Accept-Encoding': Barrenero.accept_encoding,
+                       **ResponseCache.conditional_headers(entry)}
+
+            timeout = deadline.timeout(Barrenero.timeout) if deadline else Barrenero.timeout
+
+            with Barrenero.session.get(url=url, headers=headers, timeout=timeout, stream=True) as response:
+                if entry is not None and response.status_code == 304:
+                    Barrenero.cache.set(key, entry._replace(fetched=time.time()))
+                    return entry.payload
+
+                response.raise_for_status()
+                response.raw.decode_content = True
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+                result = parser(ijson.items(response.raw, 'item'))
+        # Body is read from the raw urllib3 response, whose errors are not wrapped by requests
+        except (requests.Timeout, urllib3.exceptions.TimeoutError) as e:
+            if deadline is not None:
+                # Budget left does not fit a longer timeout, so waiting again cannot succeed either
+                raise BarreneroDeadlineException('Barrenero API did not respond in time') from e
+            raise BarreneroRequestException('Cannot request Barrenero API') from e
+        except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
+            raise BarreneroRequestException('Cannot request Barrenero API') from e
+        except ijson.JSONError as e:
+            raise BarreneroResponseException('Wrong response from Barrenero API') from e
+
+        Barrenero.cache.set(key, CacheEntry(etag, last_modified, None, result, time.time()))
 
         return result
 
     @staticmethod
-    def _post(base_url: str, path: str, token: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    def configure(timeout=None, json_backend: str = None, stream: bool = None, pool_size: int = None,
+                  batch: bool = None, interactive_budget: float = None, retries: int = None,
+                  retry_backoff: float = None):
+        """
+        Tune client behavior from settings.
+        """
+        if timeout is not None:
+            Barrenero.timeout = timeout
+
+        if interactive_budget is not None:
+            Barrenero.interactive_budget = interactive_budget
+
+        if retries is not None:
+            Barrenero.retry.retries = retries
+
+        if retry_backoff is not None:
+            Barrenero.retry.backoff = retry_backoff
+
+        if pool_size is not None and pool_size != Barrenero.pool_size:
+            Barrenero.pool_size = pool_size
+            Barrenero.session = _session(pool_size)
+            Barrenero.executor = FairExecutor(max_workers=pool_size, weights={None: Barrenero.background_weight})
+
+        if batch is not None:
+            Barrenero.batch = batch
+
+        if json_backend is not None:
+            Barrenero.json_loads = staticmethod(get_json_loads(json_backend))
+
+        if stream is not None:
+            Barrenero.stream = stream and ijson is not None
+
+    @staticmethod
+    def _post(base_url: str, path: str, token: str, data: Dict[str, Any], idempotency_key: str = None) \
+            -> Dict[str, Any]:
         try:
             url = base_url + path
             headers = {'Authorization': f'Token {token}'}
+            if idempotency_key:
+                headers['Idempotency-Key'] = idempotency_key
 
-            with requests.post(url=url, headers=headers, data=data, timeout=Barrenero.timeout) as response:
+            with Barrenero.session.post(url=url, headers=headers, data=data, timeout=Barrenero.timeout) as response:
                 response.raise_for_status()
                 result = response.json()
         except requests.RequestException as e:
@@ -39,6 +335,164 @@ class Barrenero:
 
         return result
 
+    @staticmethod
+    def _batch(base_url: str, token: str, endpoints: List[str], deadline: Deadline = None) -> Optional[Snapshot]:
+        """
+        Request several endpoints through the batch endpoint. Returns None if the API does not support batching or
+        its response is not an object, so endpoints are requested one by one instead. Every payload is cached as if
+        requested alone, so it can be served stale later.
+
+        Batch endpoint receives `{"paths": [<path>, ...]}` and responds with the body of every path: `{<path>: <body>}`.
+        """
+        try:
+            url = base_url + Barrenero.batch_path
+            headers = {'Authorization': f'Token {token}', 'Accept-Encoding': Barrenero.accept_encoding}
+            paths = [Barrenero.endpoints[e][0] for e in endpoints]
+            timeout = deadline.timeout(Barrenero.timeout) if deadline else Barrenero.timeout
+
+            with Barrenero.session.post(url=url, headers=headers, json={'paths': paths}, timeout=timeout) as response:
+                if response.status_code in (404, 405, 501):
+                    logger.info('Barrenero API %s does not support batch requests', base_url)
+                    Barrenero._batch_unsupported.add(base_url)
+                    return None
+
+                response.raise_for_status()
+                bodies = Barrenero.json_loads(response.content)
+        except requests.Timeout as e:
+            if deadline is not None:
+                raise BarreneroDeadlineException('Barrenero API did not respond in time') from e
+            raise BarreneroRequestException('Cannot request Barrenero API') from e
+        except requests.RequestException as e:
+            raise BarreneroRequestException('Cannot request Barrenero API') from e
+        except ValueError as e:
+            raise BarreneroResponseException('Wrong response from Barrenero API') from e
+
+        if not isinstance(bodies, dict):
+            logger.warning('Barrenero API %s sent a wrong batch response, requesting endpoints one by one', base_url)
+            return None
+
+        snapshot = Snapshot(base_url)
+        for endpoint, path in zip(endpoints, paths):
+            try:
+                snapshot.payloads[endpoint] = Barrenero.endpoints[endpoint][1](bodies[path])
+                Barrenero.cache.set((base_url, path, token),
+                                    CacheEntry(None, None, None, snapshot.payloads[endpoint], time.time()))
+            except KeyError:
+                snapshot.errors[endpoint] = BarreneroResponseException('Wrong response from Barrenero API')
+            except BarreneroRequestException as e:
+                snapshot.errors[endpoint] = e
+
+        return snapshot
+
+    @staticmethod
+    def hedged(apis: Iterable[Any], func: Callable[[Any], Payload], deadline: Deadline = None) -> Payload:
+        """
+        Call func with the healthiest API from given ones, hedging slow calls and falling back to other APIs. If a
+        deadline is given, the whole call, hedges and fallbacks included, must finish before it.
+        """
+        try:
+            return Barrenero.health.call(apis, func, Barrenero.executor,
+                                         timeout=deadline.remaining if deadline is not None else None)
+        except IndexError as e:
+            raise BarreneroRequestException('No Barrenero API available') from e
+        except TimeoutError as e:
+            raise BarreneroDeadlineException('Barrenero API did not respond in time') from e
+
+    @staticmethod
+    def deadline(budget: float = None) -> Deadline:
+        """
+        Deadline for a request made while an user waits for the answer.
+        """
+        return Deadline(budget if budget is not None else Barrenero.interactive_budget)
+
+    @staticmethod
+    def fetch(url: str, token: str, endpoint: str, deadline: Deadline = None, fresh: bool = False) -> Payload:
+        """
+        Retrieve a single endpoint by name, retrying transient failures. A fresh fetch bypasses the response cache.
+        """
+        path, parser = Barrenero.endpoints[endpoint]
+        get = Barrenero._get_stream if Barrenero.stream and endpoint == 'storj' else Barrenero._get
+
+        return Barrenero.retry.call(
+            lambda: get(base_url=url, path=path, token=token, parser=parser, deadline=deadline, fresh=fresh),
+            deadline=deadline)
+
+    @staticmethod
+    def fetch_or_stale(url: str, token: str, endpoint: str, deadline: Deadline = None) \
+            -> Tuple[Payload, Optional[float]]:
+        """
+        Retrieve a single endpoint within an interactive deadline. If the deadline passes, last payload retrieved is
+        returned instead along with its age in seconds, or None as age if it is fresh.
+        """
+        deadline = deadline or Barrenero.deadline()
+
+        # Waiting for the future bounds the whole fetch, retries included, to the deadline
+        future = Barrenero.executor.submit(Barrenero.fetch, url, token, endpoint, deadline)
+        try:
+            return future.result(timeout=deadline.remaining), None
+        except (BarreneroDeadlineException, TimeoutError):
+            entry = Barrenero.cache.get((url, Barrenero.endpoints[endpoint][0], token))
+            if entry is None:
+                raise BarreneroDeadlineException('Barrenero API did not respond in time')
+
+            logger.info('Barrenero API %s did not respond in time, using stale %s data', url, endpoint)
+            return entry.payload, time.time() - entry.fetched
+
+    @staticmethod
+    def hedged_or_stale(apis: Iterable[Any], endpoint: str, deadline: Deadline = None) \
+            -> Tuple[Payload, Optional[float]]:
+        """
+        Retrieve a single endpoint from the healthiest of given APIs within an interactive deadline. If the deadline
+        passes, freshest payload retrieved from any of them is returned instead along with its age in seconds, or
+        None as age if it is fresh.
+        """
+        apis = list(apis)
+        deadline = deadline or Barrenero.deadline()
+
+        try:
+            payload = Barrenero.hedged(
+                apis, lambda api: Barrenero.fetch(api.url, api.token, endpoint, deadline=deadline), deadline=deadline)
+            return payload, None
+        except BarreneroDeadlineException:
+            path = Barrenero.endpoints[endpoint][0]
+            entries = [e for e in (Barrenero.cache.get((api.url, path, api.token)) for api in apis) if e is not None]
+            if not entries:
+                raise
+
+            entry = max(entries, key=lambda e: e.fetched)
+            logger.info('Barrenero APIs did not respond in time, using stale %s data', endpoint)
+            return entry.payload, time.time() - entry.fetched
+
+    @staticmethod
+    def fetch_many(api, endpoints: Iterable[str], deadline: Deadline = None) -> Snapshot:
+        """
+        Retrieve several endpoints from a single Barrenero API, using the batch endpoint if enabled and supported or
+        concurrent requests over pooled connections otherwise.
+        """
+        endpoints = list(endpoints)
+
+        if Barrenero.batch and len(endpoints) > 1 and api.url not in Barrenero._batch_unsupported:
+            try:
+                snapshot = Barrenero._batch(api.url, api.token, endpoints, deadline)
+            except BarreneroRequestException as e:
+                snapshot = Snapshot(api.url)
+                snapshot.errors.update({endpoint: e for endpoint in endpoints})
+
+            if snapshot is not None:
+                return snapshot
+
+        futures = {endpoint: Barrenero.executor.submit(Barrenero.fetch, api.url, api.token, endpoint, deadline)
+                   for endpoint in endpoints}
+
+        snapshot = Snapshot(api.url)
+        for endpoint, future in futures.items():
+            try:
+                snapshot.payloads[endpoint] = future.result()
+            except BarreneroRequestException as e:
+                snapshot.errors[endpoint] = e
+
+        return snapshot
+
     @staticmethod
     def get_token_or_register(url: str, username: str, password: str, account: str=None, api_password: str=None) \
             -> Dict[str, Any]:
@@ -46,13 +500,13 @@ class Barrenero:
             # Try to register user
             register_url = f'{url}/api/v1/auth/register/'
             data = {'username': username, 'password': password, 'account': account, 'api_password': api_password}
-            with requests.post(url=register_url, data=data, timeout=Barrenero.timeout) as response_register:
+            with Barrenero.session.post(url=register_url, data=data, timeout=Barrenero.timeout) as response_register:
                 # If user is registered, try to get token using username and password
                 if response_register.status_code == 409:
                     login_url = f'{url}/api/v1/auth/user/'
                     data = {'username': username, 'password': password}
 
-                    with requests.post(url=login_url, data=data, timeout=Barrenero.timeout) as response_user:
+                    with Barrenero.session.post(url=login_url, data=data, timeout=Barrenero.timeout) as response_user:
                         response_user.raise_for_status()
                         payload = response_user.json()
                 else:
@@ -69,21 +523,27 @@ class Barrenero:
         return config
 
     @staticmethod
-    def miner(url: str, token: str) -> Dict[str, Any]:
-        return Barrenero._get(base_url=url, path='/api/v1/status/', token=token)
+    def miner(url: str, token: str, deadline: Deadline = None) -> Status:
+        return Barrenero.fetch(url, token, 'status', deadline=deadline)
 
     @staticmethod
-    def storj(url: str, token: str) -> List[Dict[str, Any]]:
-        return Barrenero._get(base_url=url, path='/api/v1/storj/', token=token)
+    def storj(url: str, token: str, deadline: Deadline = None, fresh: bool = False) -> Storj:
+        return Barrenero.fetch(url, token, 'storj', deadline=deadline, fresh=fresh)
 
     @staticmethod
-    def wallet(url: str, token: str) -> Dict[str, Any]:
-        return Barrenero._get(base_url=url, path='/api/v1/wallet/', token=token)
+    def wallet(url: str, token: str, deadline: Deadline = None) -> Wallet:
+        return Barrenero.fetch(url, token, 'wallet', deadline=deadline)
 
     @staticmethod
-    def restart(url: str, token: str, service: str) -> Dict[str, Any]:
-        return Barrenero._post(base_url=url, path='/api/v1/restart/', token=token, data={'name': service})
+    def restart(url: str, token: str, service: str, idempotency_key: str = None) -> Dict[str, Any]:
+        """
+        Restart a service. Restarting is not idempotent so it is only retried if an idempotency key is given.
+        """
+        return Barrenero.retry.call(
+            lambda: Barrenero._post(base_url=url, path='/api/v1/restart/', token=token, data={'name': service},
+                                    idempotency_key=idempotency_key),
+            idempotent=idempotency_key is not None)
 
     @staticmethod
-    def ether(url: str, token: str) -> Dict[str, Any]:
-        return Barrenero._get(base_url=url, path='/api/v1/ether/', token=token)
+    def ether(url: str, token: str, deadline: Deadline = None, fresh: bool = False) -> Ether:
+        return Barrenero.fetch(url, token, 'ether', deadline=deadline, fresh=fresh)
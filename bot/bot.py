@@ -1,17 +1,34 @@
+import datetime
 import logging
+import signal
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from configparser import ConfigParser, NoSectionError, NoOptionError
+from typing import List
 
+import peewee
 from telegram import Bot, ParseMode
 from telegram.ext import CommandHandler, Updater, messagequeue as mq
 from telegram.utils.request import Request
 
+from bot.api import Barrenero
 from bot.exceptions import ImproperlyConfigured
+from bot.mixins.checkpoint import CheckpointMixin
+from bot.mixins.digest import DigestMixin
 from bot.mixins.ether import EtherMixin
+from bot.mixins.failover import FailoverMixin
+from bot.mixins.live import LiveMixin
 from bot.mixins.miner import MinerMixin
+from bot.mixins.push import PushMixin
+from bot.mixins.ratelimit import RateLimitMixin
+from bot.mixins.restart import RestartMixin
 from bot.mixins.start import StartMixin
 from bot.mixins.storj import StorjMixin
+from bot.mixins.sweep import SweepMixin
 from bot.mixins.wallet import WalletMixin
-from bot.models import initialize_db
+from bot.models import DB_CONNECTIONS_PER_BOT, DB_POOL, DEFAULT_DB_URL, Chat, configure_db, initialize_db
+from bot.stats import recorder
 
 
 class MQBot(Bot):
@@ -23,6 +40,18 @@ class MQBot(Bot):
         self._is_messages_queued_default = is_queued_def
         self._msg_queue = mq.MessageQueue(all_burst_limit=burst_messages, all_time_limit_ms=burst_time)
 
+    def flush(self, timeout: float = None):
+        """
+        Send queued messages and stop the queue. Stopping the queue right away would drop messages still waiting for
+        their turn, so it is stopped once they are sent or timeout expires.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        queues = (self._msg_queue._group_delayq._queue, self._msg_queue._all_delayq._queue)
+        while not all(q.empty() for q in queues) and (deadline is None or time.monotonic() < deadline):
+            time.sleep(0.1)
+
+        self._msg_queue.stop(max(deadline - time.monotonic(), 0.0) if deadline is not None else None)
+
     def __del__(self):
         try:
             self._msg_queue.stop()
@@ -35,7 +64,33 @@ class MQBot(Bot):
         return super(MQBot, self).send_message(*args, **kwargs)
 
 
-class TelegramBot(StartMixin, MinerMixin, EtherMixin, StorjMixin, WalletMixin):
+_db_lock = threading.Lock()
+_db_initialized = None
+
+
+def setup_db(url: str, max_connections: int = None, bots: int = 1) -> Future:
+    """
+    Configure and initialize database in background, only once for all bots served by this process. Unless given,
+    pool size grows with the number of bots.
+    """
+    global _db_initialized
+
+    if max_connections is None:
+        # Plus main thread and database initialization
+        max_connections = max(DB_POOL['max_connections'], DB_CONNECTIONS_PER_BOT * bots + 2)
+
+    with _db_lock:
+        if _db_initialized is None:
+            configure_db(url=url, max_connections=max_connections)
+            executor = ThreadPoolExecutor(max_workers=1)
+            _db_initialized = executor.submit(initialize_db)
+            executor.shutdown(wait=False)
+
+    return _db_initialized
+
+
+class TelegramBot(StartMixin, MinerMixin, EtherMixin, StorjMixin, WalletMixin, SweepMixin, RestartMixin,
+                  LiveMixin, FailoverMixin, RateLimitMixin, PushMixin, DigestMixin, CheckpointMixin):
     HELP_TEXT = """I can show you Barrenero's current status, as well as some information of different services related.
 
 Lets start setting up some parameters with /start
@@ -54,7 +109,10 @@ Help us donating to support this project:
  - PayPal: `barrenerobot@gmail.com`
 """
 
-    def __init__(self, config='setup.cfg'):
+    # Seconds to wait for running handlers and queued messages when stopping
+    shutdown_timeout = 30.0
+
+    def __init__(self, config='setup.cfg', index=0, request=None, bots=1):
         super().__init__()
 
         self.logger = logging.getLogger('bot')
@@ -63,21 +121,93 @@ Help us donating to support this project:
         try:
             config_from_file = ConfigParser()
             config_from_file.read(config)
-            self._token = config_from_file.get('telegram', 'token')
+            # Several bots can be served, each one listening in its own port starting from configured one
+            self._token = self.read_tokens(config_from_file)[index]
             self._url = config_from_file.get('telegram', 'url')
             if not self._url.endswith('/'):
                 self._url = self._url + '/'
-            self._port = config_from_file.getint('telegram', 'port')
-        except (NoSectionError, NoOptionError) as e:
+            self._port = config_from_file.getint('telegram', 'port') + index
+            self.shutdown_timeout = config_from_file.getfloat('telegram', 'shutdown_timeout',
+                                                              fallback=self.shutdown_timeout)
+
+            # Database backend
+            self._db_initialized = setup_db(
+                url=config_from_file.get('database', 'url', fallback=DEFAULT_DB_URL),
+                max_connections=config_from_file.getint('database', 'max_connections', fallback=None),
+                bots=bots)
+
+            # Endpoint for events pushed by rigs, listening in its own port for every bot as webhook does
+            push_port = config_from_file.getint('push', 'port', fallback=None)
+            self._push_init(
+                port=push_port + index if push_port is not None else None,
+                secret=config_from_file.get('push', 'secret', fallback=None),
+                reconcile_interval=config_from_file.getfloat('push', 'reconcile_interval', fallback=None))
+
+            # Daily digest time, as HH:MM
+            digest_time = config_from_file.get('digest', 'time', fallback=None)
+            if digest_time is not None:
+                self.digest_time = datetime.datetime.strptime(digest_time, '%H:%M').time()
+
+            # Barrenero API client settings
+            Barrenero.configure(
+                json_backend=config_from_file.get('barrenero', 'json', fallback=None),
+                stream=config_from_file.getboolean('barrenero', 'stream', fallback=False),
+                pool_size=config_from_file.getint('barrenero', 'pool_size', fallback=None),
+                batch=config_from_file.getboolean('barrenero', 'batch', fallback=False),
+                interactive_budget=config_from_file.getfloat('barrenero', 'interactive_budget', fallback=None),
+                retries=config_from_file.getint('barrenero', 'retries', fallback=None),
+                retry_backoff=config_from_file.getfloat('barrenero', 'retry_backoff', fallback=None),
+            )
+        except (NoSectionError, NoOptionError, IndexError, ValueError) as e:
             self.logger.exception('Wrong config')
             raise ImproperlyConfigured('Wrong config') from e
 
-        # Initialize DB
-        initialize_db()
+        self.bot_id = int(self._token.split(':', 1)[0])
+        # Chats registered before serving several bots belong to the first one
+        self.primary = index == 0
+
+        # Drafts of API configs are encrypted using bot token
+        self.drafts.set_secret(self._token)
 
-        request = Request(con_pool_size=8, connect_timeout=20., read_timeout=20.)
+        request = request or Request(con_pool_size=8, connect_timeout=20., read_timeout=20.)
         self.updater = Updater(bot=MQBot(self._token, request=request))
 
+        self._failover_init()
+        self._rate_limit_init()
+        self._checkpoint_init()
+        # Set once stopping, so long running jobs end early
+        self._stopping = threading.Event()
+
+    @staticmethod
+    def read_tokens(config: ConfigParser) -> List[str]:
+        return [t.strip() for t in config.get('telegram', 'token').split(',') if t.strip()]
+
+    @classmethod
+    def from_config(cls, config='setup.cfg') -> List['TelegramBot']:
+        """
+        Create a bot for every configured token. All of them share Telegram connection pool, Barrenero API client
+        and database.
+        """
+        config_from_file = ConfigParser()
+        config_from_file.read(config)
+        try:
+            count = len(cls.read_tokens(config_from_file))
+        except (NoSectionError, NoOptionError) as e:
+            raise ImproperlyConfigured('Wrong config') from e
+
+        request = Request(con_pool_size=8 * count, connect_timeout=20., read_timeout=20.)
+        return [cls(config=config, index=i, request=request, bots=count) for i in range(count)]
+
+    @property
+    def own_chats(self):
+        """
+        Expression to filter chats served by this bot.
+        """
+        if self.primary:
+            return (Chat.bot == self.bot_id) | Chat.bot.is_null()
+
+        return Chat.bot == self.bot_id
+
     def help(self, bot, update):
         """
         Shows help message.
@@ -93,8 +223,11 @@ Help us donating to support this project:
 
     def run(self):
         """
-        Setup the bot
+        Setup the bot and start it, returning once it is listening. It runs until stop is called.
         """
+        # Per chat rate limit
+        self.add_rate_limit()
+
         # Help command
         self.updater.dispatcher.add_handler(CommandHandler('help', self.help))
 
@@ -106,24 +239,108 @@ Help us donating to support this project:
 
         # Ether command
         self.add_ether_command()
-        self.add_ether_jobs()
 
         # Storj command
         self.add_storj_command()
-        self.add_storj_jobs()
+
+        # Live status messages
+        self.add_live_command()
 
         # Wallet command
         self.add_wallet_command()
-        self.add_wallet_jobs()
 
         # Error handler
         self.updater.dispatcher.add_error_handler(self.error)
 
         try:
-            self.logger.info('Listening 0.0.0.0:%d', self._port)
-            self.updater.start_webhook(listen='0.0.0.0', port=self._port, url_path=self._token)
+            # Register webhook while DB is being initialized, Telegram retries deliveries until listener is up
             self.logger.info('Webhook: %s', self._url + self._token)
             self.updater.bot.set_webhook(self._url + self._token)
-            self.updater.idle()
-        except:
-            self.updater.stop()
+            self._db_initialized.result()
+            self._start_handler.restore()
+            self.checkpoint_restore()
+            # Jobs are scheduled once checkpoints are restored, so they resume from their last run
+            self.add_jobs()
+            self.logger.info('Listening 0.0.0.0:%d', self._port)
+            self.updater.start_webhook(listen='0.0.0.0', port=self._port, url_path=self._token)
+            self.add_push_listener()
+        except Exception:
+            self.stop()
+            raise
+
+    def add_jobs(self):
+        # Expire configuration drafts
+        self.add_start_jobs()
+
+        # Nanopool accounts refresh
+        self.add_ether_jobs()
+
+        # Ether and Storj status sweep
+        self.add_sweep_jobs()
+
+        # Wallet transactions
+        self.add_wallet_jobs()
+
+        # Daily digest
+        self.add_digest_jobs()
+
+        # Webhook to polling failover
+        self.add_failover_jobs()
+
+    def stop(self, timeout: float = None):
+        """
+        Shut down in order: stop receiving updates and rig events, let running handlers and jobs finish, persist stats
+        and checkpoints, and send queued messages. Waits up to timeout seconds, shutdown_timeout by default.
+        """
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+
+        deadline = time.monotonic() + (timeout if timeout is not None else self.shutdown_timeout)
+        self.logger.info('Shutting down')
+
+        self.stop_push_listener()
+        if self.polling:
+            self._failover_polling.clear()
+        # Running sweep makes no more requests and wallet job stops after current chat
+        self.sweep_expire()
+
+        # Stops webhook listener, then waits for running jobs and the update being dispatched. It waits with no timeout,
+        # so it runs in its own thread to keep shutdown bounded
+        updater_stop = threading.Thread(target=self.updater.stop, name=f'stop_{self.bot_id}', daemon=True)
+        updater_stop.start()
+        updater_stop.join(max(deadline - time.monotonic(), 0.0))
+        if updater_stop.is_alive():
+            self.logger.warning('Shutdown: jobs still running after %.0f seconds', self.shutdown_timeout)
+
+        if not self.scheduler.stop(wait=True, timeout=max(deadline - time.monotonic(), 0.0)):
+            self.logger.warning('Shutdown: handlers still running after %.0f seconds', self.shutdown_timeout)
+
+        try:
+            recorder.flush()
+            self.checkpoint_save()
+        except peewee.PeeweeException:
+            self.logger.exception('Shutdown: cannot persist stats and checkpoints')
+
+        self.updater.bot.flush(timeout=max(deadline - time.monotonic(), 0.0))
+        self.logger.info('Shutdown completed')
+
+
+def run_bots(bots: List[TelegramBot]):
+    """
+    Run bots in this process until a stop signal is received. Signal handlers only set an event, so every bot, even a
+    single one, is stopped from main thread with its shutdown bounded by shutdown_timeout.
+    """
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+        signal.signal(sig, lambda signum, frame: stop.set())
+
+    try:
+        for bot in bots:
+            bot.run()
+
+        while not stop.wait(1):
+            pass
+    finally:
+        for bot in bots:
+            bot.stop()
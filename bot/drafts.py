@@ -0,0 +1,132 @@
+import base64
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+from bot.models import Draft, db
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:  # pragma: no cover
+    Fernet = InvalidToken = None
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['DraftStore']
+
+
+class DraftStore:
+    """
+    Configuration conversation state and API config being created for every chat.
+
+    Drafts are persisted so a restart does not drop them, and expire after ttl seconds without changes. Only max_size
+    drafts are kept in memory. Secret fields are encrypted before being persisted, or kept only in memory if
+    cryptography is not installed.
+    """
+    secret_fields = ('password', 'api_password')
+
+    def __init__(self, ttl: float = 3600.0, max_size: int = 256):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._cache = OrderedDict()  # type: OrderedDict[int, Tuple[Dict[str, Any], float]]
+        self._lock = threading.RLock()
+        self._fernet = None
+
+    def set_secret(self, secret: str):
+        if Fernet is None:
+            logger.warning('cryptography is not installed, secret fields of drafts will not be persisted')
+        else:
+            key = base64.urlsafe_b64encode(hashlib.sha256(secret.encode()).digest())
+            self._fernet = Fernet(key)
+
+    def _encode(self, config: Dict[str, Any]) -> str:
+        data = dict(config)
+        for field in self.secret_fields:
+            if field in data:
+                if self._fernet is None:
+                    del data[field]
+                else:
+                    data[field] = self._fernet.encrypt(data[field].encode()).decode()
+
+        return json.dumps(data)
+
+    def _decode(self, config: str) -> Dict[str, Any]:
+        data = json.loads(config)
+        for field in self.secret_fields:
+            if field in data:
+                try:
+                    data[field] = self._fernet.decrypt(data[field].encode()).decode()
+                except (AttributeError, InvalidToken):
+                    del data[field]
+
+        return data
+
+    def _remember(self, chat_id: int, config: Dict[str, Any], updated: float):
+        self._cache[chat_id] = (config, updated)
+        self._cache.move_to_end(chat_id)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    @staticmethod
+    def _upsert(chat_id: int, **fields):
+        with db.atomic():
+            if not Draft.update(**fields).where(Draft.chat == chat_id).execute():
+                Draft.create(chat=chat_id, **fields)
+
+    def get(self, chat_id: int) -> Dict[str, Any]:
+        threshold = time.time() - self.ttl
+
+        with self._lock:
+            if chat_id in self._cache and self._cache[chat_id][1] > threshold:
+                self._cache.move_to_end(chat_id)
+                return dict(self._cache[chat_id][0])
+
+            try:
+                draft = Draft.get(Draft.chat == chat_id, Draft.updated > threshold)
+                config, updated = self._decode(draft.config), draft.updated
+            except Draft.DoesNotExist:
+                config, updated = {}, time.time()
+
+            self._remember(chat_id, config, updated)
+            return dict(config)
+
+    def update(self, chat_id: int, **fields):
+        with self._lock:
+            config = self.get(chat_id)
+            config.update(fields)
+            updated = time.time()
+            self._remember(chat_id, config, updated)
+            self._upsert(chat_id, config=self._encode(config), updated=updated)
+
+    def set_state(self, key: Tuple[int, int], state: int):
+        chat_id, user_id = key
+        self._upsert(chat_id, user=user_id, state=state, updated=time.time())
+
+    def delete(self, chat_id: int):
+        with self._lock:
+            self._cache.pop(chat_id, None)
+            Draft.delete().where(Draft.chat == chat_id).execute()
+
+    def states(self) -> Dict[Tuple[int, int], int]:
+        """
+        Conversation states of drafts not expired yet.
+        """
+        query = Draft.select().where(Draft.updated > time.time() - self.ttl, Draft.state.is_null(False))
+        return {(d.chat, d.user): d.state for d in query}
+
+    def expire(self) -> Dict[Tuple[int, int], int]:
+        """
+        Remove expired drafts, returning conversation states removed.
+        """
+        threshold = time.time() - self.ttl
+        with self._lock, db.atomic():
+            expired = list(Draft.select().where(Draft.updated <= threshold))
+            Draft.delete().where(Draft.updated <= threshold).execute()
+            for draft in expired:
+                self._cache.pop(draft.chat, None)
+
+        return {(d.chat, d.user): d.state for d in expired}
@@ -19,6 +19,14 @@ class BarreneroRequestException(RequestException):
     pass
 
 
+class BarreneroResponseException(BarreneroRequestException):
+    pass
+
+
+class BarreneroDeadlineException(BarreneroRequestException):
+    pass
+
+
 class ImproperlyConfigured(TelegramError):
     pass
 
@@ -0,0 +1,133 @@
+import threading
+import time
+from array import array
+from concurrent.futures import FIRST_COMPLETED, Executor, TimeoutError, wait
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Tuple
+
+__all__ = ['Health', 'HealthTracker']
+
+
+class Health:
+    """
+    Latency and error rate of an API, as exponentially weighted moving averages, plus a window of recent latencies
+    to estimate its 95th percentile.
+    """
+    __slots__ = ('latency', 'errors', 'samples', 'count')
+
+    def __init__(self, window: int):
+        self.latency = None
+        self.errors = 0.0
+        self.samples = array('d', bytes(8 * window))
+        self.count = 0
+
+    @property
+    def p95(self) -> float:
+        samples = sorted(self.samples[:min(self.count, len(self.samples))])
+        return samples[int(0.95 * (len(samples) - 1))] if samples else None
+
+    def __repr__(self):
+        return f'Health{{latency={self.latency}, errors={self.errors:.2f}, p95={self.p95}}}'
+
+
+class HealthTracker:
+    """
+    Tracks health of every API to pick the fastest healthy one, hedging slow requests and falling back to other APIs
+    when a request fails.
+    """
+
+    def __init__(self, alpha: float = 0.2, max_errors: float = 0.5, window: int = 32, default_latency: float = 1.0):
+        self.alpha = alpha
+        self.max_errors = max_errors
+        self.window = window
+        self.default_latency = default_latency
+        self._health = {}  # type: Dict[Hashable, Health]
+        self._lock = threading.Lock()
+
+    def record(self, key: Hashable, latency: float, ok: bool):
+        with self._lock:
+            health = self._health.get(key)
+            if health is None:
+                health = self._health[key] = Health(self.window)
+
+            health.errors += self.alpha * ((0.0 if ok else 1.0) - health.errors)
+            if ok:
+                health.latency = latency if health.latency is None else \
+                    health.latency + self.alpha * (latency - health.latency)
+                health.samples[health.count % self.window] = latency
+                health.count += 1
+
+    def get(self, key: Hashable) -> Health:
+        with self._lock:
+            return self._health.get(key)
+
+    def _sort_key(self, key: Hashable) -> Tuple[bool, float]:
+        health = self._health.get(key)
+        if health is None:
+            return False, self.default_latency
+
+        return health.errors > self.max_errors, health.latency if health.latency is not None else \
+            self.default_latency
+
+    def rank(self, apis: Iterable[Any], key: Callable[[Any], Hashable] = lambda a: a.url) -> List[Any]:
+        """
+        Sort APIs putting healthy ones first, fastest first.
+        """
+        with self._lock:
+            return sorted(apis, key=lambda a: self._sort_key(key(a)))
+
+    def hedge_delay(self, key: Hashable) -> float:
+        with self._lock:
+            health = self._health.get(key)
+            p95 = health.p95 if health is not None else None
+
+        return p95 if p95 is not None else self.default_latency
+
+    def call(self, apis: Iterable[Any], func: Callable[[Any], Any], executor: Executor,
+             key: Callable[[Any], Hashable] = lambda a: a.url, timeout: float = None) -> Any:
+        """
+        Call func with the best API. If it takes longer than its 95th percentile latency, the same call is sent to
+        next API once, and the first result is used. If a call fails, next API is tried. Raises TimeoutError if no
+        call succeeds within timeout seconds.
+        """
+        expires = time.monotonic() + timeout if timeout is not None else None
+        candidates = iter(self.rank(apis, key))
+        pending = {}
+        hedged = False
+        error = None
+
+        def launch():
+            api = next(candidates, None)
+            if api is not None:
+                pending[executor.submit(func, api)] = api
+            return api
+
+        if launch() is None:
+            raise IndexError('No API available')
+
+        while pending:
+            last = list(pending.values())[-1]
+            timeouts = [None if hedged else self.hedge_delay(key(last)),
+                        max(expires - time.monotonic(), 0.0) if expires is not None else None]
+            timeouts = [t for t in timeouts if t is not None]
+            done, _ = wait(list(pending), timeout=min(timeouts) if timeouts else None, return_when=FIRST_COMPLETED)
+
+            if not done:
+                if expires is not None and time.monotonic() >= expires:
+                    raise TimeoutError('No API responded in time')
+
+                if not hedged:
+                    hedged = True
+                    launch()
+                continue
+
+            for future in done:
+                del pending[future]
+                try:
+                    return future.result()
+                except Exception as e:
+                    error = e
+
+            if not pending:
+                launch()
+
+        raise error
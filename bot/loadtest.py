@@ -0,0 +1,291 @@
+"""
+Load test of bot jobs against a synthetic fleet.
+
+Seeds a temporary database with chats and APIs pointing at a local fake Barrenero server, then runs the real job
+functions for a number of sweeps, reporting time, memory high water mark and messages that would be sent.
+"""
+import json
+import logging
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Any, Callable, Dict, List, Tuple
+
+from bot.api import Barrenero
+from bot.bot import TelegramBot
+from bot.mixins import ether, storj
+from bot.models import API, Chat, configure_db, db, initialize_db
+
+__all__ = ['FakeBarrenero', 'RecordingBot', 'LoadTestBot', 'TimedLock', 'run']
+
+
+class FakeBarreneroHandler(BaseHTTPRequestHandler):
+    """
+    Barrenero API serving synthetic data for any rig under `/rig/<n>/`.
+    """
+    protocol_version = 'HTTP/1.1'
+    cards = 6
+    nodes = 4
+
+    def _rig(self) -> int:
+        parts = self.path.split('/')
+        return int(parts[2]) if len(parts) > 2 and parts[1] == 'rig' and parts[2].isdigit() else 0
+
+    def _send(self, status: int, data: Any = None):
+        body = json.dumps(data).encode() if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _ether(self, rig: int) -> Dict[str, Any]:
+        active = random.random() >= self.server.failure_rate
+        return {
+            'active': active,
+            'hashrate': [{'graphic_card': i, 'hashrate': random.gauss(30.0, 0.3) if active else 0.0}
+                         for i in range(self.cards)],
+            'nanopool': {
+                'balance': {'confirmed': 0.1 * rig},
+                'hashrate': {k: 180.0 for k in ('current', 'one_hour', 'three_hours', 'six_hours', 'twelve_hours',
+                                                'twenty_four_hours')},
+                'last_payment': {'date': '2018-01-01T00:00:00Z', 'value': 0.2},
+                'workers': {f'rig{rig}': 180.0},
+            },
+        }
+
+    def _storj(self, rig: int) -> List[Dict[str, Any]]:
+        running = random.random() >= self.server.failure_rate
+        return [{'id': f'{rig:08x}{i:032x}', 'status': 'running' if running else 'stopped', 'uptime': '1d',
+                 'restarts': 0, 'shared': '100GB', 'shared_percent': 50, 'data_received': '1GB', 'peers': 100,
+                 'allocs': 10, 'delta': 5, 'config_path': f'/storj/{i}', 'response_time': 10.5, 'reputation': 4000,
+                 'version': '1.0.0'} for i in range(self.nodes)]
+
+    def _wallet(self, rig: int) -> Dict[str, Any]:
+        transactions = [{'hash': f'0x{rig:08x}{i:056x}', 'source': '0x0', 'value': 0.01,
+                         'timestamp': '2018-01-01T00:00:00Z', 'token': {'name': 'Ether', 'symbol': 'ETH'}}
+                        for i in range(int(time.time() // 60) % 5, 0, -1)]
+        return {'tokens': {'ETH': {'name': 'Ether', 'balance': 1.0, 'symbol': 'ETH', 'balance_usd': 700.0}},
+                'transactions': transactions}
+
+    def do_GET(self):
+        self.server.count(self.command)
+        if random.random() < self.server.error_rate:
+            self._send(503)
+            return
+
+        if self.server.latency:
+            time.sleep(random.expovariate(1 / self.server.latency))
+
+        rig = self._rig()
+        endpoint = self.path.rstrip('/').rsplit('/', 1)[-1]
+        if endpoint == 'ether':
+            self._send(200, self._ether(rig))
+        elif endpoint == 'storj':
+            self._send(200, self._storj(rig))
+        elif endpoint == 'wallet':
+            self._send(200, self._wallet(rig))
+        elif endpoint == 'status':
+            self._send(200, {'services': [{'name': 'ether', 'status': 'active'}], 'graphics': []})
+        else:
+            self._send(404)
+
+    def do_POST(self):
+        self.server.count(self.command)
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        self._send(404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeBarrenero(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, failure_rate: float = 0.05, error_rate: float = 0.01, latency: float = 0.0):
+        super().__init__(('127.0.0.1', 0), FakeBarreneroHandler)
+        self.failure_rate = failure_rate
+        self.error_rate = error_rate
+        self.latency = latency
+        self.requests = Counter()
+        self._requests_lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever, name='fake_barrenero', daemon=True)
+
+    def count(self, method: str):
+        # Every request is handled in its own thread
+        with self._requests_lock:
+            self.requests[method] += 1
+
+    def total(self) -> int:
+        with self._requests_lock:
+            return sum(self.requests.values())
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_port}'
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class RecordingBot:
+    """
+    Stands for Telegram bot in jobs, counting messages instead of sending them.
+    """
+
+    def __init__(self):
+        self.messages = Counter()
+        self._lock = threading.Lock()
+
+    def _record(self, method: str, *args, **kwargs):
+        with self._lock:
+            self.messages[method] += 1
+
+    def __getattr__(self, method: str) -> Callable:
+        return lambda *args, **kwargs: self._record(method, *args, **kwargs)
+
+
+class TimedLock:
+    """
+    Reentrant lock accumulating time spent waiting for it and holding it, to measure contention on the locks of
+    status machines.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.wait = 0.0
+        self.hold = 0.0
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        start = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        if acquired:
+            depth = getattr(self._local, 'depth', 0)
+            if not depth:
+                self._local.acquired = time.perf_counter()
+                with self._stats_lock:
+                    self.wait += self._local.acquired - start
+            self._local.depth = depth + 1
+
+        return acquired
+
+    def release(self):
+        self._local.depth -= 1
+        if not self._local.depth:
+            with self._stats_lock:
+                self.hold += time.perf_counter() - self._local.acquired
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def take(self) -> Tuple[float, float]:
+        """
+        Return wait and hold time accumulated since last call, in seconds, and reset them.
+        """
+        with self._stats_lock:
+            wait, hold = self.wait, self.hold
+            self.wait = self.hold = 0.0
+
+        return wait, hold
+
+
+class LoadTestBot(TelegramBot):
+    """
+    Bot with every mixin but without Telegram updater, so its jobs can be called directly.
+    """
+
+    def __init__(self):
+        super(TelegramBot, self).__init__()
+        self.logger = logging.getLogger('bot')
+        self.bot_id = 0
+        self.primary = True
+        self.updater = None
+        self._stopping = threading.Event()
+        self._push_init()
+
+
+def seed(server: FakeBarrenero, chats: int, apis: int):
+    with db.atomic():
+        Chat.insert_many([{'id': i} for i in range(chats)]).execute()
+
+        rows = [{'name': f'rig_{i}', 'url': f'{server.url}/rig/{i}', 'token': f'{i:040x}', 'superuser': True,
+                 'wallet': f'0x{i % max(chats // 2, 1):040x}', 'chat': i % chats} for i in range(apis)]
+        for i in range(0, len(rows), 500):
+            API.insert_many(rows[i:i + 500]).execute()
+
+
+def max_rss() -> float:
+    """
+    Memory high water mark of this process, in MiB.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(chats: int = 100, apis: int = 200, sweeps: int = 5, jobs=('sweep', 'nanopool'), failure_rate: float = 0.05,
+        error_rate: float = 0.01, latency: float = 0.0):
+    """
+    Run given jobs for a number of sweeps and print a report of every one of them. Status machine locks are replaced
+    by timed ones to report contention on them.
+    """
+    bot = LoadTestBot()
+    job_functions = {
+        'sweep': bot.sweep_job_status,
+        'nanopool': bot.ether_job_nanopool,
+        'wallet': bot.wallet_job_transactions,
+        'digest': bot.digest_job,
+    }
+    Barrenero.configure(retry_backoff=0.01)
+
+    locks = {'ether': TimedLock(), 'storj': TimedLock()}
+    ether.lock, storj.lock = locks['ether'], locks['storj']
+
+    with tempfile.TemporaryDirectory() as directory, \
+            FakeBarrenero(failure_rate=failure_rate, error_rate=error_rate, latency=latency) as server:
+        configure_db(f'sqlite+pool:///{os.path.join(directory, "loadtest.db")}')
+        initialize_db()
+        seed(server, chats, apis)
+
+        print(f'Fleet: {chats} chats, {apis} APIs at {server.url}')
+        print(f'{"sweep":>5} {"job":>10} {"seconds":>9} {"requests":>9} {"messages":>9} {"machines":>9} '
+              f'{"max rss MiB":>12} {"lock wait s":>12} {"lock hold s":>12}')
+
+        telegram = RecordingBot()
+        for sweep in range(1, sweeps + 1):
+            for name in jobs:
+                requests_before = server.total()
+                messages_before = sum(telegram.messages.values())
+                for lock in locks.values():
+                    lock.take()
+
+                start = time.perf_counter()
+                job_functions[name](telegram, None)
+                elapsed = time.perf_counter() - start
+
+                machines = len(ether.status_machines) + len(storj.status_machines)
+                wait, hold = (sum(t) for t in zip(*(lock.take() for lock in locks.values())))
+                print(f'{sweep:>5} {name:>10} {elapsed:>9.3f} {server.total() - requests_before:>9} '
+                      f'{sum(telegram.messages.values()) - messages_before:>9} {machines:>9} {max_rss():>12.1f} '
+                      f'{wait:>12.4f} {hold:>12.4f}')
+
+        print(f'Messages: {dict(telegram.messages)}')
+        print(f'Requests: {dict(server.requests)}')
+        print(f'Retries: {Barrenero.retry.stats()}')
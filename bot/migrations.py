@@ -0,0 +1,125 @@
+"""
+Versioned schema migrations, applied in order at startup.
+
+Every migration is a function receiving the database and is registered with the @migration decorator. Current version
+is stored in SchemaVersion table, so only pending migrations are run.
+"""
+import logging
+import time
+from typing import Callable, List
+
+import peewee
+from playhouse.migrate import SchemaMigrator, migrate as schema_migrate
+
+from bot.models import API, BaseModel, Chat, Checkpoint, Draft, ServiceStats, TransactionStats, db
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['SchemaVersion', 'migrate', 'migrations']
+
+migrations = []  # type: List[Callable[[peewee.Database], None]]
+
+
+def migration(func: Callable[[peewee.Database], None]) -> Callable[[peewee.Database], None]:
+    migrations.append(func)
+    return func
+
+
+class SchemaVersion(BaseModel):
+    version = peewee.IntegerField(verbose_name='version', primary_key=True, help_text='Migration number')
+    name = peewee.CharField(verbose_name='name', help_text='Migration name')
+    applied = peewee.DoubleField(verbose_name='applied', help_text='Applied timestamp')
+
+    class Meta:
+        table_name = 'schema_version'
+
+
+@migration
+def initial(database: peewee.Database):
+    # Indexes are created by following migrations
+    Chat._schema.create_table(safe=True)
+    API._schema.create_table(safe=True)
+    Draft.create_table(safe=True)
+
+
+@migration
+def api_indexes(database: peewee.Database):
+    # Remove duplicated APIs, keeping the oldest one, before adding unique constraint
+    duplicated = API.select(peewee.fn.MIN(API.id)).group_by(API.chat, API.url, API.name)
+    API.delete().where(API.id.not_in(duplicated)).execute()
+
+    database.execute_sql('CREATE INDEX IF NOT EXISTS "api_chat_id" ON "api" ("chat_id")')
+    database.execute_sql('CREATE INDEX IF NOT EXISTS "api_superuser_chat_id" ON "api" ("superuser", "chat_id")')
+    database.execute_sql('CREATE UNIQUE INDEX IF NOT EXISTS "api_chat_id_url_name" ON "api" ("chat_id", "url", "name")')
+
+
+@migration
+def big_ids(database: peewee.Database):
+    # Telegram chat and user ids do not fit in 32 bits. SQLite integers are already 64 bits wide
+    if isinstance(database, peewee.PostgresqlDatabase):
+        database.execute_sql('ALTER TABLE "chat" ALTER COLUMN "id" TYPE BIGINT')
+        database.execute_sql('ALTER TABLE "api" ALTER COLUMN "chat_id" TYPE BIGINT')
+        database.execute_sql('ALTER TABLE "draft" ALTER COLUMN "chat" TYPE BIGINT')
+        database.execute_sql('ALTER TABLE "draft" ALTER COLUMN "user" TYPE BIGINT')
+
+
+@migration
+def chat_bot(database: peewee.Database):
+    # Initial migration creates tables from current models, so column can exist already
+    if 'bot' not in {c.name for c in database.get_columns('chat')}:
+        migrator = SchemaMigrator.from_database(database)
+        schema_migrate(migrator.add_column('chat', 'bot', peewee.BigIntegerField(null=True, default=None)))
+
+    database.execute_sql('CREATE INDEX IF NOT EXISTS "chat_bot" ON "chat" ("bot")')
+
+
+@migration
+def api_wallet(database: peewee.Database):
+    if 'wallet' not in {c.name for c in database.get_columns('api')}:
+        migrator = SchemaMigrator.from_database(database)
+        schema_migrate(migrator.add_column('api', 'wallet', peewee.CharField(null=True, default=None)))
+
+    database.execute_sql('CREATE INDEX IF NOT EXISTS "api_wallet" ON "api" ("wallet")')
+
+
+@migration
+def daily_stats(database: peewee.Database):
+    if 'last_digest' not in {c.name for c in database.get_columns('chat')}:
+        migrator = SchemaMigrator.from_database(database)
+        schema_migrate(migrator.add_column('chat', 'last_digest', peewee.DateField(null=True, default=None)))
+
+    ServiceStats.create_table(safe=True)
+    TransactionStats.create_table(safe=True)
+
+
+@migration
+def checkpoints(database: peewee.Database):
+    Checkpoint.create_table(safe=True)
+
+
+@migration
+def uptime_seconds(database: peewee.Database):
+    columns = {c.name for c in database.get_columns('service_stats')}
+    migrator = SchemaMigrator.from_database(database)
+    for column in ('seconds', 'up_seconds'):
+        if column not in columns:
+            schema_migrate(migrator.add_column('service_stats', column, peewee.DoubleField(default=0.0)))
+
+
+def migrate(target: int = None) -> int:
+    """
+    Apply pending migrations up to target version, all of them by default. Returns current version.
+    """
+    target = len(migrations) if target is None else target
+
+    db.create_tables([SchemaVersion], safe=True)
+    current = SchemaVersion.select(peewee.fn.MAX(SchemaVersion.version)).scalar() or 0
+
+    for version, func in enumerate(migrations[current:target], current + 1):
+        logger.info('Applying migration %d: %s', version, func.__name__)
+        with db.atomic():
+            func(db.obj)
+            SchemaVersion.create(version=version, name=func.__name__, applied=time.time())
+        current = version
+
+    return current
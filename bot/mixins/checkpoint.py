@@ -0,0 +1,100 @@
+import json
+import time
+from functools import wraps
+from typing import Callable
+
+import peewee
+
+from bot.mixins import ether, storj
+from bot.models import API, Chat, Checkpoint
+from bot.state_machine import StatusStateMachine
+
+# Modules holding status machines of every service
+CHECKPOINT_SERVICES = (
+    ('Ether', ether),
+    ('Storj', storj),
+)
+
+
+class CheckpointMixin:
+    """
+    Persists status machines and last run of jobs on shutdown, and resumes them at startup so a restart neither
+    notifies status again nor shifts job schedules.
+    """
+
+    def _checkpoint_init(self):
+        # Last run timestamp by job name
+        self._job_runs = {}
+        # Nothing is saved until previous checkpoint is restored, to never overwrite it with an empty one
+        self._checkpoint_restored = False
+
+    @property
+    def checkpoint_name(self) -> str:
+        return f'bot:{self.bot_id}'
+
+    def checkpointed(self, name: str, callback: Callable) -> Callable:
+        """
+        Wrap a job callback to record when it runs.
+        """
+        @wraps(callback)
+        def job(bot, job):
+            try:
+                callback(bot, job)
+            finally:
+                self._job_runs[name] = time.time()
+
+        return job
+
+    def job_first(self, name: str, interval: float) -> float:
+        """
+        Delay of first run of a job, resuming its schedule from last run before restart.
+        """
+        last = self._job_runs.get(name)
+        if last is None:
+            return interval
+
+        return min(max(interval - (time.time() - last), 0.0), interval)
+
+    def checkpoint_save(self):
+        if not self._checkpoint_restored:
+            return
+
+        chats = {c.id for c in Chat.select(Chat.id).where(self.own_chats)}
+
+        machines = []
+        for service, module in CHECKPOINT_SERVICES:
+            with module.lock:
+                machines.extend({'service': service, 'api': api.id, 'chat': api.chat_id, 'name': machine.api,
+                                 **machine.dump()}
+                                for api, machine in module.status_machines.items() if api.chat_id in chats)
+
+        data = json.dumps({'machines': machines, 'jobs': self._job_runs})
+        updated = Checkpoint.update(data=data, updated=time.time()).where(
+            Checkpoint.name == self.checkpoint_name).execute()
+        if not updated:
+            Checkpoint.create(name=self.checkpoint_name, data=data, updated=time.time())
+
+        self.logger.info('Checkpoint saved: %d status machines, jobs %s', len(machines), sorted(self._job_runs))
+
+    def checkpoint_restore(self):
+        try:
+            data = json.loads(Checkpoint.get(name=self.checkpoint_name).data)
+        except peewee.DoesNotExist:
+            data = {}
+        finally:
+            self._checkpoint_restored = True
+
+        modules = dict(CHECKPOINT_SERVICES)
+        machines = [m for m in data.get('machines', []) if m['service'] in modules]
+        existing = {a.id for a in API.select(API.id).where(API.id.in_([m['api'] for m in machines]))}
+        machines = [m for m in machines if m['api'] in existing]
+
+        for m in machines:
+            machine = StatusStateMachine(m['service'], m['name'])
+            machine.load(m)
+            module = modules[m['service']]
+            with module.lock:
+                module.status_machines.setdefault(API(id=m['api'], chat=m['chat']), machine)
+
+        self._job_runs.update(data.get('jobs', {}))
+        self.logger.info('Checkpoint restored: %d status machines, jobs %s', len(machines), sorted(self._job_runs))
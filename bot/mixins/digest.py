@@ -0,0 +1,147 @@
+import datetime
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import peewee
+from telegram import ParseMode
+from telegram.error import TelegramError
+from telegram.utils.promise import Promise
+
+from bot.api import Deadline
+from bot.models import API, Chat, ServiceStats, TransactionStats, db
+from bot.stats import recorder, utc_today
+
+# Delivery of digests is confirmed here so waiting for the message queue never blocks the job queue thread
+executor = ThreadPoolExecutor(max_workers=1)
+
+
+class DigestMixin:
+    """
+    Daily digest of every chat, built from status checks and transactions recorded locally. Only days since the last
+    digest of each chat are aggregated, and a chat moves its last digest forward only once its message is confirmed
+    as sent, so a failed digest is included in the next one.
+    """
+    digest_time = datetime.time(hour=8)
+    digest_retention = datetime.timedelta(days=31)
+    # Seconds to wait for queued digests to be sent, enough for 200 chats at the message queue rate limit
+    digest_confirm_timeout = 600.0
+
+    def _digest_data(self, today: datetime.date):
+        """
+        Aggregate stats of every chat since its last digest, in a query per table.
+        """
+        since = peewee.fn.COALESCE(Chat.last_digest, today - datetime.timedelta(days=2))
+
+        services = (ServiceStats
+                    .select(API.chat.alias('chat_id'), API.name.alias('api'), ServiceStats.service,
+                            peewee.fn.SUM(ServiceStats.checks).alias('checks'),
+                            peewee.fn.SUM(ServiceStats.up).alias('up'),
+                            peewee.fn.SUM(ServiceStats.hashrate).alias('hashrate'),
+                            peewee.fn.SUM(ServiceStats.hashrate_samples).alias('hashrate_samples'),
+                            peewee.fn.SUM(ServiceStats.seconds).alias('seconds'),
+                            peewee.fn.SUM(ServiceStats.up_seconds).alias('up_seconds'))
+                    .join(API)
+                    .join(Chat)
+                    .where(self.own_chats & (ServiceStats.day < today) & (ServiceStats.day > since))
+                    .group_by(API.chat, API.id, API.name, ServiceStats.service)
+                    .dicts())
+
+        transactions = (TransactionStats
+                        .select(TransactionStats.chat.alias('chat_id'), TransactionStats.token,
+                                peewee.fn.SUM(TransactionStats.count).alias('count'),
+                                peewee.fn.SUM(TransactionStats.value).alias('value'))
+                        .join(Chat)
+                        .where(self.own_chats & (TransactionStats.day < today) & (TransactionStats.day > since))
+                        .group_by(TransactionStats.chat, TransactionStats.token)
+                        .dicts())
+
+        digests = defaultdict(lambda: {'services': [], 'transactions': []})
+        for row in services:
+            digests[row['chat_id']]['services'].append(row)
+        for row in transactions:
+            digests[row['chat_id']]['transactions'].append(row)
+
+        return digests
+
+    @staticmethod
+    def digest_uptime(service) -> float:
+        """
+        Uptime percentage weighted by time between checks, or by number of checks if only one was recorded.
+        """
+        if service['seconds']:
+            return 100.0 * service['up_seconds'] / service['seconds']
+
+        return 100.0 * service['up'] / service['checks']
+
+    @classmethod
+    def digest_text(cls, data) -> str:
+        response_text = '*Daily digest*'
+
+        if data['services']:
+            response_text += '\n\n*Uptime*\n' + '\n'.join(
+                f' - {s["api"]} {s["service"].capitalize()}: `{cls.digest_uptime(s):.1f}%`'
+                for s in data['services'] if s['checks'])
+
+        hashrates = [s for s in data['services'] if s['hashrate_samples']]
+        if hashrates:
+            response_text += '\n\n*Average hashrate*\n' + '\n'.join(
+                f' - {s["api"]}: `{s["hashrate"] / s["hashrate_samples"]:.2f} MH/s`' for s in hashrates)
+
+        response_text += '\n\n*Transactions received*\n'
+        if data['transactions']:
+            response_text += '\n'.join(f' - {t["token"]}: `{t["value"]:g}` ({t["count"]} transactions)'
+                                       for t in data['transactions'])
+        else:
+            response_text += ' - None'
+
+        return response_text
+
+    def digest_job(self, bot, job):
+        """
+        Send daily digest to every chat with new stats.
+        """
+        self.logger.debug('Job: Daily digest')
+        recorder.flush()
+
+        today = utc_today()
+        digests = self._digest_data(today)
+
+        # Queued messages are sent in background, returning a promise of the sent message
+        sent = {chat_id: bot.send_message(chat_id, self.digest_text(data), parse_mode=ParseMode.MARKDOWN)
+                for chat_id, data in digests.items()}
+
+        ServiceStats.delete().where(ServiceStats.day < today - self.digest_retention).execute()
+        TransactionStats.delete().where(TransactionStats.day < today - self.digest_retention).execute()
+
+        executor.submit(self._digest_confirm, sent, today)
+
+    def _digest_confirm(self, sent, today: datetime.date):
+        """
+        Wait for digests to be sent and move last digest forward for chats whose digest was sent, or that had nothing
+        to send.
+        """
+        deadline = Deadline(self.digest_confirm_timeout)
+        failed = []
+        for chat_id, message in sent.items():
+            try:
+                if isinstance(message, Promise):
+                    message.result(timeout=deadline.remaining)
+                    if not message.done.is_set():
+                        raise TimeoutError('Digest not sent in time')
+            except (TelegramError, TimeoutError):
+                self.logger.exception('Cannot send digest to Chat %s', chat_id)
+                failed.append(chat_id)
+
+        try:
+            with db.connection_context():
+                Chat.update(last_digest=today - datetime.timedelta(days=1)) \
+                    .where(self.own_chats & Chat.id.not_in(failed)) \
+                    .execute()
+        except peewee.PeeweeException:
+            self.logger.exception('Cannot store last digest')
+            return
+
+        self.logger.info('Daily digest sent to %d chats, %d failed', len(sent) - len(failed), len(failed))
+
+    def add_digest_jobs(self):
+        self.updater.job_queue.run_daily(self.digest_job, time=self.digest_time)
@@ -1,21 +1,36 @@
-import random
 import threading
+import time
+from typing import Dict, Optional, Tuple
 
 import peewee
 from telegram import ChatAction, InlineKeyboardButton, InlineKeyboardMarkup, ParseMode
 from telegram.ext import CallbackQueryHandler, CommandHandler
 
-from bot.api import Barrenero
+from bot.anomaly import HashrateDetector
+from bot.api import Barrenero, Deadline
 from bot.exceptions import BarreneroRequestException
 from bot.models import API, Chat
+from bot.payloads import Nanopool
 from bot.state_machine import StatusStateMachine
-from bot.utils import humanize_iso_date
+from bot.stats import recorder
+from bot.utils import humanize_iso_date, stale_text
 
 status_machines = {}
 lock = threading.RLock()
 
+# Nanopool account info by wallet and time it was retrieved, shared by every chat and API using it
+nanopool_accounts = {}  # type: Dict[str, Tuple[Optional[Nanopool], float]]
+nanopool_lock = threading.Lock()
+
+# Hashrate baselines of every graphic card by API
+hashrate_detector = HashrateDetector()
+
 
 class EtherMixin:
+    nanopool_interval = 600.0
+    # Cached accounts not refreshed for two job runs are requested again
+    nanopool_ttl = 2 * nanopool_interval
+
     def ether(self, bot, update):
         """
         Call for Ether miner status and restarting service.
@@ -53,36 +68,90 @@ class EtherMixin:
 
         try:
             chat = Chat.get(id=chat_id)
-            api = random.choice(chat.apis)
-            data = Barrenero.ether(api.url, api.token)
-
-            response_text = f'*Ether miner*\n' \
-                            f' - Balance: `{data["nanopool"]["balance"]["confirmed"]} ETH`\n\n' \
-                            f'*Hashrate*\n' \
-                            f' - Current: `{data["nanopool"]["hashrate"]["current"]} MH/s`\n' \
-                            f' - 1 hour: `{data["nanopool"]["hashrate"]["one_hour"]} MH/s`\n' \
-                            f' - 3 hours: `{data["nanopool"]["hashrate"]["three_hours"]} MH/s`\n' \
-                            f' - 6 hours: `{data["nanopool"]["hashrate"]["six_hours"]} MH/s`\n' \
-                            f' - 12 hours: `{data["nanopool"]["hashrate"]["twelve_hours"]} MH/s`\n' \
-                            f' - 24 hours: `{data["nanopool"]["hashrate"]["twenty_four_hours"]} MH/s`\n\n' \
-                            f'*Last payment*\n' \
-                            f' - Date: `{humanize_iso_date(data["nanopool"]["last_payment"]["date"])}`\n' \
-                            f' - Value: `{data["nanopool"]["last_payment"]["value"]} ETH`\n\n' \
-                            f'*Workers*\n' + \
-                            '\n'.join(f' - {w}: `{v} MH/s`' for w, v in data['nanopool']['workers'].items())
+            nanopool, age = self.nanopool_account(list(chat.apis), deadline=Barrenero.deadline())
+
+            if nanopool is None:
+                response_text = 'Nanopool info not available'
+            else:
+                response_text = f'*Ether miner*\n' \
+                                f' - Balance: `{nanopool.balance} ETH`\n\n' \
+                                f'*Hashrate*\n' \
+                                f' - Current: `{nanopool.hashrate.current} MH/s`\n' \
+                                f' - 1 hour: `{nanopool.hashrate.one_hour} MH/s`\n' \
+                                f' - 3 hours: `{nanopool.hashrate.three_hours} MH/s`\n' \
+                                f' - 6 hours: `{nanopool.hashrate.six_hours} MH/s`\n' \
+                                f' - 12 hours: `{nanopool.hashrate.twelve_hours} MH/s`\n' \
+                                f' - 24 hours: `{nanopool.hashrate.twenty_four_hours} MH/s`\n\n' \
+                                f'*Last payment*\n' \
+                                f' - Date: `{humanize_iso_date(nanopool.last_payment_date)}`\n' \
+                                f' - Value: `{nanopool.last_payment_value} ETH`\n\n' \
+                                f'*Workers*\n' + \
+                                '\n'.join(f' - {w}: `{v} MH/s`' for w, v in nanopool.workers.items()) + \
+                                stale_text(age)
         except peewee.DoesNotExist:
             self.logger.error('Chat unregistered')
             response_text = 'Configure me first'
         except BarreneroRequestException as e:
             self.logger.exception(e.message)
             response_text = e.message
-        except:
-            response_text = 'Cannot retrieve Nanopool info'
-            self.logger.exception('Barrenero API wrong response for Nanopool info: %s', str(data))
 
         bot.edit_message_text(text=response_text, parse_mode=ParseMode.MARKDOWN, chat_id=query.message.chat_id,
                               message_id=query.message.message_id)
 
+    def nanopool_account(self, apis, deadline: Deadline = None) -> Tuple[Optional[Nanopool], Optional[float]]:
+        """
+        Nanopool account info of the wallet used by the healthiest of given APIs, requested only if it is not cached
+        or its cache entry expired. The request is sent to APIs sharing that wallet, falling back between them. If they do not respond in
+        time, last Ether payload retrieved from them is used instead. Returns account info and its age in seconds if
+        it is stale, None otherwise.
+        """
+        apis = Barrenero.health.rank(apis)
+        if not apis:
+            raise BarreneroRequestException('No Barrenero API available')
+
+        key = apis[0].wallet or apis[0].url
+
+        with nanopool_lock:
+            if key in nanopool_accounts:
+                nanopool, fetched = nanopool_accounts[key]
+                if time.time() - fetched < self.nanopool_ttl:
+                    return nanopool, None
+
+                del nanopool_accounts[key]
+
+        data, age = Barrenero.hedged_or_stale([a for a in apis if (a.wallet or a.url) == key], 'ether', deadline)
+        if age is None:
+            with nanopool_lock:
+                nanopool_accounts[key] = (data.nanopool, time.time())
+
+        return data.nanopool, age
+
+    def _nanopool_refresh(self, api) -> bool:
+        try:
+            nanopool = Barrenero.ether(api.url, api.token).nanopool
+        except BarreneroRequestException:
+            self.logger.debug('Cannot refresh Nanopool account from API %s', api.name)
+            return False
+
+        with nanopool_lock:
+            nanopool_accounts[api.wallet or api.url] = (nanopool, time.time())
+
+        return True
+
+    def ether_job_nanopool(self, bot, job):
+        """
+        Refresh Nanopool info of every wallet, requesting the healthiest API for each one.
+        """
+        self.logger.debug('Job: Refresh Nanopool accounts')
+
+        accounts = {}
+        apis = API.select(API.id, API.name, API.url, API.token, API.wallet).join(Chat).where(self.own_chats)
+        for api in Barrenero.health.rank(apis):
+            accounts.setdefault(api.wallet or api.url, api)
+
+        refreshed = sum(Barrenero.executor.map(self._nanopool_refresh, accounts.values()))
+        self.logger.debug('Nanopool accounts refreshed: %d/%d', refreshed, len(accounts))
+
     def ether_miner_choice(self, bot, update, groups):
         """
         Call for Ether miner status and restarting service.
@@ -99,6 +168,8 @@ class EtherMixin:
         if chat:
             buttons = [InlineKeyboardButton(api.name, callback_data=f'[ether_{action}][{api.id}]')
                        for api in chat.apis if api.superuser]
+            if action == 'restart' and len(buttons) > 1:
+                buttons.append(InlineKeyboardButton('All', callback_data='[ether_restart][all]'))
             keyboard = [buttons[i:max(len(buttons), i + 4)] for i in range(0, len(buttons), 4)]
             reply_markup = InlineKeyboardMarkup(keyboard)
         else:
@@ -112,7 +183,7 @@ class EtherMixin:
 
     def ether_restart(self, bot, update, groups):
         """
-        Restart ether service.
+        Restart Ether service in one or all APIs.
         """
         query = update.callback_query
         api_id = groups[0]
@@ -121,23 +192,16 @@ class EtherMixin:
         bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
 
         try:
-            api = API.get(id=api_id)
-            Barrenero.restart(api.url, api.token, 'Ether')
-
-            response_text = f'*API {api.name}*\n' \
-                            f'Restarting Ether.'
+            chat = Chat.get(id=chat_id)
+            if api_id == 'all':
+                apis = [api for api in chat.apis if api.superuser]
+            else:
+                apis = [API.get(id=api_id, chat=chat)]
         except peewee.DoesNotExist:
             self.logger.error('Chat unregistered')
-            response_text = 'Configure me first'
-        except BarreneroRequestException as e:
-            self.logger.exception(e.message)
-            response_text = e.message
-        except:
-            self.logger.exception('Cannot restart API %s Ether miner', api.name)
-            response_text = f'*API {api.name} - Ether miner*\nCannot restart miner'
-
-        bot.edit_message_text(text=response_text, parse_mode=ParseMode.MARKDOWN, chat_id=chat_id,
-                              message_id=query.message.message_id)
+            bot.edit_message_text(text='Configure me first', chat_id=chat_id, message_id=query.message.message_id)
+        else:
+            self.restart_service(bot, chat_id, query.message.message_id, apis, 'Ether')
 
     def ether_status(self, bot, update, groups):
         """
@@ -152,65 +216,92 @@ class EtherMixin:
         try:
             api = API.get(id=api_id)
 
-            data = Barrenero.ether(api.url, api.token)
+            data, age = Barrenero.fetch_or_stale(api.url, api.token, 'ether')
 
-            response_text = f'*API {api.name}*\n' \
-                            f'*Ether miner*\n' \
-                            f' - Status: {data["active"]}\n\n' \
-                            f'*Hashrate*\n' \
-                            + '\n'.join([f' - Graphic card #{h["graphic_card"]}: `{h["hashrate"]:.2f} MH/s`'
-                                         for h in data['hashrate']])
+            response_text = self.ether_status_text(api, data) + stale_text(age)
+            reply_markup = self.live_markup('ether', api.id)
         except peewee.DoesNotExist:
             self.logger.error('Chat unregistered')
             response_text = 'Configure me first'
+            reply_markup = None
         except BarreneroRequestException as e:
             self.logger.exception(e.message)
             response_text = f'*API {api.name} - Ether miner*\n{e.message}'
-        except:
-            response_text = f'*API {api.name} - Ether miner*\nCannot retrieve Ether miner status'
-            self.logger.exception('Barrenero API wrong response for Ether miner status: %s', str(data))
+            reply_markup = None
 
         bot.edit_message_text(text=response_text, parse_mode=ParseMode.MARKDOWN, chat_id=chat_id,
-                              message_id=query.message.message_id)
+                              message_id=query.message.message_id, reply_markup=reply_markup)
+
+    @staticmethod
+    def ether_status_text(api, data) -> str:
+        return f'*API {api.name}*\n' \
+               f'*Ether miner*\n' \
+               f' - Status: {data.active}\n\n' \
+               f'*Hashrate*\n' \
+               + '\n'.join([f' - Graphic card #{card}: `{hashrate:.2f} MH/s`' for card, hashrate in data.hashrate])
+
+    def ether_check_status(self, bot, api, snapshot, count: int = 1):
+        """
+        Update Ether status of an API from a snapshot retrieved in current sweep, recorded as count checks.
+        """
+        try:
+            data = snapshot['ether']
+            self.ether_observe(bot, api, data.active, count=count)
+        except BarreneroRequestException:
+            self.ether_observe(bot, api, False, reason=f'Cannot access `{api.name}`', count=count)
+            recorder.record_check(api.id, 'ether', False)
+        else:
+            if data.active:
+                self.ether_check_hashrate(bot, api, data.hashrate)
+            recorder.record_check(api.id, 'ether', data.active,
+                                  hashrate=sum(data.hashrate.hashrates) if data.active else None)
+
+    def ether_check_hashrate(self, bot, api, hashrate):
+        """
+        Notify graphic cards whose hashrate deviates from their usual one, and when they recover.
+        """
+        detected, recovered = hashrate_detector.update(api.id, hashrate)
 
-    def ether_job_status(self, bot, job):
+        for anomaly in detected:
+            bot.send_message(api.chat_id, f'Graphic card #{anomaly.card} from API `{api.name}` is mining at '
+                                          f'`{anomaly.hashrate:.2f} MH/s`, usually `{anomaly.baseline:.2f} MH/s`',
+                             parse_mode=ParseMode.MARKDOWN)
+
+        for anomaly in recovered:
+            bot.send_message(api.chat_id, f'Graphic card #{anomaly.card} from API `{api.name}` is back to '
+                                          f'`{anomaly.hashrate:.2f} MH/s`',
+                             parse_mode=ParseMode.MARKDOWN)
+
+    def ether_observe(self, bot, api, up: bool, reason: str = None, count: int = 1):
         """
-        Check miner status
+        Record a Ether status check of an API.
         """
-        self.logger.debug('Job: Check Ether status')
+        with lock:
+            status = status_machines.get(api)
+            if status is None:
+                status = status_machines[api] = StatusStateMachine('Ether', api.name)
 
-        # Create new state machines
-        global status_machines
+            status.observe(up, bot=bot, chat=api.chat_id, reason=reason, count=count)
 
+    def ether_forget(self, api):
+        """
+        Drop status and hashrate baselines of a removed API.
+        """
         with lock:
-            new_machines = {a: StatusStateMachine('Ether', a.name)
-                            for a in API.select().where(API.superuser == True).join(Chat)
-                            if a not in status_machines}
-            status_machines.update(new_machines)
-
-            self.logger.debug('Ether Status Machines: %s', str(status_machines))
-            for api, status in status_machines.items():
-                try:
-                    data = Barrenero.ether(api.url, api.token)
-
-                    if data['active']:
-                        status.start(bot=bot, chat=api.chat.id)
-                    else:
-                        status.stop(bot=bot, chat=api.chat.id)
-                except BarreneroRequestException:
-                    if status.is_active:
-                        bot.send_message(api.chat.id, f'Cannot access `{api.name}`', parse_mode=ParseMode.MARKDOWN)
-                        status.stop(bot=bot, chat=api.chat.id)
+            status_machines.pop(api, None)
+
+        hashrate_detector.forget(api.id)
 
     def add_ether_command(self):
         self.updater.dispatcher.add_handler(CommandHandler('ether', self.ether))
         self.updater.dispatcher.add_handler(CallbackQueryHandler(self.ether_restart, pass_groups=True,
-                                                                 pattern=r'\[ether_restart\]\[(\d+)\]'))
-        self.updater.dispatcher.add_handler(CallbackQueryHandler(self.ether_status, pass_groups=True,
+                                                                 pattern=r'\[ether_restart\]\[(\d+|all)\]'))
+        self.updater.dispatcher.add_handler(CallbackQueryHandler(self.fair(self.ether_status), pass_groups=True,
                                                                  pattern=r'\[ether_status\]\[(\d+)\]'))
         self.updater.dispatcher.add_handler(CallbackQueryHandler(self.ether_miner_choice, pass_groups=True,
                                                                  pattern=r'\[ether_(restart|status)\]$'))
-        self.updater.dispatcher.add_handler(CallbackQueryHandler(self.ether_nanopool, pattern=r'\[ether_nanopool\]'))
+        self.updater.dispatcher.add_handler(CallbackQueryHandler(self.fair(self.ether_nanopool),
+                                                                 pattern=r'\[ether_nanopool\]'))
 
     def add_ether_jobs(self):
-        self.updater.job_queue.run_repeating(self.ether_job_status, interval=180.0)
+        self.updater.job_queue.run_repeating(self.ether_job_nanopool, interval=self.nanopool_interval, first=0)
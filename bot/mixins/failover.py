@@ -0,0 +1,91 @@
+import threading
+import time
+
+import requests
+from telegram.error import TelegramError
+
+
+class FailoverMixin:
+    """
+    Switches to long polling when Telegram cannot deliver updates to the webhook, and back to webhook once it is
+    reachable again.
+    """
+    failover_interval = 60.0
+    failover_pending_updates = 1
+    failover_poll_timeout = 10
+
+    def _failover_init(self):
+        self._failover_polling = threading.Event()
+        self._failover_thread = None
+
+    @property
+    def polling(self) -> bool:
+        return self._failover_polling.is_set()
+
+    def _webhook_stalled(self, bot) -> bool:
+        info = bot.get_webhook_info()
+        recent_error = info.last_error_date and time.time() - info.last_error_date < 2 * self.failover_interval
+        if recent_error:
+            self.logger.warning('Webhook error: %s (%d pending updates)', info.last_error_message,
+                                info.pending_update_count)
+
+        return bool(recent_error) and info.pending_update_count >= self.failover_pending_updates
+
+    def _webhook_reachable(self) -> bool:
+        try:
+            # Webhook only accepts POST, so any response but a server error means proxy is forwarding requests
+            with requests.get(self._url + self._token, timeout=(3, 10)) as response:
+                return response.status_code < 500
+        except requests.RequestException:
+            return False
+
+    def failover_job_check(self, bot, job):
+        """
+        Check webhook health and switch update delivery mode if needed.
+        """
+        try:
+            if not self.polling and self._webhook_stalled(bot):
+                self.logger.warning('Webhook stalled, switching to polling')
+                self._failover_start(bot)
+            elif self.polling and self._webhook_reachable():
+                self.logger.info('Webhook reachable, switching back from polling')
+                self._failover_stop(bot)
+        except TelegramError:
+            self.logger.exception('Cannot check webhook status')
+
+    def _failover_start(self, bot):
+        bot.delete_webhook()
+        self._failover_polling.set()
+        self._failover_thread = threading.Thread(target=self._failover_poll, args=(bot,), name='failover_polling',
+                                                 daemon=True)
+        self._failover_thread.start()
+
+    def _failover_stop(self, bot):
+        self._failover_polling.clear()
+        self._failover_thread.join()
+        self._failover_thread = None
+        bot.set_webhook(self._url + self._token)
+
+    def _failover_poll(self, bot):
+        """
+        Fetch updates and feed them to the dispatcher as the webhook would do.
+        """
+        offset = None
+        while self._failover_polling.is_set():
+            try:
+                for update in bot.get_updates(offset=offset, timeout=self.failover_poll_timeout):
+                    self.updater.update_queue.put(update)
+                    offset = update.update_id + 1
+            except TelegramError:
+                self.logger.exception('Cannot get updates')
+                time.sleep(1)
+
+        # Confirm last updates so they are not delivered again through webhook
+        if offset is not None:
+            try:
+                bot.get_updates(offset=offset, timeout=0)
+            except TelegramError:
+                self.logger.exception('Cannot confirm last updates')
+
+    def add_failover_jobs(self):
+        self.updater.job_queue.run_repeating(self.failover_job_check, interval=self.failover_interval)
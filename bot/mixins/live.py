@@ -0,0 +1,134 @@
+import threading
+import time
+from typing import Dict, Set, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ParseMode
+from telegram.error import BadRequest
+from telegram.ext import CallbackQueryHandler
+
+from bot.exceptions import BarreneroRequestException
+from bot.utils import TokenBucket
+
+# Endpoint needed to render every kind of live message
+LIVE_ENDPOINTS = {'ether': 'ether', 'storj': 'storj', 'miner': 'status'}
+
+live_messages = {}  # type: Dict[int, Dict[Tuple[int, int], LiveMessage]]
+lock = threading.RLock()
+
+
+class LiveMessage:
+    """
+    Status message kept updated with results of status sweeps.
+    """
+    __slots__ = ('chat_id', 'message_id', 'kind', 'api_id', 'text', 'expires')
+
+    def __init__(self, chat_id: int, message_id: int, kind: str, api_id: int, expires: float):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.kind = kind
+        self.api_id = api_id
+        self.text = None
+        self.expires = expires
+
+    @property
+    def key(self) -> Tuple[int, int]:
+        return self.chat_id, self.message_id
+
+    def __repr__(self):
+        return f'LiveMessage{{{self.chat_id}, {self.message_id}, {self.kind}, api={self.api_id}}}'
+
+
+class LiveMixin:
+    live_duration = 3600.0
+    # Edits allowed across all live messages, to keep below Telegram limits
+    live_edits = TokenBucket(rate=5.0, capacity=30.0)
+
+    @property
+    def live_renderers(self):
+        return {'ether': self.ether_status_text, 'storj': self.storj_status_text, 'miner': self.miner_status_text}
+
+    @staticmethod
+    def live_markup(kind: str, api_id: int, active: bool = False) -> InlineKeyboardMarkup:
+        if active:
+            button = InlineKeyboardButton('Stop live', callback_data=f'[live_off][{kind}][{api_id}]')
+        else:
+            button = InlineKeyboardButton('Live', callback_data=f'[live_on][{kind}][{api_id}]')
+
+        return InlineKeyboardMarkup([[button]])
+
+    def live_toggle(self, bot, update, groups):
+        """
+        Start or stop updating a status message.
+        """
+        query = update.callback_query
+        action, kind, api_id = groups[0], groups[1], int(groups[2])
+        chat_id = query.message.chat_id
+        message_id = query.message.message_id
+
+        with lock:
+            if action == 'on':
+                message = LiveMessage(chat_id, message_id, kind, api_id, time.monotonic() + self.live_duration)
+                live_messages.setdefault(api_id, {})[message.key] = message
+            else:
+                live_messages.get(api_id, {}).pop((chat_id, message_id), None)
+
+        bot.answer_callback_query(query.id, text='Live updates enabled' if action == 'on' else 'Live updates stopped')
+        bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id,
+                                      reply_markup=self.live_markup(kind, api_id, active=action == 'on'))
+
+    def live_endpoints(self, api) -> Set[str]:
+        """
+        Endpoints that must be retrieved in a sweep to update live messages of an API.
+        """
+        with lock:
+            return {LIVE_ENDPOINTS[m.kind] for m in live_messages.get(api.id, {}).values()}
+
+    def live_update(self, bot, api, snapshot):
+        """
+        Update live messages of an API from a snapshot. Messages are only edited when its text changes and while
+        there is edit budget left, otherwise they are updated in next sweep.
+        """
+        now = time.monotonic()
+
+        with lock:
+            messages = list(live_messages.get(api.id, {}).values())
+
+        for message in messages:
+            if now >= message.expires:
+                self._live_remove(message)
+                continue
+
+            try:
+                text = self.live_renderers[message.kind](api, snapshot[LIVE_ENDPOINTS[message.kind]])
+            except BarreneroRequestException as e:
+                text = f'*API {api.name}*\n{e.message}'
+
+            if text == message.text:
+                continue
+
+            if not self.live_edits.consume():
+                self.logger.debug('Live edits budget exhausted')
+                break
+
+            try:
+                bot.edit_message_text(text=text, parse_mode=ParseMode.MARKDOWN, chat_id=message.chat_id,
+                                      message_id=message.message_id,
+                                      reply_markup=self.live_markup(message.kind, api.id, active=True))
+                message.text = text
+            except BadRequest as e:
+                if 'not modified' in e.message:
+                    message.text = text
+                else:
+                    # Message deleted or too old to be edited
+                    self.logger.debug('Cannot update %s: %s', message, e.message)
+                    self._live_remove(message)
+
+    def _live_remove(self, message: LiveMessage):
+        with lock:
+            live_messages.get(message.api_id, {}).pop(message.key, None)
+            if not live_messages.get(message.api_id, True):
+                del live_messages[message.api_id]
+
+    def add_live_command(self):
+        self.updater.dispatcher.add_handler(CallbackQueryHandler(self.live_toggle, pass_groups=True,
+                                                                 pattern=r'\[live_(on|off)\]\[(\w+)\]\[(\d+)\]'))
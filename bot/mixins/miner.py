@@ -5,6 +5,7 @@ from telegram.ext import CallbackQueryHandler, CommandHandler
 from bot.api import Barrenero
 from bot.exceptions import BarreneroRequestException
 from bot.models import API, Chat
+from bot.utils import stale_text
 
 
 class MinerMixin:
@@ -44,33 +45,38 @@ class MinerMixin:
         try:
             api = API.get(id=api_id)
 
-            data = Barrenero.miner(api.url, api.token)
+            data, age = Barrenero.fetch_or_stale(api.url, api.token, 'status')
 
-            response_text = f'*API {api.name}*\n'
-            response_text += '*Services*\n'
-            response_text += '\n'.join([f' - {service["name"]}: `{service["status"]}`'
-                                        for service in data['services']])
-
-            for graphic in data['graphics']:
-                response_text += f'\n\n*Graphic card #{graphic["id"]}*\n'
-                response_text += f' - Power: `{graphic["power"]} W`\n'
-                response_text += f' - Fan speed: `{graphic["fan"]} %`\n'
-                response_text += f' - GPU: `{graphic["gpu_usage"]} %` - `{graphic["gpu_clock"]} Mhz`\n'
-                response_text += f' - MEM: `{graphic["mem_usage"]} %` - `{graphic["mem_clock"]} Mhz`'
+            response_text = self.miner_status_text(api, data) + stale_text(age)
+            reply_markup = self.live_markup('miner', api.id)
         except peewee.DoesNotExist:
             self.logger.error('Chat unregistered')
             response_text = 'Configure me first'
+            reply_markup = None
         except BarreneroRequestException as e:
             self.logger.exception(e.message)
-            response_text = f'*API {api.name} - Ether miner*\n{e.message}'
-        except:
-            response_text = f'*API {api.name} - Ether miner*\nCannot retrieve Ether miner status'
-            self.logger.exception('Barrenero API wrong response for Ether miner status: %s', str(data))
+            response_text = f'*API {api.name} - Miner*\n{e.message}'
+            reply_markup = None
 
         bot.edit_message_text(text=response_text, parse_mode=ParseMode.MARKDOWN, chat_id=chat_id,
-                              message_id=query.message.message_id)
+                              message_id=query.message.message_id, reply_markup=reply_markup)
+
+    @staticmethod
+    def miner_status_text(api, data) -> str:
+        response_text = f'*API {api.name}*\n'
+        response_text += '*Services*\n'
+        response_text += '\n'.join([f' - {service.name}: `{service.status}`' for service in data.services])
+
+        for graphic in data.graphics:
+            response_text += f'\n\n*Graphic card #{graphic.id}*\n'
+            response_text += f' - Power: `{graphic.power} W`\n'
+            response_text += f' - Fan speed: `{graphic.fan} %`\n'
+            response_text += f' - GPU: `{graphic.gpu_usage} %` - `{graphic.gpu_clock} Mhz`\n'
+            response_text += f' - MEM: `{graphic.mem_usage} %` - `{graphic.mem_clock} Mhz`'
+
+        return response_text
 
     def add_miner_command(self):
         self.updater.dispatcher.add_handler(CommandHandler('miner', self.miner))
-        self.updater.dispatcher.add_handler(CallbackQueryHandler(self.miner_status, pass_groups=True,
+        self.updater.dispatcher.add_handler(CallbackQueryHandler(self.fair(self.miner_status), pass_groups=True,
                                                                  pattern=r'\[miner_status\]\[(\d+)\]'))
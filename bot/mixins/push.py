@@ -0,0 +1,228 @@
+import hashlib
+import hmac
+import json
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from bot.models import API, Chat, db
+from bot.state_machine import StatusStateMachine
+from bot.stats import recorder
+
+# Services that rigs can push events for, and the mixin method recording them
+PUSH_SERVICES = {
+    'ether': 'ether_observe',
+    'storj': 'storj_observe',
+}
+
+
+class PushServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler, bot):
+        super().__init__(address, handler)
+        self.bot = bot
+
+
+class PushRequestHandler(BaseHTTPRequestHandler):
+    """
+    Receives status change events pushed by rigs:
+
+        POST /events/
+        X-Barrenero-Signature: <hex HMAC-SHA256 of body using push secret>
+
+        {"id": "<unique event id>", "url": "<Barrenero API url>", "service": "ether", "active": false,
+         "timestamp": <unix time>}
+    """
+    max_body = 4096
+    max_id = 128
+    # Seconds a client can take to send a request before its connection is closed
+    timeout = 10
+
+    def do_POST(self):
+        bot = self.server.bot
+        if self.path.rstrip('/') != '/events':
+            self.send_error(404)
+            return
+
+        if 'Content-Length' not in self.headers:
+            self.send_error(411)
+            return
+
+        try:
+            length = int(self.headers['Content-Length'])
+        except ValueError:
+            self.send_error(400)
+            return
+
+        if length <= 0:
+            self.send_error(400)
+            return
+
+        if length > self.max_body:
+            self.send_error(413)
+            return
+
+        body = self.rfile.read(length)
+        if not bot.push_authenticate(body, self.headers.get('X-Barrenero-Signature', '')):
+            self.send_error(401)
+            return
+
+        try:
+            event = json.loads(body.decode())
+            event_id, url, service, active = event['id'], event['url'].rstrip('/'), event['service'], event['active']
+            timestamp = float(event['timestamp'])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.send_error(400)
+            return
+
+        if service not in PUSH_SERVICES or not isinstance(active, bool) or not isinstance(event_id, str) or \
+                not 0 < len(event_id) <= self.max_id:
+            self.send_error(400)
+            return
+
+        # Reject events replayed out of its time window, and events already received within it
+        if abs(time.time() - timestamp) > bot.push_max_skew:
+            self.send_error(401)
+            return
+
+        if not bot.push_unseen_id(event_id, timestamp):
+            self.send_error(409)
+            return
+
+        received = bot.push_event(url, service, active)
+        self.send_response(202 if received else 404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        self.server.bot.logger.debug('Push: ' + format, *args)
+
+
+class PushMixin:
+    """
+    HTTP endpoint where rigs push status change events, so failures are detected as soon as they happen. When it is
+    enabled status sweeps become a slow reconciliation of APIs that did not push anything lately.
+    """
+    push_max_skew = 300.0
+    push_reconcile_interval = 1800.0
+
+    def _push_init(self, port: int = None, secret: str = None, reconcile_interval: float = None):
+        self._push_port = port
+        self._push_secret = secret.encode() if secret else None
+        if reconcile_interval is not None:
+            self.push_reconcile_interval = reconcile_interval
+        self._push_server = None
+        # Last event pushed by every rig, and last reconciliation sweep of rigs that push events, by url
+        self._push_seen = {}
+        self._push_swept = {}
+        # Ids of events received within the time window and when they leave it, oldest first
+        self._push_ids = OrderedDict()
+        self._push_lock = threading.Lock()
+
+    @property
+    def push_enabled(self) -> bool:
+        return self._push_port is not None and self._push_secret is not None
+
+    def push_authenticate(self, body: bytes, signature: str) -> bool:
+        expected = hmac.new(self._push_secret, body, hashlib.sha256).hexdigest().encode()
+        # Compared as bytes, as comparing strings fails with non ASCII chars
+        return hmac.compare_digest(expected, signature.strip().lower().encode('utf-8'))
+
+    def push_unseen_id(self, event_id: str, timestamp: float) -> bool:
+        """
+        Record the id of an event, returning False if it was already received. Ids are kept while their events are
+        within the time window, as older events are rejected anyway.
+        """
+        now = time.time()
+        with self._push_lock:
+            while self._push_ids and next(iter(self._push_ids.values())) < now:
+                self._push_ids.popitem(last=False)
+
+            if event_id in self._push_ids:
+                return False
+
+            self._push_ids[event_id] = timestamp + self.push_max_skew
+            return True
+
+    def push_event(self, url: str, service: str, active: bool) -> bool:
+        """
+        Record a pushed status in every chat using the rig. A pushed event is conclusive, so it counts as enough
+        checks to change status right away.
+        """
+        # Every request runs in its own thread, so its pooled connection is given back once done
+        with db.connection_context():
+            apis = list(API.select()
+                        .where(API.url.in_([url, url + '/']) & (API.superuser == True))
+                        .join(Chat)
+                        .where(self.own_chats))
+            self.logger.info('Push: %s %s active=%s (%d APIs)', url, service, active, len(apis))
+
+            observe = getattr(self, PUSH_SERVICES[service])
+            for api in apis:
+                observe(self.updater.bot, api, active, count=StatusStateMachine.threshold)
+                recorder.record_check(api.id, service, active)
+
+        if apis:
+            self.push_seen(url)
+
+        return bool(apis)
+
+    def push_seen(self, url: str):
+        with self._push_lock:
+            self._push_seen[url] = time.monotonic()
+
+    def push_swept(self, api):
+        """
+        Record a status sweep of an API, which reconciles its status if its rig pushes events.
+        """
+        url = api.url.rstrip('/')
+        with self._push_lock:
+            if url in self._push_seen:
+                self._push_swept[url] = time.monotonic()
+
+    def push_reconciling(self, api) -> bool:
+        """
+        Whether sweeping an API now reconciles the status of a rig that pushes events.
+        """
+        if not self.push_enabled:
+            return False
+
+        with self._push_lock:
+            pushed = api.url.rstrip('/') in self._push_seen
+
+        return pushed and self.push_due(api)
+
+    def push_due(self, api) -> bool:
+        """
+        Whether an API has to be swept. Rigs that never pushed an event are swept every time, the rest only to
+        reconcile their status once in a while.
+        """
+        if not self.push_enabled:
+            return True
+
+        url = api.url.rstrip('/')
+        with self._push_lock:
+            seen = self._push_seen.get(url)
+            if seen is None:
+                return True
+
+            last = max(seen, self._push_swept.get(url, seen))
+
+        return time.monotonic() - last >= self.push_reconcile_interval
+
+    def add_push_listener(self):
+        if not self.push_enabled:
+            return
+
+        self._push_server = PushServer(('0.0.0.0', self._push_port), PushRequestHandler, self)
+        threading.Thread(target=self._push_server.serve_forever, name='push_listener', daemon=True).start()
+        self.logger.info('Listening rig events 0.0.0.0:%d', self._push_port)
+
+    def stop_push_listener(self):
+        if self._push_server is not None:
+            self._push_server.shutdown()
+            self._push_server.server_close()
+            self._push_server = None
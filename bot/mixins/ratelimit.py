@@ -0,0 +1,87 @@
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import wraps
+from typing import Callable
+
+from telegram import Update
+from telegram.ext import DispatcherHandlerStop, TypeHandler
+
+from bot.scheduling import FairScheduler, QueueFull
+from bot.utils import TokenBucket
+
+
+class RateLimitMixin:
+    """
+    Limits requests per chat and runs expensive handlers through a fair scheduler, so a single chat cannot degrade
+    response times for the rest.
+    """
+    rate_limit_rate = 0.5  # Requests per second allowed per chat
+    rate_limit_burst = 5.0
+    rate_limit_chats = 4096  # Buckets kept in memory
+    rate_limit_notice_interval = 30.0
+    rate_limit_text = 'Too many requests, please wait a moment'
+
+    def _rate_limit_init(self, workers: int = 4):
+        self._buckets = OrderedDict()
+        # Last rejection notice by chat, evicted along with its bucket
+        self._notices = {}
+        self.scheduler = FairScheduler(workers=workers, max_pending=int(self.rate_limit_burst))
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(rate=self.rate_limit_rate, capacity=self.rate_limit_burst)
+            while len(self._buckets) > self.rate_limit_chats:
+                evicted, _ = self._buckets.popitem(last=False)
+                self._notices.pop(evicted, None)
+        else:
+            self._buckets.move_to_end(chat_id)
+
+        return bucket
+
+    def _rate_limit_reject(self, bot, update):
+        """
+        Cheap reply for rejected requests, not touching database nor Barrenero APIs.
+        """
+        chat_id = update.effective_chat.id
+        if update.callback_query:
+            bot.answer_callback_query(update.callback_query.id, text=self.rate_limit_text)
+        elif time.monotonic() - self._notices.get(chat_id, 0) > self.rate_limit_notice_interval:
+            self._notices[chat_id] = time.monotonic()
+            bot.send_message(chat_id, self.rate_limit_text)
+
+    def rate_limit(self, bot, update):
+        """
+        Drop updates from chats that exceed their request rate.
+        """
+        if update.effective_chat and (update.message or update.callback_query):
+            if not self._bucket(update.effective_chat.id).consume():
+                self.logger.debug('Rate limit exceeded for Chat %s', update.effective_chat.id)
+                self._rate_limit_reject(bot, update)
+                raise DispatcherHandlerStop()
+
+    def fair(self, callback: Callable) -> Callable:
+        """
+        Wraps a handler callback to run it in the fair scheduler, queued by chat.
+        """
+        @wraps(callback)
+        def wrapper(bot, update, *args, **kwargs):
+            try:
+                future = self.scheduler.submit(update.effective_chat.id, callback, bot, update, *args, **kwargs)
+            except QueueFull:
+                self._rate_limit_reject(bot, update)
+            else:
+                future.add_done_callback(lambda f: self._fair_done(callback, f))
+
+        return wrapper
+
+    def _fair_done(self, callback: Callable, future: Future):
+        error = future.exception()
+        if error is not None:
+            self.logger.error('Error running handler %s', callback.__name__,
+                              exc_info=(type(error), error, error.__traceback__))
+
+    def add_rate_limit(self):
+        # Checked before any other handler group
+        self.updater.dispatcher.add_handler(TypeHandler(Update, self.rate_limit), group=-1)
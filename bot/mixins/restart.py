@@ -0,0 +1,150 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from typing import Callable, Dict, List
+
+from telegram import ParseMode
+from telegram.error import BadRequest
+
+from bot.api import Barrenero
+from bot.exceptions import BarreneroRequestException
+from bot.models import API
+from bot.scheduling import tenant
+
+# Polls run here so waiting for rigs never blocks the job queue thread
+executor = ThreadPoolExecutor(max_workers=4)
+
+
+class RestartState(Enum):
+    RESTARTING = 'Restarting'
+    ACTIVE = 'Active'
+    FAILED = 'Cannot restart'
+    TIMEOUT = 'Timeout'
+
+
+class Restart:
+    """
+    Progress of a service restart across several APIs, reported in a single message.
+    """
+    __slots__ = ('service', 'chat_id', 'message_id', 'apis', 'states', 'deadline', 'text', 'requested',
+                 'requested_at', 'stopped', 'polling', 'keys')
+
+    def __init__(self, service: str, chat_id: int, message_id: int, apis: List[API], timeout: float):
+        self.service = service
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.apis = apis
+        self.states = {api.id: RestartState.RESTARTING for api in apis}  # type: Dict[int, RestartState]
+        self.deadline = time.monotonic() + timeout
+        self.text = None
+        self.requested = False
+        self.requested_at = None
+        # APIs seen not running since restart was requested
+        self.stopped = set()
+        # Held while a poll is running, so slow rigs never cause overlapping polls
+        self.polling = threading.Lock()
+        # Idempotency key of the restart request sent to every API, so retrying it never restarts a service twice
+        self.keys = {api.id: uuid.uuid4().hex for api in apis}  # type: Dict[int, str]
+
+    @property
+    def pending(self) -> List[API]:
+        return [api for api in self.apis if self.states[api.id] == RestartState.RESTARTING]
+
+    def render(self) -> str:
+        return f'*Restarting {self.service}*\n' + \
+               '\n'.join(f' - {api.name}: `{self.states[api.id].value}`' for api in self.apis)
+
+
+class RestartMixin:
+    restart_poll_interval = 10.0
+    restart_timeout = 180.0
+    # A rig not seen stopped is only considered restarted after this delay, as it may still report its previous status
+    restart_min_delay = 30.0
+    restart_checks = {
+        'Ether': lambda api: Barrenero.ether(api.url, api.token, fresh=True).active,
+        'Storj': lambda api: Barrenero.storj(api.url, api.token, fresh=True).running,
+    }  # type: Dict[str, Callable[[API], bool]]
+
+    def restart_service(self, bot, chat_id: int, message_id: int, apis: List[API], service: str):
+        """
+        Restart a service in given APIs and keep polling them until they are active again or timeout expires.
+        Progress is shown editing given message.
+        """
+        restart = Restart(service, chat_id, message_id, apis, self.restart_timeout)
+        self._restart_update_message(bot, restart)
+        self.updater.job_queue.run_repeating(self._restart_job_poll, interval=self.restart_poll_interval, first=0,
+                                             context=restart)
+
+    def _restart_request(self, restart: Restart, api: API) -> RestartState:
+        try:
+            Barrenero.restart(api.url, api.token, restart.service, idempotency_key=restart.keys[api.id])
+        except BarreneroRequestException:
+            self.logger.exception('Cannot restart API %s %s miner', api.name, restart.service)
+            return RestartState.FAILED
+
+        return RestartState.RESTARTING
+
+    def _restart_check(self, restart: Restart, api: API) -> RestartState:
+        try:
+            active = self.restart_checks[restart.service](api)
+        except BarreneroRequestException:
+            active = False
+
+        if not active:
+            restart.stopped.add(api.id)
+            return RestartState.RESTARTING
+
+        if api.id in restart.stopped or time.monotonic() - restart.requested_at >= self.restart_min_delay:
+            return RestartState.ACTIVE
+
+        return RestartState.RESTARTING
+
+    def _restart_job_poll(self, bot, job):
+        restart = job.context
+
+        if not restart.polling.acquire(blocking=False):
+            self.logger.debug('Previous %s restart poll still running', restart.service)
+            return
+
+        executor.submit(self._restart_poll, bot, job, restart)
+
+    def _restart_poll(self, bot, job, restart: Restart):
+        try:
+            # Requests are queued as made for the chat that asked for the restart
+            with tenant(restart.chat_id):
+                if not restart.requested:
+                    # Send restart requests concurrently, bounded by client pool size
+                    results = Barrenero.executor.map(lambda a: self._restart_request(restart, a), restart.apis)
+                    restart.states.update({api.id: state for api, state in zip(restart.apis, results)})
+                    restart.requested = True
+                    restart.requested_at = time.monotonic()
+                else:
+                    pending = restart.pending
+                    results = Barrenero.executor.map(lambda a: self._restart_check(restart, a), pending)
+                    restart.states.update({api.id: state for api, state in zip(pending, results)})
+
+                    if time.monotonic() >= restart.deadline:
+                        restart.states.update({api.id: RestartState.TIMEOUT for api in restart.pending})
+
+            self._restart_update_message(bot, restart)
+
+            if not restart.pending:
+                job.schedule_removal()
+        except Exception:
+            self.logger.exception('Cannot poll %s restart', restart.service)
+        finally:
+            restart.polling.release()
+
+    def _restart_update_message(self, bot, restart: Restart):
+        text = restart.render()
+        if text == restart.text:
+            return
+
+        try:
+            bot.edit_message_text(text=text, parse_mode=ParseMode.MARKDOWN, chat_id=restart.chat_id,
+                                  message_id=restart.message_id)
+            restart.text = text
+        except BadRequest:
+            self.logger.exception('Cannot update restart progress message')
@@ -1,13 +1,65 @@
+import csv
+import io
+from concurrent.futures import TimeoutError
 from enum import Enum, IntEnum
+from typing import Any, Dict, List
 
 import peewee
 from telegram import ParseMode, ReplyKeyboardMarkup
 from telegram.ext import CommandHandler, ConversationHandler, Filters, MessageHandler
 from telegram.ext.regexhandler import RegexHandler
 
-from bot.api import Barrenero
+from bot.api import Barrenero, Deadline
+from bot.drafts import DraftStore
 from bot.exceptions import BarreneroRequestException
-from bot.models import API, Chat
+from bot.models import API, Chat, db
+from bot.stats import recorder
+
+try:
+    import yaml
+except ImportError:  # pragma: no cover
+    yaml = None
+
+IMPORT_FIELDS = ('url', 'name', 'username', 'password', 'wallet', 'api_password')
+IMPORT_MAX_SIZE = 2 ** 20
+# Seconds an import waits for APIs to register, rows not registered by then fail
+IMPORT_TIMEOUT = 60.0
+
+
+def parse_api_list(text: str) -> List[Dict[str, Any]]:
+    """
+    Parse a list of Barrenero APIs, either as CSV with a header row or as a YAML list of mappings, using
+    IMPORT_FIELDS as keys.
+    """
+    if yaml is not None and text.lstrip().startswith('-'):
+        rows = yaml.safe_load(text)
+    else:
+        rows = list(csv.DictReader(io.StringIO(text.strip())))
+
+    if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+        raise ValueError('Wrong APIs list format')
+
+    apis = []
+    for row in rows:
+        missing = [f for f in IMPORT_FIELDS if f not in row]
+        if missing:
+            raise ValueError(f'Missing fields: {", ".join(missing)}')
+
+        api = {f: str(row[f]).strip() if row[f] is not None else None for f in IMPORT_FIELDS}
+        api['url'] = api['url'].rstrip('/')
+        apis.append(api)
+
+    return apis
+
+
+def valid_wallet(wallet: str) -> bool:
+    """
+    Wallet address must begin with 0x followed by 40 hexadecimal chars.
+    """
+    try:
+        return wallet.startswith('0x') and len(wallet) == 42 and int(wallet, 16) >= 0
+    except ValueError:
+        return False
 
 
 class StartState(IntEnum):
@@ -20,11 +72,13 @@ class StartState(IntEnum):
     CHOICE_WALLET = 7
     CHOICE_SUPERUSER = 8
     CHOICE_REMOVE_API = 9
+    CHOICE_IMPORT_API = 10
 
 
 class StartOptions(Enum):
     ADD_API = 'Add API'
     REMOVE_API = 'Remove API'
+    IMPORT_API = 'Import APIs'
     CURRENT_CONFIG = 'Show current config'
     URL = 'API URL'
     NAME = 'API Name'
@@ -37,16 +91,40 @@ class StartOptions(Enum):
     FINISH = 'Finish'
 
 
+class DraftConversationHandler(ConversationHandler):
+    """
+    Conversation handler that persists its state in a draft store.
+    """
+
+    def __init__(self, *args, drafts: DraftStore, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.drafts = drafts
+
+    def restore(self):
+        """
+        Resume conversations persisted before last restart.
+        """
+        self.conversations.update(self.drafts.states())
+
+    def update_state(self, new_state, key):
+        super().update_state(new_state, key)
+
+        if new_state == self.END:
+            self.drafts.delete(key[0])
+        elif isinstance(new_state, int):
+            self.drafts.set_state(key, new_state)
+
+
 class StartMixin:
     def __init__(self):
-        # Config dict for keeping temporal data before registering in API
-        self.tmp_config = {}
+        # Keeps conversation state and temporal data before registering in API
+        self.drafts = DraftStore()
 
     def start(self, bot, update):
         """
         Start bot configuration.
         """
-        keyboard = ((StartOptions.ADD_API.value,),
+        keyboard = ((StartOptions.ADD_API.value, StartOptions.IMPORT_API.value),
                     (StartOptions.REMOVE_API.value,),
                     (StartOptions.CURRENT_CONFIG.value, StartOptions.FINISH.value,))
         markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True)
@@ -127,7 +205,7 @@ class StartMixin:
         Shows current config.
         """
         chat_id = update.message.chat_id
-        tmp_config = self.tmp_config.get(chat_id, {})
+        tmp_config = self.drafts.get(chat_id)
 
         response_text = f'*New Configuration*\n' \
                         f' - URL: `{tmp_config.get("url", "Not configured")}`\n' \
@@ -145,13 +223,10 @@ class StartMixin:
         text = update.message.text
         chat_id = update.message.chat_id
 
-        if chat_id not in self.tmp_config:
-            self.tmp_config[chat_id] = {}
-
         if text[-1] == '/':
             text = text[:-1]
 
-        self.tmp_config[chat_id]['url'] = text
+        self.drafts.update(chat_id, url=text)
 
         update.message.reply_text('Keep Barrenero API *url*', parse_mode=ParseMode.MARKDOWN)
 
@@ -161,10 +236,7 @@ class StartMixin:
         text = update.message.text
         chat_id = update.message.chat_id
 
-        if chat_id not in self.tmp_config:
-            self.tmp_config[chat_id] = {}
-
-        self.tmp_config[chat_id]['name'] = text
+        self.drafts.update(chat_id, name=text)
 
         update.message.reply_text('Keep Barrenero API *name*', parse_mode=ParseMode.MARKDOWN)
 
@@ -174,10 +246,7 @@ class StartMixin:
         text = update.message.text
         chat_id = update.message.chat_id
 
-        if chat_id not in self.tmp_config:
-            self.tmp_config[chat_id] = {}
-
-        self.tmp_config[chat_id]['username'] = text
+        self.drafts.update(chat_id, username=text)
 
         update.message.reply_text('Keep *username* for registering in API', parse_mode=ParseMode.MARKDOWN)
 
@@ -187,10 +256,7 @@ class StartMixin:
         text = update.message.text
         chat_id = update.message.chat_id
 
-        if chat_id not in self.tmp_config:
-            self.tmp_config[chat_id] = {}
-
-        self.tmp_config[chat_id]['password'] = text
+        self.drafts.update(chat_id, password=text)
 
         update.message.reply_text('Keep *password* for registering in API', parse_mode=ParseMode.MARKDOWN)
 
@@ -203,18 +269,11 @@ class StartMixin:
         text = update.message.text
         chat_id = update.message.chat_id
 
-        try:
-            assert text.startswith('0x')
-            assert len(text) == 42
-            assert int(text, 16)
-
-            if chat_id not in self.tmp_config:
-                self.tmp_config[chat_id] = {}
-
-            self.tmp_config[chat_id]['wallet'] = text
+        if valid_wallet(text):
+            self.drafts.update(chat_id, wallet=text)
 
             response_text = 'Your *Wallet* address has been configured properly.'
-        except AssertionError:
+        else:
             response_text = f'Wallet address `{text}` is wrong.\n' \
                             f'It must begin with `0x` and have an exact length of 40 chars.'
 
@@ -226,10 +285,7 @@ class StartMixin:
         text = update.message.text
         chat_id = update.message.chat_id
 
-        if chat_id not in self.tmp_config:
-            self.tmp_config[chat_id] = {}
-
-        self.tmp_config[chat_id]['api_password'] = text
+        self.drafts.update(chat_id, api_password=text)
 
         update.message.reply_text('Keep *superuser password* for registering in API', parse_mode=ParseMode.MARKDOWN)
 
@@ -242,31 +298,154 @@ class StartMixin:
         chat_id = update.message.chat_id
 
         try:
-            chat, _ = Chat.get_or_create(id=chat_id, defaults={'last_transaction': None})
+            tmp_config = self.drafts.get(chat_id)
+            chat, _ = Chat.get_or_create(id=chat_id, defaults={'last_transaction': None, 'bot': self.bot_id})
 
             config = Barrenero.get_token_or_register(
-                url=self.tmp_config[chat_id]['url'],
-                username=self.tmp_config[chat_id]['username'],
-                password=self.tmp_config[chat_id]['password'],
-                account=self.tmp_config[chat_id]['wallet'],
-                api_password=self.tmp_config[chat_id]['api_password'],
+                url=tmp_config['url'],
+                username=tmp_config['username'],
+                password=tmp_config['password'],
+                account=tmp_config['wallet'],
+                api_password=tmp_config['api_password'],
             )
 
             API.create(
-                name=self.tmp_config[chat_id]['name'],
-                url=self.tmp_config[chat_id]['url'],
+                name=tmp_config['name'],
+                url=tmp_config['url'],
                 token=config['token'],
                 superuser=config['superuser'],
+                wallet=tmp_config['wallet'],
                 chat=chat
             )
         except:
             self.logger.exception('Cannot register Barrenero API')
             update.message.reply_text('Cannot register Barrenero API')
         else:
+            self.drafts.delete(chat_id)
             update.message.reply_text('Api stored successfully')
 
         return self.start(bot, update)
 
+    def _import_api_choice(self, bot, update):
+        """
+        Asks for a list of Barrenero APIs.
+        """
+        fields = ','.join(IMPORT_FIELDS)
+        markup = ReplyKeyboardMarkup(((StartOptions.DONE.value,),), one_time_keyboard=True)
+        update.message.reply_text(f'Paste or upload a CSV list of Barrenero APIs with header:\n`{fields}`'
+                                  + ('\nA YAML list with those keys is also accepted.' if yaml is not None else ''),
+                                  parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+
+        return StartState.CHOICE_IMPORT_API
+
+    def _import_api_register(self, config: Dict[str, Any]) -> Dict[str, Any]:
+        return Barrenero.get_token_or_register(url=config['url'], username=config['username'],
+                                               password=config['password'], account=config['wallet'],
+                                               api_password=config['api_password'])
+
+    def _import_api_config(self, bot, update):
+        """
+        Registers every new API from the list concurrently and stores them in a single transaction, reporting the
+        result of every row. APIs already configured or repeated in the list are skipped.
+        """
+        chat_id = update.message.chat_id
+        document = update.message.document
+
+        try:
+            if document:
+                if document.file_size and document.file_size > IMPORT_MAX_SIZE:
+                    raise ValueError('File too large')
+
+                content = io.BytesIO()
+                bot.get_file(document.file_id).download(out=content)
+                text = content.getvalue().decode('utf-8')
+            else:
+                text = update.message.text
+
+            configs = parse_api_list(text)
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            update.message.reply_text(f'Cannot read APIs list: {e}')
+            return StartState.CHOICE_IMPORT_API
+        except Exception:
+            self.logger.exception('Cannot read APIs list')
+            update.message.reply_text('Cannot read APIs list')
+            return StartState.CHOICE_IMPORT_API
+
+        try:
+            chat, _ = Chat.get_or_create(id=chat_id, defaults={'last_transaction': None, 'bot': self.bot_id})
+            existing = {(a.url, a.name) for a in chat.apis}
+        except peewee.PeeweeException:
+            self.logger.exception('Cannot read configured Barrenero APIs')
+            update.message.reply_text('Cannot import Barrenero APIs')
+            return StartState.CHOICE_IMPORT_API
+
+        # Result of every row as (config, status, reason), keeping list order
+        results = []
+        listed = set()
+        for config in configs:
+            key = (config['url'], config['name'])
+            config['wallet'] = config['wallet'] or None
+            if key in existing:
+                results.append((config, 'skipped', 'already configured'))
+            elif key in listed:
+                results.append((config, 'skipped', 'repeated in list'))
+            elif config['wallet'] is not None and not valid_wallet(config['wallet']):
+                results.append((config, 'failed', 'wrong wallet address'))
+            else:
+                results.append((config, None, None))
+            listed.add(key)
+
+        # Register or login in every new API concurrently, waiting for all of them up to IMPORT_TIMEOUT
+        deadline = Deadline(IMPORT_TIMEOUT)
+        futures = {i: Barrenero.executor.submit(self._import_api_register, config)
+                   for i, (config, status, _) in enumerate(results) if status is None}
+
+        registered = {}
+        for i, future in futures.items():
+            config = results[i][0]
+            try:
+                registered[i] = future.result(timeout=deadline.remaining)
+            except TimeoutError:
+                future.cancel()
+                self.logger.error('Timeout registering Barrenero API %s', config['url'])
+                results[i] = (config, 'failed', 'timed out')
+            except BarreneroRequestException:
+                self.logger.exception('Cannot register Barrenero API %s', config['url'])
+                results[i] = (config, 'failed', 'cannot register')
+            except Exception:
+                self.logger.exception('Wrong response registering Barrenero API %s', config['url'])
+                results[i] = (config, 'failed', 'wrong response')
+
+        # Every row is stored in a savepoint, so a row already configured meanwhile does not abort the rest
+        try:
+            with db.atomic():
+                for i, result in registered.items():
+                    config = results[i][0]
+                    try:
+                        with db.atomic():
+                            API.create(name=config['name'], url=config['url'], token=result['token'],
+                                       superuser=result['superuser'], wallet=config['wallet'], chat=chat)
+                    except peewee.IntegrityError:
+                        results[i] = (config, 'skipped', 'already configured')
+                    else:
+                        results[i] = (config, 'stored', None)
+        except peewee.PeeweeException:
+            self.logger.exception('Cannot store Barrenero APIs')
+            for i in registered:
+                if results[i][1] == 'stored':
+                    results[i] = (results[i][0], 'failed', 'cannot store')
+
+        counts = {status: sum(1 for _, s, _ in results if s == status) for status in ('stored', 'skipped', 'failed')}
+        response_text = f'*Import completed*\n - Stored: `{counts["stored"]}`\n - Skipped: `{counts["skipped"]}`\n' \
+                        f' - Failed: `{counts["failed"]}`'
+        not_stored = [(c, r) for c, s, r in results if s != 'stored']
+        if not_stored:
+            response_text += '\n\n*Not stored*\n' + '\n'.join(f' - {c["name"]}: `{c["url"]}` ({r})'
+                                                             for c, r in not_stored)
+        update.message.reply_text(response_text, parse_mode=ParseMode.MARKDOWN)
+
+        return self.start(bot, update)
+
     def _remove_api_choice(self, bot, update):
         """
         Asks for removing a Barrenero API already configured.
@@ -301,6 +480,9 @@ class StartMixin:
             api = API.get(id=text, chat=chat)
             name = api.name
             api.delete_instance()
+            self.ether_forget(api)
+            self.storj_forget(api)
+            recorder.forget(api.id)
             update.message.reply_text(f'Barrenero API `{name}` removed successfully', parse_mode=ParseMode.MARKDOWN)
         except:
             self.logger.exception('Cannot remove Barrenero API')
@@ -346,12 +528,14 @@ class StartMixin:
         Setup the bot
         """
         # Start command
-        self.updater.dispatcher.add_handler(ConversationHandler(
+        self._start_handler = DraftConversationHandler(
+            drafts=self.drafts,
             entry_points=[CommandHandler('start', self.start)],
             states={
                 StartState.CHOICE_ROOT: [
                     RegexHandler(f'^{StartOptions.ADD_API.value}$', self._add_api_choice),
                     RegexHandler(f'^{StartOptions.REMOVE_API.value}$', self._remove_api_choice),
+                    RegexHandler(f'^{StartOptions.IMPORT_API.value}$', self._import_api_choice),
                     RegexHandler(f'^{StartOptions.CURRENT_CONFIG.value}$', self._current_config_choice),
                 ],
                 StartState.CHOICE_ADD_API: [
@@ -368,6 +552,10 @@ class StartMixin:
                     RegexHandler(f'^{StartOptions.DONE.value}$', self.start),
                     MessageHandler(Filters.text, self._remove_api_config),
                 ],
+                StartState.CHOICE_IMPORT_API: [
+                    RegexHandler(f'^{StartOptions.DONE.value}$', self.start),
+                    MessageHandler(Filters.text | Filters.document, self._import_api_config)
+                ],
                 StartState.CHOICE_URL: [
                     MessageHandler(Filters.text, self._add_api_config_url)
                 ],
@@ -388,7 +576,19 @@ class StartMixin:
                 ]
             },
             fallbacks=[RegexHandler(f'^{StartOptions.FINISH.value}$', self._config_done_choice)]
-        ))
+        )
+        self.updater.dispatcher.add_handler(self._start_handler)
+
+    def _start_job_expire_drafts(self, bot, job):
+        """
+        Remove abandoned configurations.
+        """
+        self.logger.debug('Job: Expire drafts')
+        for key in self.drafts.expire():
+            self._start_handler.conversations.pop(key, None)
+
+    def add_start_jobs(self):
+        self.updater.job_queue.run_repeating(self._start_job_expire_drafts, interval=600.0)
 
 
 
@@ -8,6 +8,8 @@ from bot.api import Barrenero
 from bot.exceptions import BarreneroRequestException
 from bot.models import API, Chat
 from bot.state_machine import StatusStateMachine
+from bot.stats import recorder
+from bot.utils import stale_text
 
 status_machines = {}
 lock = threading.RLock()
@@ -49,6 +51,8 @@ class StorjMixin:
         if chat:
             buttons = [InlineKeyboardButton(api.name, callback_data=f'[storj_{action}][{api.id}]')
                        for api in chat.apis if api.superuser]
+            if action == 'restart' and len(buttons) > 1:
+                buttons.append(InlineKeyboardButton('All', callback_data='[storj_restart][all]'))
             keyboard = [buttons[i:max(len(buttons), i + 4)] for i in range(0, len(buttons), 4)]
             reply_markup = InlineKeyboardMarkup(keyboard)
         else:
@@ -62,7 +66,7 @@ class StorjMixin:
 
     def storj_restart(self, bot, update, groups):
         """
-        Restart storj service.
+        Restart Storj service in one or all APIs.
         """
         query = update.callback_query
         api_id = groups[0]
@@ -71,24 +75,16 @@ class StorjMixin:
         bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
 
         try:
-            api = API.get(id=api_id)
-
-            Barrenero.restart(api.url, api.token, 'Storj')
-
-            response_text = f'*API {api.name}*\n' \
-                            f'Restarting Storj.'
+            chat = Chat.get(id=chat_id)
+            if api_id == 'all':
+                apis = [api for api in chat.apis if api.superuser]
+            else:
+                apis = [API.get(id=api_id, chat=chat)]
         except peewee.DoesNotExist:
             self.logger.error('Chat unregistered')
-            response_text = 'Configure me first'
-        except BarreneroRequestException as e:
-            self.logger.exception(e.message)
-            response_text = e.message
-        except:
-            self.logger.exception('Cannot restart API %s Storj miner', api.name)
-            response_text = f'*API {api.name} - Storj miner*\nCannot restart miner'
-
-        bot.edit_message_text(text=response_text, parse_mode=ParseMode.MARKDOWN, chat_id=chat_id,
-                              message_id=query.message.message_id)
+            bot.edit_message_text(text='Configure me first', chat_id=chat_id, message_id=query.message.message_id)
+        else:
+            self.restart_service(bot, chat_id, query.message.message_id, apis, 'Storj')
 
     def storj_status(self, bot, update, groups):
         """
@@ -102,82 +98,89 @@ class StorjMixin:
 
         try:
             api = API.get(id=api_id)
-            data = Barrenero.storj(api.url, api.token)
-
-            nodes_status = []
-            for node in data:
-                shared = node['shared'] if node['shared'] is not None else 'Unknown'
-                shared_percent = f'{node["shared_percent"]}%' if node['shared_percent'] is not None else 'Unknown'
-                data_received = node['data_received'] if node['data_received'] is not None else 'Unknown'
-                delta = f'{node["delta"]:d} ms' if node['delta'] is not None else 'Unknown'
-                response_time = f'{node["response_time"]:.2f} ms' if node['response_time'] is not None else 'Unknown'
-                reputation = f'{node["reputation"]:d}/5000' if node['reputation'] is not None else 'Unknown'
-                version = node["version"] if node['version'] is not None else 'Unknown'
-                nodes_status.append(
-                    f'*Storj node #{node["id"]}*\n'
-                    f' - Status: `{node["status"]}`\n'
-                    f' - Uptime: `{node["uptime"]} ({node["restarts"]} restarts)`\n'
-                    f' - Shared: `{shared} ({shared_percent})`\n'
-                    f' - Data received: `{data_received}`\n'
-                    f' - Peers/Allocs: `{node["peers"]:d}` / `{node["allocs"]:d}`\n'
-                    f' - Delta: `{delta}`\n'
-                    f' - Path: `{node["config_path"]}`\n'
-                    f' - Response Time: `{response_time}`\n'
-                    f' - Reputation: `{reputation}`\n'
-                    f' - Version: `{version}`')
-            response_text = f'*API {api.name}*\n' + '\n\n'.join(nodes_status)
+            data, age = Barrenero.fetch_or_stale(api.url, api.token, 'storj')
+
+            response_text = self.storj_status_text(api, data) + stale_text(age)
+            reply_markup = self.live_markup('storj', api.id)
         except peewee.DoesNotExist:
             self.logger.error('Chat unregistered')
             response_text = 'Configure me first'
+            reply_markup = None
         except BarreneroRequestException as e:
             self.logger.exception(e.message)
-            response_text = f'*API {api}*\nCannot retrieve Storj miner status'
-        except:
+            response_text = f'*API {api.name}*\nCannot retrieve Storj miner status'
+            reply_markup = None
+        except peewee.PeeweeException:
             self.logger.exception('Error retrieving storj status')
             response_text = 'Cannot retrieve storj status'
+            reply_markup = None
 
         bot.edit_message_text(text=response_text, parse_mode=ParseMode.MARKDOWN, chat_id=chat_id,
-                              message_id=query.message.message_id)
+                              message_id=query.message.message_id, reply_markup=reply_markup)
+
+    @staticmethod
+    def storj_status_text(api, data) -> str:
+        nodes_status = []
+        for node in data:
+            shared = node.shared if node.shared is not None else 'Unknown'
+            shared_percent = f'{node.shared_percent}%' if node.shared_percent is not None else 'Unknown'
+            data_received = node.data_received if node.data_received is not None else 'Unknown'
+            delta = f'{node.delta:d} ms' if node.delta is not None else 'Unknown'
+            response_time = f'{node.response_time:.2f} ms' if node.response_time is not None else 'Unknown'
+            reputation = f'{node.reputation:d}/5000' if node.reputation is not None else 'Unknown'
+            version = node.version if node.version is not None else 'Unknown'
+            nodes_status.append(
+                f'*Storj node #{node.id}*\n'
+                f' - Status: `{node.status}`\n'
+                f' - Uptime: `{node.uptime} ({node.restarts} restarts)`\n'
+                f' - Shared: `{shared} ({shared_percent})`\n'
+                f' - Data received: `{data_received}`\n'
+                f' - Peers/Allocs: `{node.peers:d}` / `{node.allocs:d}`\n'
+                f' - Delta: `{delta}`\n'
+                f' - Path: `{node.config_path}`\n'
+                f' - Response Time: `{response_time}`\n'
+                f' - Reputation: `{reputation}`\n'
+                f' - Version: `{version}`')
+
+        return f'*API {api.name}*\n' + '\n\n'.join(nodes_status)
+
+    def storj_check_status(self, bot, api, snapshot, count: int = 1):
+        """
+        Update Storj status of an API from a snapshot retrieved in current sweep, recorded as count checks.
+        """
+        try:
+            running = snapshot['storj'].running
+        except BarreneroRequestException:
+            self.storj_observe(bot, api, False, reason=f'Cannot access `{api.name}`', count=count)
+            running = False
+        else:
+            self.storj_observe(bot, api, running, count=count)
 
-    def storj_job_status(self, bot, job):
+        recorder.record_check(api.id, 'storj', running)
+
+    def storj_observe(self, bot, api, up: bool, reason: str = None, count: int = 1):
         """
-        Check miner status
+        Record a Storj status check of an API.
         """
-        self.logger.debug('Job: Check Storj status')
+        with lock:
+            status = status_machines.get(api)
+            if status is None:
+                status = status_machines[api] = StatusStateMachine('Storj', api.name)
 
-        # Create new state machines
-        global status_machines
+            status.observe(up, bot=bot, chat=api.chat_id, reason=reason, count=count)
 
+    def storj_forget(self, api):
+        """
+        Drop status of a removed API.
+        """
         with lock:
-            new_machines = {a: StatusStateMachine('Storj', a.name)
-                            for a in API.select().where(API.superuser == True).join(Chat)
-                            if a not in status_machines}
-            status_machines.update(new_machines)
-
-            self.logger.debug('Storj Status Machines: %s', str(status_machines))
-
-            for api, status in status_machines.items():
-                try:
-                    data = Barrenero.storj(api.url, api.token)
-
-                    node_status = {d['status'] for d in data}
-                    if node_status == {'running'}:
-                        status.start(bot=bot, chat=api.chat.id)
-                    else:
-                        status.stop(bot=bot, chat=api.chat.id)
-                except BarreneroRequestException:
-                    if status.is_active:
-                        bot.send_message(api.chat.id, f'Cannot access `{api.name}`', parse_mode=ParseMode.MARKDOWN)
-                        status.stop(bot=bot, chat=api.chat.id)
+            status_machines.pop(api, None)
 
     def add_storj_command(self):
         self.updater.dispatcher.add_handler(CommandHandler('storj', self.storj))
         self.updater.dispatcher.add_handler(CallbackQueryHandler(self.storj_restart, pass_groups=True,
-                                                                 pattern=r'\[storj_restart\]\[(\d+)\]'))
-        self.updater.dispatcher.add_handler(CallbackQueryHandler(self.storj_status, pass_groups=True,
+                                                                 pattern=r'\[storj_restart\]\[(\d+|all)\]'))
+        self.updater.dispatcher.add_handler(CallbackQueryHandler(self.fair(self.storj_status), pass_groups=True,
                                                                  pattern=r'\[storj_status\]\[(\d+)\]'))
         self.updater.dispatcher.add_handler(CallbackQueryHandler(self.storj_miner_choice, pass_groups=True,
                                                                  pattern=r'\[storj_(status|restart)\]$'))
-
-    def add_storj_jobs(self):
-        self.updater.job_queue.run_repeating(self.storj_job_status, interval=300.0)
@@ -0,0 +1,60 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from bot.api import Barrenero, Deadline
+from bot.models import API, Chat
+from bot.state_machine import StatusStateMachine
+from bot.stats import recorder
+
+executor = ThreadPoolExecutor(max_workers=8)
+
+
+class SweepMixin:
+    sweep_interval = 180.0
+    sweep_endpoints = ('ether', 'storj')
+    # Deadline of running sweep, if any
+    _sweep_deadline = None
+
+    def sweep_job_status(self, bot, job):
+        """
+        Retrieve a single snapshot of every superuser API and check services status from it.
+        """
+        self.logger.debug('Job: Status sweep')
+
+        # Retries cannot make a sweep last longer than the interval between sweeps
+        deadline = self._sweep_deadline = Deadline(self.sweep_interval)
+        apis = list(API.select().where(API.superuser == True).join(Chat).where(self.own_chats))
+        # Rigs pushing their events are only swept to reconcile status or to refresh live messages
+        apis = [a for a in apis if self.push_due(a) or self.live_endpoints(a)]
+        snapshots = executor.map(
+            lambda a: Barrenero.fetch_many(a, set(self.sweep_endpoints) | self.live_endpoints(a), deadline), apis)
+
+        for api, snapshot in zip(apis, snapshots):
+            if self._stopping.is_set():
+                # Requests were cut short, so their results do not reflect the status of rigs
+                self.logger.info('Status sweep interrupted by shutdown')
+                break
+
+            self.logger.debug('Snapshot: %s', snapshot)
+            # Rigs pushing their events are swept once in a long while, so a reconciliation is conclusive
+            count = StatusStateMachine.threshold if self.push_reconciling(api) else 1
+            self.ether_check_status(bot, api, snapshot, count=count)
+            self.storj_check_status(bot, api, snapshot, count=count)
+            self.live_update(bot, api, snapshot)
+            if self.push_due(api):
+                self.push_swept(api)
+
+        recorder.flush()
+        self.logger.info('Barrenero API retries: %s', Barrenero.retry.stats())
+
+    def sweep_expire(self):
+        """
+        Cut running sweep short: requests not made yet are skipped.
+        """
+        deadline = self._sweep_deadline
+        if deadline is not None:
+            deadline.expire()
+
+    def add_sweep_jobs(self):
+        self.updater.job_queue.run_repeating(self.checkpointed('sweep', self.sweep_job_status),
+                                             interval=self.sweep_interval,
+                                             first=self.job_first('sweep', self.sweep_interval))
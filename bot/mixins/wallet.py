@@ -1,5 +1,3 @@
-import random
-import time
 from itertools import takewhile
 
 import peewee
@@ -9,8 +7,9 @@ from telegram.parsemode import ParseMode
 
 from bot.api import Barrenero
 from bot.exceptions import BarreneroRequestException
-from bot.models import Chat
-from bot.utils import humanize_iso_date
+from bot.models import API, Chat, save_all
+from bot.stats import recorder
+from bot.utils import Lazy, humanize_iso_date, stale_text
 
 
 class WalletMixin:
@@ -23,28 +22,28 @@ class WalletMixin:
 
         try:
             chat = Chat.get(id=chat_id)
-            api = random.choice(chat.apis)
-            data = Barrenero.wallet(api.url, api.token)
+            data, age = Barrenero.hedged_or_stale(chat.apis, 'wallet')
 
             response_text = f'*Tokens*\n'
             response_text += '\n'.join(
-                [f' - {t["name"]}: `{t["balance"]} {t["symbol"]}` ({t.get("balance_usd", "Unknown")} $)'
-                 for t in data['tokens'].values()])
+                [f' - {t.name}: `{t.balance} {t.symbol}` ({t.balance_usd or "Unknown"} $)' for t in data.tokens])
 
-            for i, tx in zip(range(1, 4), data['transactions']):
+            for i, tx in zip(range(1, 4), data.transactions):
                 response_text += f'\n\n*Last transaction #{i}*\n' \
-                                 f' - Token: `{tx["token"]["name"]}`\n' \
-                                 f' - Hash: `{tx["hash"]}`\n' \
-                                 f' - Source: `{tx["source"]}`\n' \
-                                 f' - Value: `{tx["value"]} {tx["token"]["symbol"]}`\n' \
-                                 f' - Date: `{humanize_iso_date(tx["timestamp"])}`'
+                                 f' - Token: `{tx.token_name}`\n' \
+                                 f' - Hash: `{tx.hash}`\n' \
+                                 f' - Source: `{tx.source}`\n' \
+                                 f' - Value: `{tx.value} {tx.token_symbol}`\n' \
+                                 f' - Date: `{humanize_iso_date(tx.timestamp)}`'
+
+            response_text += stale_text(age)
         except peewee.DoesNotExist:
             self.logger.error('Chat unregistered')
             response_text = 'Configure me first'
         except BarreneroRequestException as e:
             self.logger.exception(e.message)
             response_text = e.message
-        except:
+        except peewee.PeeweeException:
             self.logger.exception('Error retrieving wallet info')
             response_text = 'Cannot retrieve wallet info'
 
@@ -55,33 +54,49 @@ class WalletMixin:
         Check last transaction and notify if there are new payments.
         """
         self.logger.debug('Job: Check transactions')
-        for chat in Chat.select():
-            api = random.choice(chat.apis)
-            data = Barrenero.wallet(api.url, api.token)
+        updated_chats = []
+        # Retrieve chats and their APIs in two queries instead of one per chat
+        for chat in peewee.prefetch(Chat.select().where(self.own_chats), API.select()):
+            if self._stopping.is_set():
+                self.logger.info('Transactions check interrupted by shutdown')
+                break
+
+            if not chat.apis:
+                continue
+
             try:
-                self.logger.debug('Current transaction: %s', str(chat.last_transaction))
-                self.logger.debug('Retrieved transactions: %s', str(data['transactions']))
-                first_transaction_hash = data['transactions'][0]['hash']
+                data = Barrenero.hedged(chat.apis, lambda api: Barrenero.wallet(api.url, api.token))
+                self.logger.debug('Current transaction: %s', chat.last_transaction)
+                self.logger.debug('Retrieved transactions: %s',
+                                  Lazy(lambda data=data: [tx.hash for tx in data.transactions]))
+                first_transaction_hash = data.transactions[0].hash
                 if not chat.last_transaction:
                     # If last transaction is unknown, simply update it
                     chat.last_transaction = first_transaction_hash
                 else:
                     # Show transactions until last known
-                    for tx in takewhile(lambda x: x['hash'] != chat.last_transaction, data['transactions']):
+                    for tx in takewhile(lambda x: x.hash != chat.last_transaction, data.transactions):
                         text = f'\n\n*Transaction completed*\n' \
-                               f' - Token: `{tx["token"]["name"]}`\n' \
-                               f' - Value: `{tx["value"]} {tx["token"]["symbol"]}`\n' \
-                               f' - Date: `{humanize_iso_date(tx["timestamp"])}`'
+                               f' - Token: `{tx.token_name}`\n' \
+                               f' - Value: `{tx.value} {tx.token_symbol}`\n' \
+                               f' - Date: `{humanize_iso_date(tx.timestamp)}`'
                         bot.send_message(text=text, parse_mode=ParseMode.MARKDOWN, chat_id=chat.id)
+                        recorder.record_transaction(chat.id, tx.token_symbol, tx.value)
 
                     chat.last_transaction = first_transaction_hash
-                chat.save()
-            except (KeyError, IndexError):
+                updated_chats.append(chat)
+            except BarreneroRequestException:
+                self.logger.exception('Cannot retrieve transactions for Chat %s', chat.id)
+            except IndexError:
                 self.logger.debug('No transactions found for Chat %s', chat.id)
-            time.sleep(1)
+            self._stopping.wait(1)
+
+        save_all(updated_chats)
+        recorder.flush()
 
     def add_wallet_command(self):
-        self.updater.dispatcher.add_handler(CommandHandler('wallet', self.wallet))
+        self.updater.dispatcher.add_handler(CommandHandler('wallet', self.fair(self.wallet)))
 
     def add_wallet_jobs(self):
-        self.updater.job_queue.run_repeating(self.wallet_job_transactions, interval=900.0)
+        self.updater.job_queue.run_repeating(self.checkpointed('wallet', self.wallet_job_transactions),
+                                             interval=900.0, first=self.job_first('wallet', 900.0))
@@ -0,0 +1,339 @@
+import collections.abc
+import datetime
+import numbers
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from bot.exceptions import BarreneroResponseException
+from bot.utils import ISO_DATE_FORMAT
+
+__all__ = ['Payload', 'Ether', 'GraphicCardsHashrate', 'Graphic', 'Nanopool', 'NanopoolHashrate', 'Service',
+           'Status', 'Storj', 'StorjNode', 'Token', 'Transaction', 'Wallet']
+
+
+class Payload:
+    """
+    Base class for typed Barrenero API responses.
+
+    Subclasses declare their fields through __slots__ and build themselves from the decoded JSON in _parse, so any
+    missing key or wrong type is reported once as a BarreneroResponseException.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def _parse(cls, data: Any) -> 'Payload':
+        raise NotImplementedError
+
+    @classmethod
+    def from_json(cls, data: Any) -> 'Payload':
+        try:
+            return cls._parse(data)
+        except (KeyError, IndexError, TypeError, ValueError, AttributeError) as e:
+            raise BarreneroResponseException(f'Wrong response from Barrenero API for {cls.__name__}') from e
+
+    def __repr__(self):
+        attrs = ', '.join(f'{s}={getattr(self, s)!r}' for s in self.__slots__)
+        return f'{self.__class__.__name__}{{{attrs}}}'
+
+    @staticmethod
+    def _int(value: Any, optional: bool = False) -> Optional[int]:
+        """
+        Integer field. Other numbers are accepted only if they have no fractional part.
+        """
+        if value is None and optional:
+            return None
+
+        if isinstance(value, bool) or not isinstance(value, numbers.Number):
+            raise TypeError(f'Not an integer: {value!r}')
+
+        if int(value) != value:
+            raise ValueError(f'Not an integer: {value}')
+
+        return int(value)
+
+    @staticmethod
+    def _float(value: Any, optional: bool = False) -> Optional[float]:
+        if value is None and optional:
+            return None
+
+        if isinstance(value, bool) or not isinstance(value, numbers.Number):
+            raise TypeError(f'Not a number: {value!r}')
+
+        return float(value)
+
+    @staticmethod
+    def _number(value: Any, optional: bool = False) -> Optional[Union[int, float]]:
+        """
+        Numeric field only rendered, kept as received: an integer, a float or a Decimal from streamed responses.
+        """
+        if value is None and optional:
+            return None
+
+        if isinstance(value, bool) or not isinstance(value, numbers.Number):
+            raise TypeError(f'Not a number: {value!r}')
+
+        return value
+
+    @staticmethod
+    def _bool(value: Any) -> bool:
+        if not isinstance(value, bool):
+            raise TypeError(f'Not a boolean: {value!r}')
+
+        return value
+
+    @staticmethod
+    def _str(value: Any, optional: bool = False) -> Optional[str]:
+        if value is None and optional:
+            return None
+
+        if not isinstance(value, str):
+            raise TypeError(f'Not a string: {value!r}')
+
+        return value
+
+    @staticmethod
+    def _dict(value: Any) -> Dict[str, Any]:
+        if not isinstance(value, dict):
+            raise TypeError(f'Not an object: {value!r}')
+
+        return value
+
+    @staticmethod
+    def _list(value: Any) -> List[Any]:
+        if not isinstance(value, list):
+            raise TypeError(f'Not a list: {value!r}')
+
+        return value
+
+    @staticmethod
+    def _date(value: Any) -> str:
+        """
+        ISO 8601 date field, kept as a string once validated.
+        """
+        datetime.datetime.strptime(value, ISO_DATE_FORMAT)
+        return value
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, s) == getattr(other, s) for s in self.__slots__)
+
+
+class GraphicCardsHashrate(Payload):
+    """
+    Hashrate for every graphic card, stored in two compact arrays instead of a list of dicts.
+    """
+    __slots__ = ('cards', 'hashrates')
+
+    def __init__(self, cards: array, hashrates: array):
+        self.cards = cards
+        self.hashrates = hashrates
+
+    @classmethod
+    def _parse(cls, data: List[Dict[str, Any]]) -> 'GraphicCardsHashrate':
+        data = cls._list(data)
+        return cls(cards=array('i', (cls._int(h['graphic_card']) for h in data)),
+                   hashrates=array('d', (cls._float(h['hashrate']) for h in data)))
+
+    def __iter__(self) -> Iterator[Tuple[int, float]]:
+        return zip(self.cards, self.hashrates)
+
+    def __len__(self):
+        return len(self.cards)
+
+
+class NanopoolHashrate(Payload):
+    __slots__ = ('current', 'one_hour', 'three_hours', 'six_hours', 'twelve_hours', 'twenty_four_hours')
+
+    def __init__(self, current, one_hour, three_hours, six_hours, twelve_hours, twenty_four_hours):
+        self.current = current
+        self.one_hour = one_hour
+        self.three_hours = three_hours
+        self.six_hours = six_hours
+        self.twelve_hours = twelve_hours
+        self.twenty_four_hours = twenty_four_hours
+
+    @classmethod
+    def _parse(cls, data: Dict[str, Any]) -> 'NanopoolHashrate':
+        return cls(**{s: cls._number(data[s]) for s in cls.__slots__})
+
+
+class Nanopool(Payload):
+    __slots__ = ('balance', 'hashrate', 'last_payment_date', 'last_payment_value', 'workers')
+
+    def __init__(self, balance, hashrate: NanopoolHashrate, last_payment_date: str, last_payment_value,
+                 workers: Dict[str, Any]):
+        self.balance = balance
+        self.hashrate = hashrate
+        self.last_payment_date = last_payment_date
+        self.last_payment_value = last_payment_value
+        self.workers = workers
+
+    @classmethod
+    def _parse(cls, data: Dict[str, Any]) -> 'Nanopool':
+        return cls(balance=cls._number(data['balance']['confirmed']),
+                   hashrate=NanopoolHashrate._parse(data['hashrate']),
+                   last_payment_date=cls._date(data['last_payment']['date']),
+                   last_payment_value=cls._number(data['last_payment']['value']),
+                   workers={cls._str(k): cls._number(v) for k, v in cls._dict(data['workers']).items()})
+
+
+class Ether(Payload):
+    __slots__ = ('active', 'hashrate', 'nanopool')
+
+    def __init__(self, active: bool, hashrate: GraphicCardsHashrate, nanopool: Optional[Nanopool]):
+        self.active = active
+        self.hashrate = hashrate
+        self.nanopool = nanopool
+
+    @classmethod
+    def _parse(cls, data: Dict[str, Any]) -> 'Ether':
+        nanopool = data.get('nanopool')
+        return cls(active=cls._bool(data['active']),
+                   hashrate=GraphicCardsHashrate._parse(data['hashrate']),
+                   nanopool=Nanopool._parse(nanopool) if nanopool else None)
+
+
+class Service(Payload):
+    __slots__ = ('name', 'status')
+
+    def __init__(self, name: str, status: str):
+        self.name = name
+        self.status = status
+
+    @classmethod
+    def _parse(cls, data: Dict[str, Any]) -> 'Service':
+        return cls(name=cls._str(data['name']), status=cls._str(data['status']))
+
+
+class Graphic(Payload):
+    __slots__ = ('id', 'power', 'fan', 'gpu_usage', 'gpu_clock', 'mem_usage', 'mem_clock')
+
+    def __init__(self, id, power, fan, gpu_usage, gpu_clock, mem_usage, mem_clock):
+        self.id = id
+        self.power = power
+        self.fan = fan
+        self.gpu_usage = gpu_usage
+        self.gpu_clock = gpu_clock
+        self.mem_usage = mem_usage
+        self.mem_clock = mem_clock
+
+    @classmethod
+    def _parse(cls, data: Dict[str, Any]) -> 'Graphic':
+        # Cards not reporting a metric send it as null
+        return cls(id=cls._int(data['id']), **{s: cls._number(data[s], optional=True) for s in cls.__slots__[1:]})
+
+
+class Status(Payload):
+    __slots__ = ('services', 'graphics')
+
+    def __init__(self, services: List[Service], graphics: List[Graphic]):
+        self.services = services
+        self.graphics = graphics
+
+    @classmethod
+    def _parse(cls, data: Dict[str, Any]) -> 'Status':
+        return cls(services=[Service._parse(s) for s in cls._list(data['services'])],
+                   graphics=[Graphic._parse(g) for g in cls._list(data['graphics'])])
+
+
+class StorjNode(Payload):
+    __slots__ = ('id', 'status', 'uptime', 'restarts', 'shared', 'shared_percent', 'data_received', 'peers', 'allocs',
+                 'delta', 'config_path', 'response_time', 'reputation', 'version')
+
+    def __init__(self, id, status, uptime, restarts, shared, shared_percent, data_received, peers, allocs, delta,
+                 config_path, response_time, reputation, version):
+        self.id = id
+        self.status = status
+        self.uptime = uptime
+        self.restarts = restarts
+        self.shared = shared
+        self.shared_percent = shared_percent
+        self.data_received = data_received
+        self.peers = peers
+        self.allocs = allocs
+        self.delta = delta
+        self.config_path = config_path
+        self.response_time = response_time
+        self.reputation = reputation
+        self.version = version
+
+    @classmethod
+    def _parse(cls, data: Dict[str, Any]) -> 'StorjNode':
+        return cls(**{
+            **{s: data[s] for s in cls.__slots__},
+            'peers': cls._int(data['peers']),
+            'allocs': cls._int(data['allocs']),
+            'delta': cls._int(data['delta'], optional=True),
+            'response_time': cls._float(data['response_time'], optional=True),
+            'reputation': cls._int(data['reputation'], optional=True),
+        })
+
+
+class Storj(Payload):
+    __slots__ = ('nodes',)
+
+    def __init__(self, nodes: List[StorjNode]):
+        self.nodes = nodes
+
+    @classmethod
+    def _parse(cls, data: Iterable[Dict[str, Any]]) -> 'Storj':
+        # Streamed responses are parsed while their items are decoded
+        if not isinstance(data, collections.abc.Iterator):
+            data = cls._list(data)
+
+        return cls(nodes=[StorjNode._parse(n) for n in data])
+
+    @property
+    def running(self) -> bool:
+        return {n.status for n in self.nodes} == {'running'}
+
+    def __iter__(self) -> Iterator[StorjNode]:
+        return iter(self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+class Token(Payload):
+    __slots__ = ('name', 'balance', 'symbol', 'balance_usd')
+
+    def __init__(self, name: str, balance, symbol: str, balance_usd=None):
+        self.name = name
+        self.balance = balance
+        self.symbol = symbol
+        self.balance_usd = balance_usd
+
+    @classmethod
+    def _parse(cls, data: Dict[str, Any]) -> 'Token':
+        return cls(name=cls._str(data['name']), balance=cls._number(data['balance']), symbol=cls._str(data['symbol']),
+                   balance_usd=cls._number(data.get('balance_usd'), optional=True))
+
+
+class Transaction(Payload):
+    __slots__ = ('hash', 'source', 'value', 'timestamp', 'token_name', 'token_symbol')
+
+    def __init__(self, hash: str, source: str, value, timestamp: str, token_name: str, token_symbol: str):
+        self.hash = hash
+        self.source = source
+        self.value = value
+        self.timestamp = timestamp
+        self.token_name = token_name
+        self.token_symbol = token_symbol
+
+    @classmethod
+    def _parse(cls, data: Dict[str, Any]) -> 'Transaction':
+        return cls(hash=cls._str(data['hash']), source=cls._str(data['source']), value=cls._number(data['value']),
+                   timestamp=cls._date(data['timestamp']),
+                   token_name=cls._str(data['token']['name']), token_symbol=cls._str(data['token']['symbol']))
+
+
+class Wallet(Payload):
+    __slots__ = ('tokens', 'transactions')
+
+    def __init__(self, tokens: List[Token], transactions: List[Transaction]):
+        self.tokens = tokens
+        self.transactions = transactions
+
+    @classmethod
+    def _parse(cls, data: Dict[str, Any]) -> 'Wallet':
+        return cls(tokens=[Token._parse(t) for t in cls._dict(data['tokens']).values()],
+                   transactions=[Transaction._parse(t) for t in cls._list(data['transactions'])])
@@ -0,0 +1,81 @@
+import random
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Iterator
+
+import requests
+
+from bot.exceptions import BarreneroDeadlineException, BarreneroRequestException, BarreneroResponseException
+
+__all__ = ['RetryPolicy']
+
+
+class RetryPolicy:
+    """
+    Retry failed requests with exponential backoff and full jitter. Only connection errors, timeouts and server errors
+    are retried, never client errors nor wrong responses. Calls made with a deadline stop retrying when next attempt
+    would not fit in remaining time.
+    """
+
+    def __init__(self, retries: int = 2, backoff: float = 0.25, max_backoff: float = 4.0):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._counters = Counter()
+        self._lock = threading.Lock()
+
+    def delays(self) -> Iterator[float]:
+        for attempt in range(self.retries):
+            yield random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    @staticmethod
+    def retryable(exception: BarreneroRequestException) -> bool:
+        if isinstance(exception, (BarreneroResponseException, BarreneroDeadlineException)):
+            return False
+
+        cause = exception.__cause__
+        if isinstance(cause, requests.HTTPError) and cause.response is not None:
+            return cause.response.status_code >= 500
+
+        return True
+
+    def _count(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def call(self, func: Callable[[], Any], deadline=None, idempotent: bool = True) -> Any:
+        """
+        Call func, retrying it if it fails and it is safe to do it again.
+        """
+        delays = self.delays() if idempotent else iter(())
+        retried = False
+
+        while True:
+            self._count('attempts')
+            try:
+                result = func()
+            except BarreneroRequestException as e:
+                if not self.retryable(e):
+                    raise
+
+                delay = next(delays, None)
+                if delay is None or (deadline is not None and deadline.remaining <= delay):
+                    self._count('exhausted' if idempotent else 'not_retried')
+                    raise
+
+                self._count('retries')
+                retried = True
+                time.sleep(delay)
+            else:
+                if retried:
+                    self._count('recovered')
+                return result
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Counters of attempts, retries, calls recovered by a retry, calls failed after every retry and non idempotent
+        calls failed without retrying.
+        """
+        with self._lock:
+            return {k: self._counters[k] for k in ('attempts', 'retries', 'recovered', 'exhausted', 'not_retried')}
@@ -0,0 +1,156 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from typing import Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['FairExecutor', 'FairScheduler', 'QueueFull', 'current_tenant', 'tenant']
+
+# Tenant (e.g. a chat) the current thread is working for
+_context = threading.local()
+
+
+def current_tenant() -> Hashable:
+    """
+    Tenant the current thread is working for, None for background work such as jobs.
+    """
+    return getattr(_context, 'tenant', None)
+
+
+@contextmanager
+def tenant(key: Hashable):
+    """
+    Work done in this context, including tasks submitted to a FairExecutor, is accounted to given tenant.
+    """
+    previous = current_tenant()
+    _context.tenant = key
+    try:
+        yield
+    finally:
+        _context.tenant = previous
+
+
+class QueueFull(Exception):
+    pass
+
+
+class FairScheduler:
+    """
+    Runs tasks in a pool of workers, taking them from a queue per key (e.g. a chat) in weighted round robin order. A
+    key runs as many tasks as its weight, 1 by default, before the next key, so a key with many pending tasks cannot
+    delay tasks of other keys more than one round. Tasks run accounted to their key, see tenant.
+    """
+
+    def __init__(self, workers: int = 4, max_pending: int = 5, weights: Dict[Hashable, int] = None,
+                 name: str = 'fair_scheduler'):
+        self.max_pending = max_pending
+        self.weights = weights or {}
+        self._queues = OrderedDict()  # type: OrderedDict[Hashable, deque]
+        self._credits = {}  # type: Dict[Hashable, int]
+        self._condition = threading.Condition()
+        self._running = True
+        self._workers = [threading.Thread(target=self._work, name=f'{name}_{i}', daemon=True)
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, key: Hashable, func: Callable, *args, **kwargs) -> Future:
+        """
+        Queue a task for given key. Raises QueueFull if the key already has max_pending tasks waiting.
+        """
+        future = Future()
+
+        with self._condition:
+            if not self._running:
+                raise RuntimeError('Cannot schedule tasks after stop')
+
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = deque()
+                self._credits[key] = self.weights.get(key, 1)
+            elif self.max_pending is not None and len(queue) >= self.max_pending:
+                raise QueueFull(f'Too many pending tasks for {key}')
+
+            queue.append((future, func, args, kwargs))
+            self._condition.notify()
+
+        return future
+
+    def pending(self, key: Hashable) -> int:
+        with self._condition:
+            return len(self._queues.get(key, ()))
+
+    def _next(self):
+        """
+        Take next task: the first key in rotation runs as many tasks as its weight before moving to the end.
+        """
+        key, queue = next(iter(self._queues.items()))
+        task = queue.popleft()
+        self._credits[key] -= 1
+
+        if not queue:
+            del self._queues[key]
+            del self._credits[key]
+        elif self._credits[key] <= 0:
+            self._credits[key] = self.weights.get(key, 1)
+            self._queues.move_to_end(key)
+
+        return key, task
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while self._running and not self._queues:
+                    self._condition.wait()
+
+                if not self._queues:
+                    return
+
+                key, (future, func, args, kwargs) = self._next()
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                with tenant(key):
+                    result = func(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def stop(self, wait: bool = True, timeout: float = None) -> bool:
+        """
+        Stop workers once queued tasks are done. If waiting, returns whether every task finished within timeout.
+        """
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+
+        if wait:
+            deadline = time.monotonic() + timeout if timeout is not None else None
+            for worker in self._workers:
+                worker.join(max(deadline - time.monotonic(), 0.0) if deadline is not None else None)
+
+        return not any(worker.is_alive() for worker in self._workers)
+
+
+class FairExecutor(Executor):
+    """
+    Executor queuing tasks by the tenant submitting them, so tasks of a tenant issuing many of them do not delay
+    those of the rest. Tasks submitted outside of any tenant, e.g. by jobs, share a single queue.
+    """
+
+    def __init__(self, max_workers: int, weights: Dict[Hashable, int] = None):
+        self._scheduler = FairScheduler(workers=max_workers, max_pending=None, weights=weights,
+                                        name='fair_executor')
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        return self._scheduler.submit(current_tenant(), fn, *args, **kwargs)
+
+    def shutdown(self, wait: bool = True):
+        self._scheduler.stop(wait=wait)
@@ -1,4 +1,5 @@
 from enum import Enum
+from typing import Any, Dict
 
 from telegram import ParseMode
 from transitions import Machine
@@ -9,41 +10,108 @@ __all__ = ['StatusState', 'StatusStateMachine']
 class StatusState(Enum):
     ACTIVE = 'active'
     INACTIVE = 'inactive'
+    FLAPPING = 'flapping'
 
 
 class StatusStateMachine(Machine):
-    states = [StatusState.INACTIVE.name, StatusState.ACTIVE.name]
+    """
+    Service status damped against flapping: results of last checks are kept in a fixed size bit ring and status only
+    changes when `threshold` of last `window` checks agree. A service changing too often is considered flapping and
+    notified once, until it is stable again.
+    """
+    states = [StatusState.INACTIVE.name, StatusState.ACTIVE.name, StatusState.FLAPPING.name]
     initial = StatusState.INACTIVE.name
     transitions = [
         {'trigger': 'start', 'source': StatusState.INACTIVE.name, 'dest': StatusState.ACTIVE.name,
          'after': 'notify_start'},
+        {'trigger': 'start', 'source': StatusState.FLAPPING.name, 'dest': StatusState.ACTIVE.name,
+         'after': 'notify_start'},
         {'trigger': 'start', 'source': StatusState.ACTIVE.name, 'dest': StatusState.ACTIVE.name},
         {'trigger': 'stop', 'source': StatusState.INACTIVE.name, 'dest': StatusState.INACTIVE.name},
         {'trigger': 'stop', 'source': StatusState.ACTIVE.name, 'dest': StatusState.INACTIVE.name,
          'after': 'notify_stop'},
+        {'trigger': 'stop', 'source': StatusState.FLAPPING.name, 'dest': StatusState.INACTIVE.name,
+         'after': 'notify_stop'},
+        {'trigger': 'flap', 'source': [StatusState.INACTIVE.name, StatusState.ACTIVE.name],
+         'dest': StatusState.FLAPPING.name, 'after': 'notify_flapping'},
+        {'trigger': 'flap', 'source': StatusState.FLAPPING.name, 'dest': StatusState.FLAPPING.name},
     ]
 
+    # Checks kept, checks that must agree to change status and changes between checks considered flapping
+    window = 5
+    threshold = 3
+    flap_changes = 3
+
     def __init__(self, service, api):
         super().__init__(self, states=self.states, initial=self.initial, transitions=self.transitions)
         self.service = service
         self.api = api
+        # Last check results as bits, most recent one is the lowest bit
+        self.results = 0
+        self.checks = 0
+
+    def observe(self, up: bool, bot, chat, reason: str = None, count: int = 1):
+        """
+        Record result of a check and update status if last results are conclusive. A result can be recorded as several
+        checks when it comes from a trusted source, e.g. an event pushed by the rig itself.
+        """
+        count = min(count, self.window)
+        self.results = ((self.results << count) | (((1 << count) - 1) if up else 0)) & ((1 << self.window) - 1)
+        self.checks = min(self.checks + count, self.window)
+
+        mask = (1 << self.checks) - 1
+        ups = bin(self.results & mask).count('1')
+        changes = bin((self.results ^ (self.results >> 1)) & (mask >> 1)).count('1')
+
+        recent = self.results & ((1 << self.threshold) - 1)
+        stable = self.checks >= self.threshold and recent in (0, (1 << self.threshold) - 1)
 
-    def notify_start(self, bot, chat):
+        if changes >= self.flap_changes:
+            self.flap(bot=bot, chat=chat, changes=changes)
+        elif self.state == StatusState.FLAPPING.name and not stable:
+            return
+        elif ups >= self.threshold:
+            self.start(bot=bot, chat=chat, reason=reason)
+        elif self.checks - ups >= self.threshold:
+            self.stop(bot=bot, chat=chat, reason=reason)
+
+    def notify_start(self, bot, chat, **kwargs):
         bot.send_message(chat_id=chat, text=f'Service `{self.service}` from API `{self.api}` is *active* and running '
                                             f'now',
                          parse_mode=ParseMode.MARKDOWN)
 
-    def notify_stop(self, bot, chat):
+    def notify_stop(self, bot, chat, reason=None, **kwargs):
+        if reason:
+            bot.send_message(chat_id=chat, text=reason, parse_mode=ParseMode.MARKDOWN)
+
         bot.send_message(chat_id=chat, text=f'Service `{self.service}` from API `{self.api}` stops working and is now '
                                             f'*inactive*',
                          parse_mode=ParseMode.MARKDOWN)
 
+    def notify_flapping(self, bot, chat, changes, **kwargs):
+        bot.send_message(chat_id=chat, text=f'Service `{self.service}` from API `{self.api}` is *flapping*, it changed '
+                                            f'{changes} times in last {self.checks} checks. You will be notified when '
+                                            f'it is stable again',
+                         parse_mode=ParseMode.MARKDOWN)
+
+    def dump(self) -> Dict[str, Any]:
+        return {'state': self.state, 'results': self.results, 'checks': self.checks}
+
+    def load(self, data: Dict[str, Any]):
+        """
+        Restore status and last check results without notifying anything.
+        """
+        if data['state'] in self.states:
+            self.set_state(data['state'])
+        self.results = int(data['results']) & ((1 << self.window) - 1)
+        self.checks = min(int(data['checks']), self.window)
+
     @property
     def is_active(self):
-        return self.model.state == StatusState.ACTIVE
+        return self.model.state == StatusState.ACTIVE.name
 
     def __str__(self):
         return self.model.state
 
     def __repr__(self):
-        return f'StatusStateMachine{{{self.service}, {self.model.state}}}'
+        return f'StatusStateMachine{{{self.service}, {self.model.state}, {self.results:0{self.window}b}}}'
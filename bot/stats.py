@@ -0,0 +1,124 @@
+import datetime
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import peewee
+
+from bot.models import ServiceStats, TransactionStats, db
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['StatsRecorder', 'recorder', 'utc_today']
+
+
+def utc_today() -> datetime.date:
+    return datetime.datetime.utcnow().date()
+
+
+class StatsRecorder:
+    """
+    Daily counters of status checks and received transactions. Samples are accumulated in memory and added to stored
+    counters once per job run, so recording does not cost a query per sample.
+
+    Uptime is also weighted by time: the status seen by a check is held until the next check of the same service, up
+    to max_gap seconds, so checks pushed by rigs between sweeps do not skew it.
+    """
+    max_gap = 600.0
+
+    def __init__(self):
+        self._checks = defaultdict(lambda: [0, 0, 0.0, 0, 0.0, 0.0])  # type: Dict[Tuple[int, str, datetime.date], List]
+        self._transactions = defaultdict(lambda: [0, 0.0])  # type: Dict[Tuple[int, str, datetime.date], List]
+        # Time and status of last check of every service
+        self._last = {}  # type: Dict[Tuple[int, str], Tuple[float, bool]]
+        self._lock = threading.Lock()
+        # Serializes flushes so two of them never create the same row
+        self._flush_lock = threading.Lock()
+
+    def record_check(self, api_id: int, service: str, up: bool, hashrate: float = None):
+        now = time.monotonic()
+        with self._lock:
+            counters = self._checks[(api_id, service, utc_today())]
+            counters[0] += 1
+            counters[1] += int(up)
+            if hashrate is not None:
+                counters[2] += hashrate
+                counters[3] += 1
+
+            last = self._last.get((api_id, service))
+            if last is not None:
+                seconds = min(now - last[0], self.max_gap)
+                counters[4] += seconds
+                counters[5] += seconds if last[1] else 0.0
+            self._last[(api_id, service)] = (now, up)
+
+    def forget(self, api_id: int):
+        with self._lock:
+            for key in [k for k in self._last if k[0] == api_id]:
+                del self._last[key]
+
+    def record_transaction(self, chat_id: int, token: str, value):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            logger.debug('Unknown transaction value: %s', value)
+            value = 0.0
+
+        with self._lock:
+            counters = self._transactions[(chat_id, token, utc_today())]
+            counters[0] += 1
+            counters[1] += value
+
+    def flush(self):
+        """
+        Add accumulated samples to stored daily counters.
+        """
+        with self._lock:
+            checks, self._checks = self._checks, defaultdict(self._checks.default_factory)
+            transactions, self._transactions = self._transactions, defaultdict(self._transactions.default_factory)
+
+        if not checks and not transactions:
+            return
+
+        with self._flush_lock, db.atomic():
+            for (api_id, service, day), (count, up, hashrate, samples, seconds, up_seconds) in checks.items():
+                updated = ServiceStats.update(
+                    checks=ServiceStats.checks + count,
+                    up=ServiceStats.up + up,
+                    hashrate=ServiceStats.hashrate + hashrate,
+                    hashrate_samples=ServiceStats.hashrate_samples + samples,
+                    seconds=ServiceStats.seconds + seconds,
+                    up_seconds=ServiceStats.up_seconds + up_seconds,
+                ).where((ServiceStats.api == api_id) & (ServiceStats.service == service) &
+                        (ServiceStats.day == day)).execute()
+                if not updated:
+                    try:
+                        with db.atomic():
+                            ServiceStats.create(api=api_id, service=service, day=day, checks=count, up=up,
+                                                hashrate=hashrate, hashrate_samples=samples, seconds=seconds,
+                                                up_seconds=up_seconds)
+                    except peewee.IntegrityError:
+                        # API was removed meanwhile
+                        logger.debug('Cannot store stats of API %d', api_id)
+
+            for (chat_id, token, day), (count, value) in transactions.items():
+                updated = TransactionStats.update(
+                    count=TransactionStats.count + count,
+                    value=TransactionStats.value + value,
+                ).where((TransactionStats.chat == chat_id) & (TransactionStats.token == token) &
+                        (TransactionStats.day == day)).execute()
+                if not updated:
+                    try:
+                        with db.atomic():
+                            TransactionStats.create(chat=chat_id, token=token, day=day, count=count, value=value)
+                    except peewee.IntegrityError:
+                        # Chat was removed meanwhile
+                        logger.debug('Cannot store transaction stats of Chat %d', chat_id)
+
+        logger.debug('Stats stored: %d checks, %d transactions', len(checks), len(transactions))
+
+
+# Shared by every bot served in this process
+recorder = StatsRecorder()
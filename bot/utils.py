@@ -1,5 +1,83 @@
 import datetime
+import importlib
+import json
+import threading
+import time
+from typing import Any, Callable, Optional, Union
+
+JSON_BACKENDS = ('orjson', 'ujson', 'rapidjson', 'json')
+
+ISO_DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 
 
 def humanize_iso_date(d):
-    return datetime.datetime.strptime(d, "%Y-%m-%dT%H:%M:%SZ").strftime("%B %d, %Y %H:%M")
+    return datetime.datetime.strptime(d, ISO_DATE_FORMAT).strftime("%B %d, %Y %H:%M")
+
+
+def stale_text(age: Optional[float]) -> str:
+    """
+    Warning appended to a response built from stale data, given its age in seconds.
+    """
+    if age is None:
+        return ''
+
+    return f'\n\n_API did not respond in time, showing data from {int(age)} seconds ago_'
+
+
+def get_json_loads(backend: str = None) -> Callable[[Union[bytes, str]], Any]:
+    """
+    Returns a JSON decoding function. If no backend is given, the fastest available one is used, falling back to
+    standard library json.
+    """
+    backends = (backend,) if backend else JSON_BACKENDS
+    for name in backends:
+        try:
+            return importlib.import_module(name).loads
+        except ImportError:
+            pass
+
+    return json.loads
+
+
+class Lazy:
+    """
+    Defers building an expensive log argument until the record is actually emitted, possibly in another thread and
+    after the caller moved on, so values it renders must be bound as defaults instead of read from enclosing scope.
+
+    logger.debug('Machines: %s', Lazy(lambda machines=machines: expensive_repr(machines)))
+    """
+    __slots__ = ('func',)
+
+    def __init__(self, func: Callable[[], Any]):
+        self.func = func
+
+    def __str__(self):
+        return str(self.func())
+
+    def __repr__(self):
+        return repr(self.func())
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket. Tokens are refilled continuously at given rate up to capacity.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, tokens: float = 1.0) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+
+            if self._tokens < tokens:
+                return False
+
+            self._tokens -= tokens
+            return True
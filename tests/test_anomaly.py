@@ -0,0 +1,68 @@
+import random
+from array import array
+
+import pytest
+
+from bot.anomaly import HashrateDetector
+from bot.payloads import GraphicCardsHashrate
+
+
+def sample(*hashrates, cards=None):
+    cards = cards if cards is not None else range(len(hashrates))
+    return GraphicCardsHashrate(cards=array('i', cards), hashrates=array('d', hashrates))
+
+
+@pytest.fixture
+def detector():
+    random.seed(0)
+    detector = HashrateDetector(warmup=10)
+    for _ in range(30):
+        assert detector.update('rig', sample(random.gauss(30.0, 0.3), random.gauss(30.0, 0.3))) == ([], [])
+    return detector
+
+
+def test_no_anomalies_while_warming_up():
+    detector = HashrateDetector(warmup=10)
+    for hashrate in [30.0] * 5 + [5.0] * 4:
+        assert detector.update('rig', sample(hashrate)) == ([], [])
+
+
+def test_degraded_card_is_reported_once(detector):
+    detected, recovered = detector.update('rig', sample(30.0, 20.0))
+    assert [(a.card, a.hashrate) for a in detected] == [(1, 20.0)]
+    assert detected[0].baseline == pytest.approx(30.0, abs=0.5)
+    assert recovered == []
+
+    baseline = detector._baselines['rig'].means[1]
+    for _ in range(20):
+        assert detector.update('rig', sample(30.0, 20.0)) == ([], [])
+
+    # Baseline does not learn the degraded hashrate
+    assert detector._baselines['rig'].means[1] == baseline
+
+    detected, recovered = detector.update('rig', sample(30.0, 30.0))
+    assert detected == []
+    assert [(a.card, a.hashrate) for a in recovered] == [(1, 30.0)]
+
+
+def test_deviation_must_exceed_relative_minimum():
+    detector = HashrateDetector(warmup=10)
+    for _ in range(20):
+        detector.update('rig', sample(30.0))
+
+    # Far beyond the standard deviation of a constant hashrate, but within 15% of it
+    assert detector.update('rig', sample(27.0)) == ([], [])
+    assert len(detector.update('rig', sample(25.0))[0]) == 1
+
+
+def test_baselines_reset_when_cards_change(detector):
+    assert detector.update('rig', sample(10.0, 10.0, cards=[0, 2])) == ([], [])
+    assert detector._baselines['rig'].cards == (0, 2)
+    assert detector._baselines['rig'].samples == 1
+
+
+def test_forget(detector):
+    detector.forget('rig')
+    detector.forget('unknown')
+
+    assert 'rig' not in detector._baselines
@@ -0,0 +1,91 @@
+import json
+import time
+
+import pytest
+
+from bot.drafts import DraftStore
+from bot.migrations import migrate
+from bot.models import Draft, configure_db, db
+
+
+@pytest.fixture(autouse=True)
+def database(tmpdir):
+    database = configure_db(f'sqlite+pool:///{tmpdir.join("test.db")}')
+    db.connect()
+    migrate()
+    yield database
+    db.close()
+    database.close_all()
+
+
+def test_update_is_persisted():
+    store = DraftStore()
+    store.update(1, url='http://rig', name='rig')
+    store.update(1, username='user')
+
+    assert store.get(1) == {'url': 'http://rig', 'name': 'rig', 'username': 'user'}
+    # A new store, as after a restart, reads it from database
+    assert DraftStore().get(1) == {'url': 'http://rig', 'name': 'rig', 'username': 'user'}
+
+
+def test_get_returns_copy():
+    store = DraftStore()
+    store.update(1, name='rig')
+    store.get(1)['name'] = 'changed'
+
+    assert store.get(1) == {'name': 'rig'}
+
+
+def test_expired_drafts_are_ignored_and_removed():
+    store = DraftStore(ttl=60.0)
+    store.update(1, name='old')
+    store.set_state((1, 10), 3)
+    store.update(2, name='new')
+    store.set_state((2, 20), 4)
+    Draft.update(updated=time.time() - 120.0).where(Draft.chat == 1).execute()
+
+    assert DraftStore(ttl=60.0).get(1) == {}
+    assert store.states() == {(2, 20): 4}
+    assert store.expire() == {(1, 10): 3}
+    assert [d.chat for d in Draft.select()] == [2]
+    assert store.get(1) == {}
+
+
+def test_least_recently_used_drafts_leave_memory():
+    store = DraftStore(max_size=2)
+    for chat_id in (1, 2, 3):
+        store.update(chat_id, name=f'rig{chat_id}')
+    store.get(2)
+    store.update(4, name='rig4')
+
+    assert list(store._cache) == [2, 4]
+    # Drafts evicted from memory are still read from database
+    assert store.get(1) == {'name': 'rig1'}
+
+
+def test_secret_fields_are_encrypted():
+    pytest.importorskip('cryptography')
+    store = DraftStore()
+    store.set_secret('token')
+    store.update(1, username='user', password='secret', api_password='api secret')
+
+    stored = json.loads(Draft.get(Draft.chat == 1).config)
+    assert stored['username'] == 'user'
+    assert 'secret' not in stored['password'] and 'secret' not in stored['api_password']
+
+    restored = DraftStore()
+    restored.set_secret('token')
+    assert restored.get(1) == {'username': 'user', 'password': 'secret', 'api_password': 'api secret'}
+
+    # Secret fields cannot be read with a different bot token, and are dropped
+    other = DraftStore()
+    other.set_secret('other token')
+    assert other.get(1) == {'username': 'user'}
+
+
+def test_secret_fields_are_not_persisted_without_secret():
+    store = DraftStore()
+    store.update(1, username='user', password='secret')
+
+    assert store.get(1) == {'username': 'user', 'password': 'secret'}
+    assert json.loads(Draft.get(Draft.chat == 1).config) == {'username': 'user'}
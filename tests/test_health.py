@@ -0,0 +1,97 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from types import SimpleNamespace
+
+import pytest
+
+from bot.health import HealthTracker
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=4)
+    yield executor
+    executor.shutdown(wait=False)
+
+
+@pytest.fixture
+def apis():
+    return [SimpleNamespace(url=f'http://rig{i}') for i in range(3)]
+
+
+def test_rank_puts_healthy_and_fast_apis_first(apis):
+    tracker = HealthTracker()
+    tracker.record('http://rig0', 0.5, ok=True)
+    tracker.record('http://rig1', 0.1, ok=True)
+    for _ in range(5):
+        tracker.record('http://rig2', 0.01, ok=False)
+
+    assert [a.url for a in tracker.rank(apis)] == ['http://rig1', 'http://rig0', 'http://rig2']
+
+
+def test_p95(apis):
+    tracker = HealthTracker(window=20)
+    for i in range(1, 21):
+        tracker.record('http://rig0', i / 100, ok=True)
+
+    assert tracker.get('http://rig0').p95 == 0.19
+    assert tracker.hedge_delay('http://rig1') == tracker.default_latency
+
+
+def test_call_hedges_slow_api(apis, executor):
+    tracker = HealthTracker()
+    tracker.record('http://rig0', 0.01, ok=True)
+    tracker.record('http://rig1', 0.02, ok=True)
+    release = threading.Event()
+    calls = []
+
+    def func(api):
+        calls.append(api.url)
+        if api.url == 'http://rig0':
+            release.wait(5)
+        return api.url
+
+    try:
+        assert tracker.call(apis, func, executor) == 'http://rig1'
+    finally:
+        release.set()
+
+    # A single hedged request is sent, third API is not called
+    assert calls == ['http://rig0', 'http://rig1']
+
+
+def test_call_falls_back_on_failure(apis, executor):
+    tracker = HealthTracker()
+
+    def func(api):
+        if api.url != 'http://rig2':
+            raise ConnectionError(api.url)
+        return api.url
+
+    assert tracker.call(apis, func, executor) == 'http://rig2'
+
+
+def test_call_raises_last_error(apis, executor):
+    tracker = HealthTracker()
+
+    def func(api):
+        raise ConnectionError(api.url)
+
+    with pytest.raises(ConnectionError):
+        tracker.call(apis, func, executor)
+
+
+def test_call_timeout(apis, executor):
+    tracker = HealthTracker(default_latency=0.01)
+    release = threading.Event()
+
+    try:
+        with pytest.raises(TimeoutError):
+            tracker.call(apis, lambda api: release.wait(5), executor, timeout=0.1)
+    finally:
+        release.set()
+
+
+def test_call_without_apis(executor):
+    with pytest.raises(IndexError):
+        HealthTracker().call([], lambda api: None, executor)
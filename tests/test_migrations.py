@@ -0,0 +1,78 @@
+import os
+
+import peewee
+import pytest
+
+from bot.migrations import SchemaVersion, migrate, migrations
+from bot.models import API, Chat, Checkpoint, Draft, ServiceStats, TransactionStats, configure_db, db
+
+# Server database used by tests, must be an empty database. Tests using it are skipped if it cannot be reached
+POSTGRESQL_URL = os.environ.get('TEST_DATABASE_URL', 'postgresql+pool://postgres@localhost:5432/barrenero_test')
+
+MODELS = [Chat, API, Draft, ServiceStats, TransactionStats, Checkpoint, SchemaVersion]
+
+
+@pytest.fixture(params=['sqlite', 'postgresql'])
+def database_url(request, tmpdir):
+    if request.param == 'sqlite':
+        return f'sqlite+pool:///{tmpdir.join("test.db")}'
+
+    try:
+        configure_db(POSTGRESQL_URL)
+        db.connect()
+    except peewee.PeeweeException as e:
+        pytest.skip(f'PostgreSQL not available: {e}')
+
+    db.drop_tables(MODELS, safe=True)
+    db.close()
+    return POSTGRESQL_URL
+
+
+@pytest.fixture
+def database(database_url):
+    database = configure_db(database_url)
+    db.connect()
+    yield database
+    db.drop_tables(MODELS, safe=True)
+    db.close()
+    database.close_all()
+
+
+def test_configure_db(database_url):
+    database = configure_db(database_url, max_connections=4)
+
+    assert db.obj is database
+    assert isinstance(database, peewee.SqliteDatabase if database_url.startswith('sqlite') else
+                      peewee.PostgresqlDatabase)
+    assert database._max_connections == 4
+
+    with database.connection_context():
+        assert database.execute_sql('SELECT 1').fetchone()[0] == 1
+        if isinstance(database, peewee.SqliteDatabase):
+            assert database.execute_sql('PRAGMA journal_mode').fetchone()[0] == 'wal'
+            assert database.execute_sql('PRAGMA foreign_keys').fetchone()[0] == 1
+
+    database.close_all()
+
+
+def test_migrate(database):
+    assert migrate() == len(migrations)
+    assert [v.name for v in SchemaVersion.select().order_by(SchemaVersion.version)] == [m.__name__ for m in migrations]
+
+    # Applied migrations are not run again
+    assert migrate() == len(migrations)
+    assert SchemaVersion.select().count() == len(migrations)
+
+
+def test_migrate_legacy_database(database):
+    # Initial schema has no unique index, so legacy databases can hold duplicated APIs
+    assert migrate(1) == 1
+    Chat.insert(id=2 ** 40).execute()
+    API.insert_many([{'name': 'rig', 'url': 'http://rig', 'token': str(i), 'superuser': True, 'chat': 2 ** 40}
+                     for i in range(3)]).execute()
+
+    assert migrate() == len(migrations)
+    assert [a.token for a in API.select()] == ['0']
+
+    with pytest.raises(peewee.IntegrityError), db.atomic():
+        API.create(name='rig', url='http://rig', token='1', superuser=True, chat=2 ** 40)
@@ -0,0 +1,110 @@
+from decimal import Decimal
+
+import pytest
+
+from bot.exceptions import BarreneroResponseException
+from bot.payloads import Ether, Status, Storj, Wallet
+
+ETHER = {
+    'active': True,
+    'hashrate': [{'graphic_card': 0, 'hashrate': 30.5}, {'graphic_card': 1, 'hashrate': 29}],
+    'nanopool': {
+        'balance': {'confirmed': 0.1},
+        'hashrate': {k: 180.0 for k in ('current', 'one_hour', 'three_hours', 'six_hours', 'twelve_hours',
+                                        'twenty_four_hours')},
+        'last_payment': {'date': '2018-01-01T00:00:00Z', 'value': 0.2},
+        'workers': {'rig': 180.0},
+    },
+}
+
+STORJ_NODE = {'id': '0' * 40, 'status': 'running', 'uptime': '1d', 'restarts': 0, 'shared': '100GB',
+              'shared_percent': 50, 'data_received': '1GB', 'peers': 100, 'allocs': 10, 'delta': None,
+              'config_path': '/storj', 'response_time': 10.5, 'reputation': 4000, 'version': '1.0.0'}
+
+WALLET = {
+    'tokens': {'ETH': {'name': 'Ether', 'balance': 1, 'symbol': 'ETH', 'balance_usd': None}},
+    'transactions': [{'hash': '0x1', 'source': '0x0', 'value': 0.01, 'timestamp': '2018-01-01T00:00:00Z',
+                      'token': {'name': 'Ether', 'symbol': 'ETH'}}],
+}
+
+STATUS = {
+    'services': [{'name': 'ether', 'status': 'active'}],
+    'graphics': [{'id': 0, 'power': 120.5, 'fan': 60, 'gpu_usage': 100, 'gpu_clock': 1500, 'mem_usage': 90,
+                  'mem_clock': None}],
+}
+
+
+def replace(data, path, value):
+    """
+    Copy of data with the value at given path of keys and indexes replaced.
+    """
+    if not path:
+        return value
+
+    copy = dict(data) if isinstance(data, dict) else list(data)
+    copy[path[0]] = replace(data[path[0]], path[1:], value)
+    return copy
+
+
+def test_parse():
+    ether = Ether.from_json(ETHER)
+    assert ether.active is True
+    assert list(ether.hashrate) == [(0, 30.5), (1, 29.0)]
+    assert ether.nanopool.workers == {'rig': 180.0}
+
+    storj = Storj.from_json([STORJ_NODE])
+    assert storj.running
+    assert storj.nodes[0].delta is None
+
+    wallet = Wallet.from_json(WALLET)
+    assert wallet.tokens[0].balance == 1
+    assert wallet.transactions[0].token_symbol == 'ETH'
+
+    status = Status.from_json(STATUS)
+    assert status.graphics[0].mem_clock is None
+
+
+def test_parse_streamed():
+    # Streamed responses give an iterator of items, with non integer numbers decoded as Decimal
+    storj = Storj.from_json(iter([{**STORJ_NODE, 'peers': Decimal('100'), 'response_time': Decimal('10.5')}]))
+    assert storj.nodes[0].peers == 100
+    assert storj.nodes[0].response_time == 10.5
+
+    with pytest.raises(BarreneroResponseException):
+        Storj.from_json(iter([{**STORJ_NODE, 'peers': Decimal('100.5')}]))
+
+
+@pytest.mark.parametrize('payload,data,path,value', [
+    (Ether, ETHER, ('active',), 'false'),
+    (Ether, ETHER, ('hashrate',), {'graphic_card': 0}),
+    (Ether, ETHER, ('hashrate', 0, 'hashrate'), '30.5'),
+    (Ether, ETHER, ('nanopool', 'balance', 'confirmed'), '0.1'),
+    (Ether, ETHER, ('nanopool', 'last_payment', 'date'), '01/01/2018'),
+    (Ether, ETHER, ('nanopool', 'workers'), ['rig']),
+    (Storj, [STORJ_NODE], (0, 'peers'), 10.5),
+    (Storj, [STORJ_NODE], (0, 'allocs'), True),
+    (Storj, [STORJ_NODE], (0, 'reputation'), '4000'),
+    (Wallet, WALLET, ('tokens',), []),
+    (Wallet, WALLET, ('tokens', 'ETH', 'symbol'), None),
+    (Wallet, WALLET, ('transactions', 0, 'value'), '0.01'),
+    (Wallet, WALLET, ('transactions', 0, 'token'), None),
+    (Status, STATUS, ('services',), 'ether'),
+    (Status, STATUS, ('services', 0, 'status'), 1),
+    (Status, STATUS, ('graphics', 0, 'fan'), '60 %'),
+])
+def test_parse_malformed(payload, data, path, value):
+    with pytest.raises(BarreneroResponseException):
+        payload.from_json(replace(data, path, value))
+
+
+@pytest.mark.parametrize('payload,data', [(Ether, ETHER), (Storj, [STORJ_NODE]), (Wallet, WALLET), (Status, STATUS)])
+def test_parse_missing_key(payload, data):
+    item = data[0] if isinstance(data, list) else data
+    for key in item:
+        missing = {k: v for k, v in item.items() if k != key}
+        if key == 'nanopool':
+            # Nanopool data is optional
+            continue
+
+        with pytest.raises(BarreneroResponseException):
+            payload.from_json([missing] if isinstance(data, list) else missing)
@@ -0,0 +1,126 @@
+from unittest import mock
+
+import pytest
+import requests
+
+from bot.api import Barrenero, Deadline
+from bot.exceptions import BarreneroDeadlineException, BarreneroRequestException, BarreneroResponseException
+from bot.retry import RetryPolicy
+
+
+def failing(*exceptions, result='ok'):
+    """
+    Function raising given exceptions in successive calls, then returning result.
+    """
+    calls = []
+
+    def func():
+        calls.append(len(calls))
+        if len(calls) <= len(exceptions):
+            raise exceptions[len(calls) - 1]
+        return result
+
+    func.calls = calls
+    return func
+
+
+def request_error(cause: Exception) -> BarreneroRequestException:
+    try:
+        raise BarreneroRequestException('Cannot request Barrenero API') from cause
+    except BarreneroRequestException as e:
+        return e
+
+
+def http_error(status: int) -> BarreneroRequestException:
+    return request_error(requests.HTTPError(response=mock.Mock(status_code=status)))
+
+
+@pytest.fixture
+def policy():
+    return RetryPolicy(retries=2, backoff=0.001, max_backoff=0.002)
+
+
+def test_delays_grow_exponentially_with_full_jitter():
+    policy = RetryPolicy(retries=6, backoff=0.25, max_backoff=4.0)
+
+    with mock.patch('random.uniform', side_effect=lambda low, high: high):
+        assert list(policy.delays()) == [0.25, 0.5, 1.0, 2.0, 4.0, 4.0]
+
+    for _ in range(100):
+        assert all(0 <= d <= min(4.0, 0.25 * 2 ** i) for i, d in enumerate(policy.delays()))
+
+
+@pytest.mark.parametrize('error', [
+    request_error(requests.ConnectionError()),
+    request_error(requests.Timeout()),
+    http_error(503),
+])
+def test_transient_failures_are_retried(policy, error):
+    func = failing(error, error)
+
+    assert policy.call(func) == 'ok'
+    assert len(func.calls) == 3
+    assert policy.stats() == {'attempts': 3, 'retries': 2, 'recovered': 1, 'exhausted': 0, 'not_retried': 0}
+
+
+@pytest.mark.parametrize('error', [
+    http_error(404),
+    BarreneroResponseException('Wrong response from Barrenero API'),
+    BarreneroDeadlineException('Barrenero API did not respond in time'),
+])
+def test_permanent_failures_are_not_retried(policy, error):
+    func = failing(error)
+
+    with pytest.raises(type(error)):
+        policy.call(func)
+    assert len(func.calls) == 1
+
+
+def test_retries_are_exhausted(policy):
+    error = request_error(requests.ConnectionError())
+    func = failing(error, error, error)
+
+    with pytest.raises(BarreneroRequestException):
+        policy.call(func)
+    assert len(func.calls) == 3
+    assert policy.stats()['exhausted'] == 1
+
+
+def test_retry_does_not_exceed_deadline():
+    policy = RetryPolicy(retries=2, backoff=10.0, max_backoff=10.0)
+    error = request_error(requests.ConnectionError())
+    func = failing(error)
+
+    with mock.patch('random.uniform', side_effect=lambda low, high: high), \
+            pytest.raises(BarreneroRequestException):
+        policy.call(func, deadline=Deadline(1.0))
+    assert len(func.calls) == 1
+
+
+def test_non_idempotent_calls_are_not_retried(policy):
+    func = failing(request_error(requests.ConnectionError()))
+
+    with pytest.raises(BarreneroRequestException):
+        policy.call(func, idempotent=False)
+    assert len(func.calls) == 1
+    assert policy.stats()['not_retried'] == 1
+
+
+@pytest.mark.parametrize('idempotency_key,attempts', [(None, 1), ('key', 2)])
+def test_restart_is_retried_only_with_idempotency_key(policy, idempotency_key, attempts):
+    response = mock.MagicMock()
+    response.__enter__.return_value.json.return_value = {'status': 'ok'}
+    session = mock.Mock()
+    session.post.side_effect = [requests.ConnectionError(), response]
+
+    with mock.patch.object(Barrenero, 'session', session), mock.patch.object(Barrenero, 'retry', policy):
+        if idempotency_key is None:
+            with pytest.raises(BarreneroRequestException):
+                Barrenero.restart('http://rig', 'token', 'ether', idempotency_key=idempotency_key)
+        else:
+            assert Barrenero.restart('http://rig', 'token', 'ether', idempotency_key=idempotency_key) == \
+                {'status': 'ok'}
+
+    assert session.post.call_count == attempts
+    for call in session.post.call_args_list:
+        assert call[1]['headers'].get('Idempotency-Key') == idempotency_key
@@ -0,0 +1,100 @@
+import pytest
+
+from bot.state_machine import StatusState, StatusStateMachine
+
+
+class FakeBot:
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.messages.append(text)
+
+
+@pytest.fixture
+def bot():
+    return FakeBot()
+
+
+@pytest.fixture
+def machine():
+    return StatusStateMachine('Ether', 'rig')
+
+
+def observe(machine, bot, *results, **kwargs):
+    for up in results:
+        machine.observe(up, bot, chat=1, **kwargs)
+
+
+def test_status_changes_when_threshold_checks_agree(machine, bot):
+    observe(machine, bot, True, True)
+    assert machine.state == StatusState.INACTIVE.name
+    assert bot.messages == []
+
+    observe(machine, bot, True)
+    assert machine.is_active
+    assert len(bot.messages) == 1
+    assert '*active*' in bot.messages[0]
+
+
+def test_single_failure_is_damped(machine, bot):
+    observe(machine, bot, True, True, True, False, True)
+
+    assert machine.is_active
+    assert len(bot.messages) == 1
+
+
+def test_stop_notifies_reason(machine, bot):
+    observe(machine, bot, True, True, True)
+    observe(machine, bot, False, False, False, reason='Cannot access')
+
+    assert machine.state == StatusState.INACTIVE.name
+    assert len(bot.messages) == 3
+    assert bot.messages[1] == 'Cannot access'
+    assert '*inactive*' in bot.messages[2]
+
+
+def test_flapping_is_notified_once(machine, bot):
+    observe(machine, bot, True, True, True)
+    observe(machine, bot, False, True, False, True, False, True, False)
+
+    assert machine.state == StatusState.FLAPPING.name
+    assert len(bot.messages) == 2
+    assert '*flapping*' in bot.messages[1]
+
+
+def test_flapping_ends_when_stable(machine, bot):
+    observe(machine, bot, True, False, True, False)
+    assert machine.state == StatusState.FLAPPING.name
+
+    # Two agreeing checks are not enough to leave flapping
+    observe(machine, bot, True, True)
+    assert machine.state == StatusState.FLAPPING.name
+
+    observe(machine, bot, True)
+    assert machine.is_active
+    assert '*active*' in bot.messages[-1]
+
+
+def test_conclusive_result_changes_status_at_once(machine, bot):
+    observe(machine, bot, True, count=StatusStateMachine.threshold)
+    assert machine.is_active
+
+    observe(machine, bot, False, count=StatusStateMachine.threshold)
+    assert machine.state == StatusState.INACTIVE.name
+    assert len(bot.messages) == 2
+
+
+def test_load_does_not_notify(machine, bot):
+    observe(machine, bot, True, True, True, False)
+
+    restored = StatusStateMachine('Ether', 'rig')
+    restored.load(machine.dump())
+
+    assert restored.dump() == machine.dump()
+    assert restored.is_active
+
+    # Restored ring keeps damping: one more failure is not enough to stop
+    observe(restored, bot, False)
+    assert restored.is_active
+    assert len(bot.messages) == 1